@@ -1,11 +1,20 @@
 import streamlit as st
-import torch
-from PIL import Image, ImageDraw, ImageFont
 import numpy as np
+import pandas as pd
 import random
-import re
 import hashlib
-from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
+import functools
+import io
+import time
+from image_cache import DiffusionImageCache
+from generation_jobs import GenerationJob, GenerationJobQueue
+from diffusion_startup import DEFAULT_MODEL_ID, DiffusionStartup, detect_device, load_pipeline, warm_up
+from step_budget import DEFAULT_LATENCY_BUDGET, StepBudgetPlanner, StepTimer, apply_solver_order
+from card_art import ART_SIZES, DEFAULT_ART_SIZE, apply_art_size
+from card_composition import compose_detailed_card
+from prompt_parser import PROMPT_PARSER
+from card_index import NEAR_COPY_DISTANCE, CardIndex
+from generation_metrics import GenerationMetrics
 
 st.set_page_config(
     page_title="Generador de Cartas Clash Royale IA",
@@ -13,183 +22,10 @@ st.set_page_config(
     layout="wide"
 )
 
-def extract_exact_numbers_from_prompt(prompt):
-    """Extrae EXACTAMENTE los números que especifica el usuario"""
-    prompt_lower = prompt.lower()
-    extracted = {'cost': None, 'damage': None, 'health': None, 'duration': None}
-    
-    # Patrones para coste
-    cost_patterns = [
-        r'(?:cueste?|coste?|cost[eo]?|elixir)\s*(?:de)?\s*(\d+)',
-        r'(\d+)\s*(?:de\s*)?(?:elixir|coste?|cost[eo]?)',
-        r'(?:que\s*)?(?:cueste?|valga)\s*(\d+)',
-        r'de\s*(\d+)\s*elixir'
-    ]
-    
-    # Patrones para daño
-    damage_patterns = [
-        r'(\d+)\s*(?:de\s*)?(?:daño|damage|ataque|attack)',
-        r'(?:daño|damage|ataque|attack)\s*(?:de)?\s*(\d+)',
-        r'(?:que\s*)?(?:haga|cause|tenga)\s*(\d+)\s*(?:de\s*)?(?:daño|damage|ataque)',
-        r'con\s*(\d+)\s*(?:de\s*)?(?:daño|ataque)'
-    ]
-    
-    # Patrones para vida
-    health_patterns = [
-        r'(\d+)\s*(?:de\s*)?(?:vida|health|hp|salud|resistencia)',
-        r'(?:vida|health|hp|salud|resistencia)\s*(?:de)?\s*(\d+)',
-        r'(?:que\s*)?(?:tenga|posea)\s*(\d+)\s*(?:de\s*)?(?:vida|health|hp)',
-        r'y\s*(\d+)\s*(?:de\s*)?(?:vida|health)'
-    ]
-    
-    # Patrones para duración
-    duration_patterns = [
-        r'duracion\s*(?:de)?\s*(\d+)\s*(?:segundos?|segs?|s)',
-        r'dure\s*(\d+)\s*(?:segundos?|segs?|s)',
-        r'(\d+)\s*segundos?\s*(?:de\s*)?(?:duracion|efecto|tiempo)',
-        r'(?:por|durante)\s*(\d+)\s*(?:segundos?|segs?|s)',
-        r'efecto\s*(?:de)?\s*(\d+)\s*(?:segundos?|segs?|s)',
-        r'con\s*duracion\s*(?:de)?\s*(\d+)\s*(?:segundos?|segs?|s)',
-        r'que\s*dure\s*(\d+)\s*(?:segundos?|segs?|s)'
-    ]
-    
-    # Extraer números exactos
-    for pattern in cost_patterns:
-        match = re.search(pattern, prompt_lower)
-        if match:
-            extracted['cost'] = int(match.group(1))
-            break
-    
-    for pattern in damage_patterns:
-        match = re.search(pattern, prompt_lower)
-        if match:
-            extracted['damage'] = int(match.group(1))
-            break
-    
-    for pattern in health_patterns:
-        match = re.search(pattern, prompt_lower)
-        if match:
-            extracted['health'] = int(match.group(1))
-            break
-    
-    for pattern in duration_patterns:
-        match = re.search(pattern, prompt_lower)
-        if match:
-            extracted['duration'] = int(match.group(1))
-            break
-    
-    return extracted
-
-def detect_character_and_type(prompt):
-    """Detecta el personaje específico y tipo de carta"""
-    prompt_lower = prompt.lower()
-    
-    # Personajes específicos con info completa
-    characters = {
-        'golem': {'type': 'Troops and Defenses', 'base_cost': 8, 'character': 'Golem', 'base_duration': 0},
-        'gigante': {'type': 'Troops and Defenses', 'base_cost': 5, 'character': 'Gigante', 'base_duration': 0},
-        'caballero': {'type': 'Troops and Defenses', 'base_cost': 3, 'character': 'Caballero', 'base_duration': 0},
-        'arquero': {'type': 'Troops and Defenses', 'base_cost': 3, 'character': 'Arquero', 'base_duration': 0},
-        'dragon': {'type': 'Troops and Defenses', 'base_cost': 4, 'character': 'Dragón', 'base_duration': 0},
-        'mago': {'type': 'Troops and Defenses', 'base_cost': 5, 'character': 'Mago', 'base_duration': 0},
-        
-        # Hechizos específicos
-        'hechizo': {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Hechizo', 'base_duration': 3},
-        'rayo': {'type': 'Damaging Spells', 'base_cost': 6, 'character': 'Rayo', 'base_duration': 1},
-        'bola de fuego': {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Bola de Fuego', 'base_duration': 2},
-        'flecha': {'type': 'Damaging Spells', 'base_cost': 3, 'character': 'Flechas', 'base_duration': 1},
-        'veneno': {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Veneno', 'base_duration': 8},
-        'ralentizar': {'type': 'Damaging Spells', 'base_cost': 2, 'character': 'Ralentizar', 'base_duration': 5},
-        'congelar': {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Congelar', 'base_duration': 4},
-        
-        # Edificios
-        'torre': {'type': 'Spawners', 'base_cost': 4, 'character': 'Torre', 'base_duration': 0},
-        'cañon': {'type': 'Spawners', 'base_cost': 3, 'character': 'Cañón', 'base_duration': 0},
-        'mortero': {'type': 'Spawners', 'base_cost': 4, 'character': 'Mortero', 'base_duration': 0},
-    }
-    
-    for keyword, info in characters.items():
-        if keyword in prompt_lower:
-            return info
-    
-    # Detección por tipo general
-    if any(word in prompt_lower for word in ['hechizo', 'spell', 'magia', 'conjuro']):
-        return {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Hechizo', 'base_duration': 3}
-    elif any(word in prompt_lower for word in ['edificio', 'torre', 'defensa', 'spawner']):
-        return {'type': 'Spawners', 'base_cost': 4, 'character': 'Torre', 'base_duration': 0}
-    else:
-        return {'type': 'Troops and Defenses', 'base_cost': 4, 'character': 'Guerrero', 'base_duration': 0}
-
-def detect_elements(prompt):
-    """Detecta elementos mágicos específicos"""
-    prompt_lower = prompt.lower()
-    elements = []
-    
-    if any(word in prompt_lower for word in ['hielo', 'nieve', 'congelar', 'frio']):
-        elements.append('hielo')
-    if any(word in prompt_lower for word in ['fuego', 'llama', 'quemar', 'ardiente']):
-        elements.append('fuego')
-    if any(word in prompt_lower for word in ['rayo', 'electrico', 'trueno']):
-        elements.append('electrico')
-    if any(word in prompt_lower for word in ['veneno', 'toxico']):
-        elements.append('veneno')
-    
-    return elements
-
 def parse_user_prompt_precisely(prompt):
     """Parser que RESPETA EXACTAMENTE el prompt del usuario"""
-    # Extraer números específicos del usuario
-    numbers = extract_exact_numbers_from_prompt(prompt)
-    
-    # Detectar personaje y tipo
-    char_info = detect_character_and_type(prompt)
-    
-    # Detectar elementos mágicos
-    elements = detect_elements(prompt)
-    
-    # USAR EXACTAMENTE los números especificados por el usuario
-    cost = numbers['cost']
-    damage = numbers['damage']
-    health = numbers['health']
-    duration = numbers['duration']
-    
-    # Solo usar valores por defecto si NO fueron especificados por el usuario
-    if cost is None:
-        cost = char_info['base_cost']
-    
-    if damage is None and char_info['type'] != 'Spawners':
-        if char_info['type'] == 'Damaging Spells':
-            damage = cost * 70
-        else:
-            damage = cost * 50
-    elif damage is None:
-        damage = 0
-    
-    if health is None and char_info['type'] != 'Damaging Spells':
-        if char_info['type'] == 'Spawners':
-            health = cost * 300
-        else:
-            health = cost * 150
-    elif health is None:
-        health = 0
-    
-    # Duración solo para hechizos
-    if char_info['type'] == 'Damaging Spells':
-        if duration is None:
-            duration = char_info.get('base_duration', 3)
-    else:
-        duration = 0
-    
-    return {
-        'Cost': cost,
-        'Damage': damage,
-        'Health (+Shield)': health,
-        'Duration': duration,
-        'Type': char_info['type'],
-        'Character': char_info['character'],
-        'Elements': elements,
-        'original_prompt': prompt
-    }
+    # Patrones y palabras clave precompilados en prompt_parser
+    return PROMPT_PARSER.parse(prompt)
 
 def generate_precise_narrative(card_data):
     """Genera narrativa que coincide EXACTAMENTE con el prompt"""
@@ -289,26 +125,80 @@ def generate_precise_card_name(card_data):
     
     return ' '.join(name_parts)
 
+@st.cache_resource
+def get_image_cache():
+    """Caché de imágenes compartida por todas las sesiones"""
+    return DiffusionImageCache()
+
+@st.cache_resource
+def get_prompt_embeddings(model_id, _pipeline):
+    """Embeddings CLIP memorizados por proceso y persistidos en disco"""
+    from prompt_embeddings import PromptEmbeddingCache
+    return PromptEmbeddingCache(_pipeline, model_id=model_id)
+
+@st.cache_resource
+def get_job_queue():
+    """Cola de generación compartida: un único trabajador para no saturar la CPU"""
+    return GenerationJobQueue(num_workers=1)
+
+@st.cache_resource
+def get_card_index():
+    """Índice de cartas reales para buscar la más parecida a cada carta generada"""
+    return CardIndex.from_csv()
+
+@st.cache_resource
+def get_step_planner():
+    """Planificador de pasos con los tiempos medidos en este host"""
+    return StepBudgetPlanner()
+
+@st.cache_resource
+def get_generation_metrics():
+    """Tiempos por etapa, memoria y parámetros medidos en este proceso"""
+    return GenerationMetrics()
+
 class StableDiffusionCardGenerator:
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.pipeline = None
+        self.image_cache = get_image_cache()
 
-    @st.cache_resource(show_spinner="Cargando modelo de difusión...")
-    def setup_stable_diffusion(_self, model_id="runwayml/stable-diffusion-v1-5"):
-        try:
-            pipeline = StableDiffusionPipeline.from_pretrained(
-                model_id,
-                torch_dtype=torch.float16 if _self.device == "cuda" else torch.float32,
-                safety_checker=None,
-                requires_safety_checker=False,
-            )
-            pipeline.scheduler = DPMSolverMultistepScheduler.from_config(pipeline.scheduler.config)
-            pipeline = pipeline.to(_self.device)
-            return pipeline
-        except Exception as e:
-            st.warning(f"No se pudo cargar Stable Diffusion: {e}")
-            return None
+    @property
+    def device(self):
+        # torch se importa la primera vez que se pregunta, no al cargar la app
+        return detect_device()
+
+    def setup_stable_diffusion(self, startup, model_id=DEFAULT_MODEL_ID, profile=None, backend=None):
+        """Carga el pipeline (snapshot local) y le aplica perfil, backend y embeddings; corre en el hilo de arranque"""
+        with startup.phase('import'):
+            from inference_profiles import DEFAULT_PROFILE, apply_cpu_fast_profile
+            from onnx_backend import DEFAULT_BACKEND, OnnxStableDiffusionBackend
+        profile = profile or DEFAULT_PROFILE
+        backend = backend or DEFAULT_BACKEND
+
+        pipeline = load_pipeline(model_id, self.device, startup)
+        with startup.phase('setup'):
+            # Parámetros contados en los módulos torch, antes de un posible backend ONNX
+            get_generation_metrics().record_parameters(pipeline)
+            # Perfil optimizado para servidores sin GPU
+            use_onnx = backend == 'onnx' and self.device == "cpu"
+            if profile == 'cpu-fast' and self.device == "cpu" and not use_onnx:
+                apply_cpu_fast_profile(pipeline)
+            # Backend ONNX Runtime: exportación cacheada en disco y validada contra PyTorch
+            if use_onnx:
+                try:
+                    pipeline = OnnxStableDiffusionBackend(pipeline)
+                except Exception as e:
+                    startup.warn(f"Backend ONNX no disponible, se usa PyTorch: {e}")
+            # El embedding incondicional (negative_prompt) se calcula una vez al cargar
+            get_prompt_embeddings(model_id, pipeline).warm([self.generate_precise_diffusion_prompt({})])
+        return pipeline
+
+    def warm_up_pipeline(self, pipeline):
+        """Inferencia corta con el prompt por defecto en el formato de arte por defecto"""
+        prompt_data = self.generate_precise_diffusion_prompt({})
+        params = apply_art_size(prompt_data['generation_params'], DEFAULT_ART_SIZE)
+        model_id = getattr(pipeline, 'name_or_path', None) or DEFAULT_MODEL_ID
+        prompt_embeds, negative_prompt_embeds = get_prompt_embeddings(model_id, pipeline).get(prompt_data)
+        warm_up(pipeline, params['width'], params['height'], prompt_embeds, negative_prompt_embeds)
 
     def generate_precise_diffusion_prompt(self, card_data):
         """Genera prompt que coincide EXACTAMENTE con la descripción del usuario"""
@@ -364,198 +254,111 @@ class StableDiffusionCardGenerator:
             }
         }
 
-    def generate_image_with_diffusion(self, prompt_data, pipeline):
+    def generate_image_with_diffusion(self, prompt_data, pipeline, callback=None):
         """Genera imagen con Stable Diffusion"""
-        try:
-            params = prompt_data['generation_params']
-            prompt_hash = hashlib.md5(prompt_data['prompt'].encode()).hexdigest()
-            seed = int(prompt_hash[:8], 16) % 1000000
-            generator = torch.Generator(device=self.device).manual_seed(seed)
-            
-            with torch.inference_mode():
-                result = pipeline(
-                    prompt=prompt_data['prompt'],
-                    negative_prompt=prompt_data['negative_prompt'],
-                    num_inference_steps=params['num_inference_steps'],
-                    guidance_scale=params['guidance_scale'],
-                    width=params['width'],
-                    height=params['height'],
-                    generator=generator
-                )
-            
-            return result.images[0]
-        except Exception as e:
-            st.error(f"Error generando imagen: {e}")
-            return None
+        import torch
+        from inference_profiles import inference_context
+        # Corre en el hilo de la cola, sin contexto de Streamlit: los errores llegan a la UI como job.error
+        params = prompt_data['generation_params']
+        prompt_hash = hashlib.md5(prompt_data['prompt'].encode()).hexdigest()
+        seed = int(prompt_hash[:8], 16) % 1000000
+        
+        # La imagen es función pura de (modelo, prompts, parámetros, semilla)
+        model_id = getattr(pipeline, 'name_or_path', None) or DEFAULT_MODEL_ID
+        profile_report = getattr(pipeline, 'inference_profile', None)
+        variant = f"{self.device}:{profile_report['profile'] if profile_report else 'default'}"
+        cache_key = self.image_cache.make_key(model_id, prompt_data, seed, variant=variant)
+        cached_image = self.image_cache.get(cache_key)
+        if cached_image is not None:
+            return cached_image
+        
+        generator = torch.Generator(device=self.device).manual_seed(seed)
+        
+        # Texto ya codificado: sin tokenizar ni pasar por CLIP en cada petición
+        metrics = get_generation_metrics()
+        with metrics.stage('text_encode'):
+            prompt_embeds, negative_prompt_embeds = get_prompt_embeddings(model_id, pipeline).get(prompt_data)
+        
+        # Orden del solver elegido por el presupuesto de latencia (2 por defecto)
+        apply_solver_order(pipeline, params.get('solver_order', 2))
+        
+        # Progreso y cancelación por paso (cola de trabajos) + tiempos por paso de este host
+        timer = StepTimer(callback)
+        timer.start()
+        
+        with torch.inference_mode(), inference_context(profile_report):
+            result = pipeline(
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                num_inference_steps=params['num_inference_steps'],
+                guidance_scale=params['guidance_scale'],
+                width=params['width'],
+                height=params['height'],
+                generator=generator,
+                callback_on_step_end=timer
+            )
+        
+        # Pasos de la UNet y decodificación VAE con los instantes anotados por el timer
+        metrics.record_steps(timer, time.perf_counter())
+        metrics.sample_memory()
+        get_step_planner().record(pipeline, params, timer)
+        image = result.images[0]
+        self.image_cache.put(cache_key, image)
+        return image
 
     def create_card_composition(self, image, card_data, card_name):
         """Crea composición de carta con duración para hechizos"""
-        card_width, card_height = 600, 800
-        canvas = Image.new('RGB', (card_width, card_height), color='#1a1a1a')
-        draw = ImageDraw.Draw(canvas)
-        
-        cost = int(card_data.get('Cost', 3))
-        damage = int(card_data.get('Damage', 100))
-        health = int(card_data.get('Health (+Shield)', 100))
-        duration = int(card_data.get('Duration', 0))
-        card_type = card_data.get('Type', 'Troops and Defenses')
-        
-        # Colores por rareza
-        if cost <= 2:
-            scheme = {'border': '#C0C0C0', 'bg': '#E8E8E8', 'rarity': 'COMÚN', 'cost_bg': '#4A90E2'}
-        elif cost <= 4:
-            scheme = {'border': '#FF8C00', 'bg': '#FFE4B5', 'rarity': 'RARO', 'cost_bg': '#FF6B35'}
-        elif cost <= 6:
-            scheme = {'border': '#9932CC', 'bg': '#E6E6FA', 'rarity': 'ÉPICO', 'cost_bg': '#8E44AD'}
-        else:
-            scheme = {'border': '#FFD700', 'bg': '#FFF8DC', 'rarity': 'LEGENDARIO', 'cost_bg': '#F39C12'}
-        
-        # Fondo principal
-        draw.rounded_rectangle(
-            [(15, 15), (card_width-15, card_height-15)],
-            radius=25, fill=scheme['bg'], outline=scheme['border'], width=6
-        )
-        
-        # Círculo de coste
-        self._draw_cost_circle(draw, cost, scheme)
-        
-        # Área de imagen
-        if image:
-            self._draw_image_area(draw, card_width, image, scheme)
-        
-        # Información completa de la carta
-        self._draw_card_info_complete(draw, card_width, card_height, card_data, card_name, scheme)
-        
-        return canvas
-    
-    def _draw_cost_circle(self, draw, cost, scheme):
-        """Dibuja círculo de coste"""
-        cost_center = (75, 75)
-        cost_radius = 40
-        
-        draw.ellipse([
-            cost_center[0]-cost_radius-4, cost_center[1]-cost_radius-4,
-            cost_center[0]+cost_radius+4, cost_center[1]+cost_radius+4
-        ], fill='white', outline=scheme['border'], width=3)
-        draw.ellipse([
-            cost_center[0]-cost_radius, cost_center[1]-cost_radius,
-            cost_center[0]+cost_radius, cost_center[1]+cost_radius
-        ], fill=scheme['cost_bg'], outline='white', width=2)
-        
-        try:
-            font_cost = ImageFont.truetype("arial.ttf", 32)
-        except:
-            font_cost = ImageFont.load_default()
-        
-        cost_text = str(cost)
-        bbox = draw.textbbox((0, 0), cost_text, font=font_cost)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        draw.text((cost_center[0] - text_width//2, cost_center[1] - text_height//2), 
-                 cost_text, fill='white', font=font_cost)
-    
-    def _draw_image_area(self, draw, width, image, scheme):
-        """Dibuja área de imagen"""
-        image_area = [(40, 120), (width-40, 420)]
-        draw.rounded_rectangle(image_area, radius=20, fill='#2C3E50', outline=scheme['border'], width=4)
-        
-        if image:
-            image_resized = image.resize((520, 290), Image.Resampling.LANCZOS)
-            return (45, 125, image_resized)
-        return None
-    
-    def _draw_card_info_complete(self, draw, width, height, card_data, card_name, scheme):
-        """Dibuja información completa incluyendo duración para hechizos"""
-        try:
-            font_title = ImageFont.truetype("arial.ttf", 18)
-            font_stats = ImageFont.truetype("arial.ttf", 16)
-            font_desc = ImageFont.truetype("arial.ttf", 11)
-        except:
-            font_title = font_stats = font_desc = ImageFont.load_default()
-        
-        # Área de información
-        info_area = [(40, 440), (width-40, height-20)]
-        draw.rounded_rectangle(info_area, radius=15, fill='#34495E', outline=scheme['border'], width=3)
-        
-        # Título y rareza
-        title_y = 460
-        draw.text((60, title_y), card_name, fill='white', font=font_title)
-        draw.text((width-120, title_y), scheme['rarity'], fill=scheme['border'], font=font_stats)
-        
-        # Tipo de carta
-        type_y = title_y + 25
-        type_mapping = {
-            'Troops and Defenses': 'TROPA',
-            'Damaging Spells': 'HECHIZO',
-            'Spawners': 'EDIFICIO'
-        }
-        card_type_display = type_mapping.get(card_data['Type'], 'TROPA')
-        draw.text((60, type_y), card_type_display, fill='#3498DB', font=font_stats)
-        
-        # Estadísticas con duración 
-        stats_y = 510
-        self._draw_card_stats_with_exact_duration(draw, card_data, stats_y, font_stats)
-        
-        # Narrativa completa
-        desc_y = stats_y + 35
-        narrative = card_data.get('Narrative', '')
-        self._draw_complete_text(draw, narrative, 60, desc_y, width-120, font_desc, '#BDC3C7')
-    
-    def _draw_card_stats_with_exact_duration(self, draw, card_data, y, font):
-        """Dibuja estadísticas incluyendo duración para hechizos"""
-        card_type = card_data.get('Type', 'Troops and Defenses')
-        duration = int(card_data.get('Duration', 0))
-        
-        if card_type == 'Damaging Spells':
-            # Para hechizos: DAÑO y DURACIÓN 
-            draw.text((60, y), "DAÑO", fill='#E74C3C', font=font)
-            draw.text((150, y), str(card_data.get('Damage', 0)), fill='white', font=font)
-            draw.text((250, y), "DURACIÓN", fill='#F39C12', font=font)
-            if duration == 1:
-                draw.text((360, y), "Instant.", fill='white', font=font)
-            else:
-                draw.text((360, y), f"{duration}s", fill='white', font=font)
-        elif card_type == 'Spawners':
-            draw.text((60, y), "VIDA", fill='#27AE60', font=font)
-            draw.text((150, y), str(card_data.get('Health (+Shield)', 0)), fill='white', font=font)
-        else:
-            draw.text((60, y), "DAÑO", fill='#E74C3C', font=font)
-            draw.text((140, y), str(card_data.get('Damage', 0)), fill='white', font=font)
-            draw.text((220, y), "VIDA", fill='#27AE60', font=font)
-            draw.text((300, y), str(card_data.get('Health (+Shield)', 0)), fill='white', font=font)
-    
-    def _draw_complete_text(self, draw, text, x, y, max_width, font, color):
-        """Dibuja texto completo con wrapping mejorado"""
-        words = text.split()
-        lines = []
-        current_line = ""
-        
-        for word in words:
-            test_line = current_line + word + " " if current_line else word + " "
-            bbox = draw.textbbox((0, 0), test_line, font=font)
-            text_width = bbox[2] - bbox[0]
-            
-            if text_width <= max_width - 20:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line.strip())
-                current_line = word + " "
-        
-        if current_line:
-            lines.append(current_line.strip())
-        
-        # Dibujar todas las líneas
-        line_height = 15
-        max_lines = min(len(lines), 8)
-        
-        for i, line in enumerate(lines[:max_lines]):
-            draw.text((x, y + i * line_height), line, fill=color, font=font)
-        
-        if len(lines) > max_lines:
-            draw.text((x, y + max_lines * line_height), "...", fill=color, font=font)
+        # Marco precalculado por rareza x tipo; solo se dibuja el contenido de la carta
+        with get_generation_metrics().stage('composition'):
+            return compose_detailed_card(image, card_data, card_name)
+
+@st.cache_resource
+def get_diffusion_startup():
+    """Carga del modelo de difusión en segundo plano desde que arranca el proceso"""
+    generator = StableDiffusionCardGenerator()
+    return DiffusionStartup(generator.setup_stable_diffusion, warmup=generator.warm_up_pipeline)
+
+def render_card_job(generator, pipeline, prompt_data, card_data, card_name, job):
+    """Trabajo en segundo plano: difusión, composición y PNG de la carta final (bytes)"""
+    image = generator.generate_image_with_diffusion(prompt_data, pipeline, callback=job.step_callback)
+    if image is None:
+        raise RuntimeError("Error generando la imagen")
+    job.check_cancelled()
+    
+    card_img = generator.create_card_composition(image, card_data, card_name)
+    # Una sola codificación por carta: la vista y la descarga usan los mismos bytes en cada rerun
+    img_buffer = io.BytesIO()
+    with get_generation_metrics().stage('png_encode'):
+        card_img.save(img_buffer, format='PNG')
+    return img_buffer.getvalue()
+
+def render_perf_panel(metrics):
+    """Tabla de tiempos por etapa, memoria, parámetros y descargas de las métricas"""
+    summary = metrics.summary()
+    if not summary:
+        st.caption("Aún no hay generaciones medidas.")
+        return
+    st.dataframe(pd.DataFrame.from_dict(summary, orient='index'), use_container_width=True)
+    
+    memory = metrics.sample_memory()
+    if 'peak_rss_bytes' in memory:
+        st.caption(f"Pico de memoria residente: {memory['peak_rss_bytes'] / 1024**3:.2f} GB")
+    if 'cuda_peak_allocated_bytes' in memory:
+        st.caption(f"Pico de VRAM asignada: {memory['cuda_peak_allocated_bytes'] / 1024**3:.2f} GB")
+    if metrics.parameters:
+        st.caption("Parámetros: " + ", ".join(
+            f"{module} {count / 1e6:.0f}M" for module, count in metrics.parameters.items()
+        ))
+    
+    st.download_button("Métricas (JSON lines)", metrics.to_json_lines(), file_name="generation_metrics.jsonl",
+                       mime="application/x-ndjson")
+    st.download_button("Métricas (Prometheus)", metrics.to_prometheus(), file_name="generation_metrics.prom",
+                       mime="text/plain")
 
 def main():
+    # El modelo de difusión se empieza a cargar en segundo plano al abrir la app
+    startup = get_diffusion_startup()
+    
     # Header
     st.markdown("""
     <style>
@@ -600,6 +403,43 @@ def main():
         - "efecto de 3 segundos"
         - "por 8 segundos"
         """)
+        
+        # Vista previa aproximada de los latentes cada pocos pasos
+        show_previews = st.checkbox("👁️ Vista previa durante la generación", value=True)
+        
+        # Formato de la ilustración: "native" genera ya apaisada para el hueco de arte
+        art_size = st.selectbox(
+            "🖼️ Formato de la ilustración",
+            list(ART_SIZES),
+            index=list(ART_SIZES).index(DEFAULT_ART_SIZE) if DEFAULT_ART_SIZE in ART_SIZES else 0,
+            help="native: 576x320, casi la proporción del hueco de la carta y la mitad de cómputo que 512x640"
+        )
+        
+        # Presupuesto de latencia: los pasos se eligen con los tiempos medidos en este host
+        latency_budget = st.number_input(
+            "⏱️ Presupuesto de tiempo (segundos)",
+            min_value=0.0,
+            value=DEFAULT_LATENCY_BUDGET,
+            step=1.0,
+            help="0 = pasos fijos. Si el presupuesto es muy justo se genera un borrador rápido."
+        )
+        
+        # Segundos por paso medidos al aplicar el perfil de inferencia
+        profile_report = st.session_state.get('profile_report')
+        if profile_report and 'seconds_per_step_after' in profile_report:
+            st.caption(
+                f"⚙️ Perfil {profile_report['profile']}: "
+                f"{profile_report['seconds_per_step_before']:.2f}s/paso → "
+                f"{profile_report['seconds_per_step_after']:.2f}s/paso"
+            )
+        
+        # Tiempo de cada fase del arranque del modelo de difusión
+        if startup.ready and startup.pipeline is not None:
+            st.caption(f"🚀 Arranque del modelo: {startup.summary()}")
+        
+        # Métricas medidas por etapa, exportables para Prometheus o como JSON lines
+        with st.expander("📊 Rendimiento"):
+            render_perf_panel(get_generation_metrics())
     
     # Área principal
     st.subheader("🎯 Describe tu carta con números específicos")
@@ -609,12 +449,23 @@ def main():
         placeholder="Ejemplo: 'Golem de hielo con 400 de daño y 200 de vida' o 'Hechizo de fuego que cueste 4 elixir, cause 350 de daño y dure 4 segundos'"
     )
     
+    job_queue = get_job_queue()
+    
+    # Si el usuario cambia la descripción, la generación en curso ya no sirve
+    active_job_id = st.session_state.get('job_id')
+    if active_job_id and st.session_state.get('job_prompt') != user_prompt:
+        job_queue.cancel(active_job_id)
+    
     # Botón principal
     if st.button("Generar Carta", type="primary", use_container_width=True):
         if not user_prompt.strip():
             st.warning("Por favor, describe la carta que deseas crear con números específicos.")
             return
         
+        # Un segundo clic sustituye al trabajo anterior en vez de duplicarlo
+        if active_job_id:
+            job_queue.cancel(active_job_id)
+        
         with st.spinner("Analizando tu descripción exacta..."):
             # Parser que RESPETA el prompt
             card_data = parse_user_prompt_precisely(user_prompt)
@@ -625,85 +476,136 @@ def main():
             narrative = generate_precise_narrative(card_data)
             card_data['Narrative'] = narrative
         
-        # Mostrar resultados
-        st.success("¡Carta generada exitosamente")
-        
-        # Información de la carta
-        if card_data['Type'] == 'Damaging Spells':
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("💎 Coste", f"{card_data['Cost']} elixir")
-            with col2:
-                st.metric("⚔️ Daño", card_data['Damage'])
-            with col3:
-                st.metric("🛡️ Vida", card_data['Health (+Shield)'])
-            with col4:
-                duration = card_data['Duration']
-                if duration == 1:
-                    st.metric("⏱️ Duración", "Instant.")
-                else:
-                    st.metric("⏱️ Duración", f"{duration}s")
-        else:
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("💎 Coste", f"{card_data['Cost']} elixir")
-                st.metric("⚔️ Daño", card_data['Damage'])
-            with col2:
-                st.metric("🛡️ Vida", card_data['Health (+Shield)'])
-                type_display = {
-                    'Troops and Defenses': '🛡️ Tropa',
-                    'Damaging Spells': '⚡ Hechizo',
-                    'Spawners': '🏗️ Edificio'
-                }
-                st.metric("🎭 Tipo", type_display.get(card_data['Type'], '🛡️ Tropa'))
-            with col3:
-                cost = card_data['Cost']
-                rarity = "⚪ COMÚN" if cost <= 2 else "🟠 RARO" if cost <= 4 else "🟣 ÉPICO" if cost <= 6 else "🟡 LEGENDARIO"
-                st.metric("⭐ Rareza", rarity)
-        
-        # Nombre y narrativa
-        st.subheader(f"🏆 {card_name}")
-        st.info(card_data['Narrative'])
-        
-        # Generación de imagen
+        st.session_state['card_data'] = card_data
+        st.session_state['card_name'] = card_name
+        # Carta real más parecida según coste, daño y vida
+        stats = pd.DataFrame([{key: card_data[key] for key in ('Cost', 'Damage', 'Health (+Shield)')}])
+        nearest = get_card_index().nearest(stats, k=1).iloc[0]
+        st.session_state['nearest_card'] = (nearest['nearest_1'], float(nearest['distance_1']))
+        st.session_state['job_prompt'] = user_prompt
+        st.session_state['job_id'] = None
+        st.session_state['card_png'] = None
+        
+        # Generación de imagen en segundo plano
         generator = StableDiffusionCardGenerator()
         
         with st.spinner("🎨 Cargando modelo de generación..."):
-            pipeline = generator.setup_stable_diffusion()
+            pipeline = startup.get()
+        if startup.error:
+            st.warning(f"No se pudo cargar Stable Diffusion: {startup.error}")
+        for warning in startup.warnings:
+            st.warning(warning)
         
         if pipeline:
-            with st.spinner("🖼️ Creando imagen que coincide con tu descripción..."):
-                prompt_data = generator.generate_precise_diffusion_prompt(card_data)
-                image = generator.generate_image_with_diffusion(prompt_data, pipeline)
-                
-                if image:
-                    with st.spinner("🎴 Componiendo carta final..."):
-                        card_img = generator.create_card_composition(image, card_data, card_name)
-                        # Pegar la imagen
-                        image_info = generator._draw_image_area(ImageDraw.Draw(card_img), 600, image, {'border': '#FFD700'})
-                        if image_info:
-                            card_img.paste(image_info[2], (image_info[0], image_info[1]))
-                    
-                    st.subheader("🏆 Tu carta personalizada")
-                    st.image(card_img, caption=f"Carta: {card_name}", use_container_width=True)
-                    
-                    # Descarga
-                    import io
-                    img_buffer = io.BytesIO()
-                    card_img.save(img_buffer, format='PNG')
-                    img_buffer.seek(0)
-                    
-                    st.download_button(
-                        label="Descargar carta completa",
-                        data=img_buffer.getvalue(),
-                        file_name=f"carta_{card_name.replace(' ', '_').lower()}.png",
-                        mime="image/png",
-                        use_container_width=True
-                    )
-                else:
-                    st.error("❌ Error generando la imagen.")
+            from latent_preview import LatentPreviewer
+            prompt_data = generator.generate_precise_diffusion_prompt(card_data)
+            prompt_data['generation_params'] = get_step_planner().plan(
+                pipeline, apply_art_size(prompt_data['generation_params'], art_size), latency_budget
+            )
+            st.session_state['draft'] = prompt_data['generation_params'].get('draft', False)
+            st.session_state['job_id'] = job_queue.submit(
+                functools.partial(render_card_job, generator, pipeline, prompt_data, card_data, card_name),
+                total_steps=prompt_data['generation_params']['num_inference_steps'],
+                previewer=LatentPreviewer(every_n_steps=5) if show_previews else None
+            )
+        st.session_state['model_unavailable'] = not pipeline
+        st.session_state['profile_report'] = getattr(pipeline, 'inference_profile', None)
+    
+    card_data = st.session_state.get('card_data')
+    if card_data is None:
+        return
+    card_name = st.session_state['card_name']
+    
+    # Mostrar resultados
+    st.success("¡Carta generada exitosamente")
+    
+    # Información de la carta
+    if card_data['Type'] == 'Damaging Spells':
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("💎 Coste", f"{card_data['Cost']} elixir")
+        with col2:
+            st.metric("⚔️ Daño", card_data['Damage'])
+        with col3:
+            st.metric("🛡️ Vida", card_data['Health (+Shield)'])
+        with col4:
+            duration = card_data['Duration']
+            if duration == 1:
+                st.metric("⏱️ Duración", "Instant.")
+            else:
+                st.metric("⏱️ Duración", f"{duration}s")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("💎 Coste", f"{card_data['Cost']} elixir")
+            st.metric("⚔️ Daño", card_data['Damage'])
+        with col2:
+            st.metric("🛡️ Vida", card_data['Health (+Shield)'])
+            type_display = {
+                'Troops and Defenses': '🛡️ Tropa',
+                'Damaging Spells': '⚡ Hechizo',
+                'Spawners': '🏗️ Edificio'
+            }
+            st.metric("🎭 Tipo", type_display.get(card_data['Type'], '🛡️ Tropa'))
+        with col3:
+            cost = card_data['Cost']
+            rarity = "⚪ COMÚN" if cost <= 2 else "🟠 RARO" if cost <= 4 else "🟣 ÉPICO" if cost <= 6 else "🟡 LEGENDARIO"
+            st.metric("⭐ Rareza", rarity)
+    
+    # Nombre y narrativa
+    st.subheader(f"🏆 {card_name}")
+    st.info(card_data['Narrative'])
+    
+    nearest_card = st.session_state.get('nearest_card')
+    if nearest_card:
+        nearest_name, distance = nearest_card
+        if distance <= NEAR_COPY_DISTANCE:
+            st.warning(f"⚠️ Estadísticas casi idénticas a la carta real {nearest_name}")
+        else:
+            st.caption(f"Carta real más parecida: {nearest_name} (distancia {distance:.2f})")
+    
+    if st.session_state.get('model_unavailable'):
+        st.warning("⚠️ No se pudo cargar el modelo de imágenes.")
+        return
+    
+    job = job_queue.get(st.session_state.get('job_id'))
+    if job is not None and job.status == GenerationJob.DONE:
+        # La cola olvida los trabajos terminados al cabo de unos minutos; el PNG queda en la sesión
+        st.session_state['card_png'] = job.result
+    card_png = st.session_state.get('card_png')
+    
+    if card_png is not None:
+        st.subheader("🏆 Tu carta personalizada")
+        if st.session_state.get('draft'):
+            st.caption("✏️ Borrador rápido: el presupuesto de tiempo no alcanzaba para la imagen completa")
+        st.image(card_png, caption=f"Carta: {card_name}", use_container_width=True)
+        
+        # Descarga
+        st.download_button(
+            label="Descargar carta completa",
+            data=card_png,
+            file_name=f"carta_{card_name.replace(' ', '_').lower()}.png",
+            mime="image/png",
+            use_container_width=True
+        )
+    elif job is None:
+        return
+    elif job.status == GenerationJob.FAILED:
+        st.error(f"❌ Error generando la imagen: {job.error}")
+    elif job.status == GenerationJob.CANCELLED:
+        st.info("⏹️ Generación cancelada.")
+    else:
+        # Polling: la página se vuelve a ejecutar hasta que el trabajo termine
+        if job.status == GenerationJob.PENDING:
+            st.progress(0.0, text="⏳ En cola...")
         else:
-            st.warning("⚠️ No se pudo cargar el modelo de imágenes.")
+            st.progress(job.progress, text=f"🖼️ Creando imagen... paso {job.step}/{job.total_steps}")
+            if job.preview is not None:
+                st.image(job.preview, caption="Vista previa (aproximada)")
+        if st.button("Cancelar generación"):
+            job_queue.cancel(job.id)
+        time.sleep(0.5)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
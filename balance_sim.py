@@ -0,0 +1,147 @@
+"""Puntuación de equilibrio de cartas con duelos simulados en NumPy.
+
+Las cartas generadas no se comparaban con el juego: lo único parecido eran
+los umbrales de generate_diffusion_prompt (damage > 300 y health > 1000). Aquí
+cada carta candidata se enfrenta a todas las cartas reales de
+clash_dataset_cleaned.csv en un duelo simplificado, con una sola operación de
+arrays por lote de candidatas:
+
+  - vida total = Health (+Shield) * Count, menos el Death Damage del rival;
+  - DPS total = Damage per second * Count (o Damage / Hit Speed si falta);
+  - la carta de más alcance golpea gratis mientras el rival recorre la
+    diferencia de Range a RANGE_CLOSING_SPEED casillas por segundo.
+
+La ventaja de un duelo es log2(tiempo que tarda el rival en matarla / tiempo
+que tarda ella en matar al rival) menos log2(coste propio / coste del rival),
+acotada a ±MAX_ADVANTAGE. La puntuación de equilibrio es la media sobre las
+cartas reales: 0 es una carta a la par del juego real, positiva está por
+encima de lo que cuesta y negativa por debajo.
+
+Uso:
+    python balance_sim.py candidatas.parquet --output equilibradas.parquet --tolerance 0.5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from card_data import load_cards
+
+REFERENCE_CSV = 'clash_dataset_cleaned.csv'
+DEFAULT_CHUNK_SIZE = 16384
+DEFAULT_TOLERANCE = 0.5
+# Casillas por segundo a las que se cierra la diferencia de alcance
+RANGE_CLOSING_SPEED = 1.0
+MAX_ADVANTAGE = 4.0
+
+
+def _column(cards, name, default):
+    if name not in cards.columns:
+        return np.full(len(cards), default, dtype=np.float32)
+    values = pd.to_numeric(cards[name], errors='coerce').fillna(default)
+    return values.to_numpy(dtype=np.float32)
+
+
+def combat_stats(cards):
+    """Vida, DPS, alcance, daño de muerte y coste de cada carta (arrays float32)"""
+    count = np.maximum(_column(cards, 'Count', 1), 1)
+    hit_speed = _column(cards, 'Hit Speed', 0)
+    damage = _column(cards, 'Damage', 0)
+    dps = _column(cards, 'Damage per second', 0)
+    # Sin DPS en la tabla se deduce del daño por golpe y la velocidad de ataque
+    with np.errstate(divide='ignore', invalid='ignore'):
+        derived = np.where(hit_speed > 0, damage / hit_speed, 0)
+    dps = np.where(dps > 0, dps, derived)
+    return {
+        'health': np.maximum(_column(cards, 'Health (+Shield)', 0), 0) * count,
+        'dps': np.maximum(dps, 0) * count,
+        'range': np.maximum(_column(cards, 'Range', 0), 0),
+        'death_damage': np.maximum(_column(cards, 'Death Damage', 0), 0),
+        'cost': np.maximum(_column(cards, 'Cost', 1), 1),
+    }
+
+
+class BalanceScorer:
+    def __init__(self, reference_cards, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.reference = {key: values[np.newaxis, :] for key, values in combat_stats(reference_cards).items()}
+        self.reference_count = len(reference_cards)
+
+    @classmethod
+    def from_csv(cls, path=REFERENCE_CSV, chunk_size=DEFAULT_CHUNK_SIZE):
+        return cls(load_cards(path), chunk_size=chunk_size)
+
+    def duel_advantage(self, stats):
+        """Matriz (candidatas x cartas reales) de ventaja ajustada por elixir"""
+        own = {key: values[:, np.newaxis] for key, values in stats.items()}
+        rival = self.reference
+
+        # Segundos que cada lado pasa sin poder atacar mientras se acerca
+        own_delay = np.maximum(rival['range'] - own['range'], 0) / RANGE_CLOSING_SPEED
+        rival_delay = np.maximum(own['range'] - rival['range'], 0) / RANGE_CLOSING_SPEED
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            own_kill_time = own_delay + np.maximum(rival['health'] - own['death_damage'], 0) / own['dps']
+            rival_kill_time = rival_delay + np.maximum(own['health'] - rival['death_damage'], 0) / rival['dps']
+            advantage = np.log2(rival_kill_time / own_kill_time) - np.log2(own['cost'] / rival['cost'])
+        # Ninguno puede matar al otro (inf/inf) o ambos mueren a la vez (0/0): empate
+        advantage = np.nan_to_num(advantage, nan=0.0, posinf=MAX_ADVANTAGE, neginf=-MAX_ADVANTAGE)
+        return np.clip(advantage, -MAX_ADVANTAGE, MAX_ADVANTAGE)
+
+    def score(self, cards):
+        """balance_score (media de ventajas) y win_rate de cada carta, alineados con cards.index"""
+        stats = combat_stats(cards)
+        scores = np.empty(len(cards), dtype=np.float32)
+        win_rates = np.empty(len(cards), dtype=np.float32)
+        # Por lotes: la matriz de duelos de un lote ocupa chunk_size x cartas reales
+        for start in range(0, len(cards), self.chunk_size):
+            end = start + self.chunk_size
+            advantage = self.duel_advantage({key: values[start:end] for key, values in stats.items()})
+            scores[start:end] = advantage.mean(axis=1)
+            win_rates[start:end] = (advantage > 0).mean(axis=1)
+        return pd.DataFrame({'balance_score': scores, 'win_rate': win_rates}, index=cards.index)
+
+    def balanced_mask(self, cards, tolerance=DEFAULT_TOLERANCE):
+        """True para las cartas con |balance_score| <= tolerance"""
+        return (self.score(cards)['balance_score'].abs() <= tolerance).to_numpy()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Puntúa el equilibrio de cartas con duelos simulados")
+    parser.add_argument('cards', help="Cartas candidatas (.parquet o .csv)")
+    parser.add_argument('--reference', default=REFERENCE_CSV, help="Cartas reales de referencia")
+    parser.add_argument('--output', default=None, help="Guarda las cartas con balance_score y win_rate")
+    parser.add_argument('--tolerance', type=float, default=None, help="Conserva solo |balance_score| <= tolerance")
+    args = parser.parse_args(argv)
+
+    if args.cards.endswith('.parquet'):
+        cards = pd.read_parquet(args.cards)
+    else:
+        cards = pd.read_csv(args.cards)
+    scorer = BalanceScorer.from_csv(args.reference)
+
+    start = time.perf_counter()
+    scores = scorer.score(cards)
+    elapsed = time.perf_counter() - start
+    print(f"{len(cards)} cartas contra {scorer.reference_count} reales en {elapsed:.2f}s")
+    print(scores['balance_score'].describe().to_string())
+
+    result = pd.concat([cards, scores], axis=1)
+    if args.tolerance is not None:
+        result = result[result['balance_score'].abs() <= args.tolerance]
+        print(f"{len(result)} cartas dentro de ±{args.tolerance}")
+    if args.output:
+        directory = os.path.dirname(os.path.abspath(args.output))
+        os.makedirs(directory, exist_ok=True)
+        if args.output.endswith('.parquet'):
+            result.to_parquet(args.output, index=False)
+        else:
+            result.to_csv(args.output, index=False, encoding='utf-8')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""Benchmarks reproducibles de cada etapa de la generación de una carta.
+
+No había benchmarks, solo time.time() alrededor de la generación en
+IAGenThirdPhase. Aquí se mide cada etapa por separado, solo con CPU y sin
+red:
+
+  - parse_user_prompt (StreamlitApp) y parse_user_prompt_precisely
+    (StreamlitSecVer, que delega en PROMPT_PARSER.parse);
+  - generate_premium_clash_narrative y generate_precise_narrative;
+  - create_card_composition de las dos apps (compose_classic_card y
+    compose_detailed_card) y la codificación PNG de la carta;
+  - difusión de punta a punta con un UNet, un VAE y un CLIP diminutos
+    inicializados al azar con semilla fija (mide el pipeline de diffusers y
+    DPMSolverMultistepScheduler, no la calidad del modelo).
+
+Cada benchmark tiene calentamiento, semillas fijas y un número fijo de hilos de
+torch. El resultado es un JSON con el entorno y la mediana, mínimo, p90 y
+desviación de cada etapa. Con --baseline se compara la mediana con un JSON
+anterior y se sale con código 1 si alguna etapa empeora más que la tolerancia.
+
+Uso:
+    python benchmark_suite.py --output benchmark_baseline.json
+    python benchmark_suite.py --baseline benchmark_baseline.json --tolerance 0.15
+    python benchmark_suite.py --quick --only parse_user_prompt png_encode
+"""
+import argparse
+import importlib.metadata
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SEED = 1234
+DEFAULT_THREADS = 1
+DEFAULT_TOLERANCE = 0.15
+QUICK_FACTOR = 10
+PACKAGES = ('numpy', 'pandas', 'Pillow', 'torch', 'diffusers', 'transformers')
+TINY_SIZE = 64
+TINY_STEPS = 10
+# Configuración del scheduler de runwayml/stable-diffusion-v1-5
+SD15_SCHEDULER = {'beta_start': 0.00085, 'beta_end': 0.012, 'beta_schedule': 'scaled_linear', 'steps_offset': 1}
+
+
+def _sample_cards():
+    from prompt_parser import SAMPLE_PROMPTS, parse_prompt
+    return [dict(parse_prompt(prompt), original_prompt=prompt) for prompt in SAMPLE_PROMPTS]
+
+
+def _art_image(size=(512, 640)):
+    from PIL import Image
+    pixels = np.random.default_rng(SEED).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    return Image.fromarray(pixels, 'RGB')
+
+
+def bench_parse_user_prompt():
+    from prompt_parser import SAMPLE_PROMPTS, parse_user_prompt
+    rng = random.Random(SEED)
+
+    def run():
+        for prompt in SAMPLE_PROMPTS:
+            parse_user_prompt(prompt, rng)
+    return run, len(SAMPLE_PROMPTS)
+
+
+def bench_parse_user_prompt_precisely():
+    # parse_user_prompt_precisely (StreamlitSecVer) es PROMPT_PARSER.parse
+    from prompt_parser import PROMPT_PARSER, SAMPLE_PROMPTS
+
+    def run():
+        for prompt in SAMPLE_PROMPTS:
+            PROMPT_PARSER.parse(prompt)
+    return run, len(SAMPLE_PROMPTS)
+
+
+def bench_generate_premium_clash_narrative():
+    from narrative_tables import generate_premium_clash_narrative
+    from prompt_parser import SAMPLE_PROMPTS, parse_user_prompt
+    rng = random.Random(SEED)
+    cards = [parse_user_prompt(prompt, rng) for prompt in SAMPLE_PROMPTS]
+
+    def run():
+        for card in cards:
+            generate_premium_clash_narrative(card)
+    return run, len(cards)
+
+
+def bench_generate_precise_narrative():
+    # Vive en StreamlitSecVer: hace falta streamlit instalado (su main() no se ejecuta al importar)
+    from StreamlitSecVer import generate_precise_narrative
+    cards = _sample_cards()
+
+    def run():
+        for card in cards:
+            generate_precise_narrative(card)
+    return run, len(cards)
+
+
+def bench_compose_classic_card():
+    from card_composition import compose_classic_card
+    from narrative_tables import generate_premium_clash_narrative
+    image = _art_image()
+    card = _sample_cards()[1]
+    card['Narrative'] = generate_premium_clash_narrative(card)
+
+    def run():
+        compose_classic_card(image, card, "CARTA IA #01")
+    return run, 1
+
+
+def bench_compose_detailed_card():
+    from card_composition import compose_detailed_card
+    from narrative_tables import generate_premium_clash_narrative
+    image = _art_image()
+    card = _sample_cards()[1]
+    card['Narrative'] = generate_premium_clash_narrative(card)
+
+    def run():
+        compose_detailed_card(image, card, "HECHIZO DE FUEGO ÉPICO")
+    return run, 1
+
+
+def bench_png_encode():
+    from card_composition import compose_detailed_card
+    card = compose_detailed_card(_art_image(), _sample_cards()[1], "HECHIZO DE FUEGO ÉPICO")
+
+    def run():
+        # Igual que la descarga de StreamlitSecVer y render_cards.py
+        buffer = io.BytesIO()
+        card.save(buffer, format='PNG')
+    return run, 1
+
+
+def _tiny_tokenizer(directory):
+    from transformers import CLIPTokenizer
+
+    # Vocabulario de bytes sin merges: cada carácter es un token, sin descargar nada
+    characters = [chr(c) for c in range(ord('!'), ord('~') + 1)]
+    vocab = {token: i for i, token in enumerate(characters + [c + '</w>' for c in characters])}
+    vocab['<|startoftext|>'] = len(vocab)
+    vocab['<|endoftext|>'] = len(vocab)
+    with open(os.path.join(directory, 'vocab.json'), 'w', encoding='utf-8') as f:
+        json.dump(vocab, f)
+    with open(os.path.join(directory, 'merges.txt'), 'w', encoding='utf-8') as f:
+        f.write('#version: 0.2\n')
+    return CLIPTokenizer(os.path.join(directory, 'vocab.json'), os.path.join(directory, 'merges.txt'),
+                         model_max_length=77)
+
+
+def build_tiny_pipeline(seed=SEED):
+    """StableDiffusionPipeline diminuto con pesos aleatorios y DPMSolverMultistepScheduler, como las apps"""
+    import torch
+    from diffusers import AutoencoderKL, DPMSolverMultistepScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    torch.manual_seed(seed)
+    unet = UNet2DConditionModel(
+        sample_size=TINY_SIZE // 8, in_channels=4, out_channels=4, layers_per_block=1,
+        block_out_channels=(32, 64), cross_attention_dim=32,
+        down_block_types=('DownBlock2D', 'CrossAttnDownBlock2D'),
+        up_block_types=('CrossAttnUpBlock2D', 'UpBlock2D'),
+    )
+    vae = AutoencoderKL(
+        in_channels=3, out_channels=3, latent_channels=4, block_out_channels=(32, 64),
+        down_block_types=('DownEncoderBlock2D', 'DownEncoderBlock2D'),
+        up_block_types=('UpDecoderBlock2D', 'UpDecoderBlock2D'),
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        vocab_size=1000, hidden_size=32, intermediate_size=37, num_attention_heads=4, num_hidden_layers=2,
+        bos_token_id=0, eos_token_id=2, pad_token_id=1,
+    ))
+    with tempfile.TemporaryDirectory() as directory:
+        tokenizer = _tiny_tokenizer(directory)
+    pipeline = StableDiffusionPipeline(
+        unet=unet, vae=vae, text_encoder=text_encoder, tokenizer=tokenizer,
+        scheduler=DPMSolverMultistepScheduler(**SD15_SCHEDULER), safety_checker=None, feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    pipeline.set_progress_bar_config(disable=True)
+    return pipeline.to('cpu')
+
+
+def bench_diffusion_tiny():
+    import torch
+    pipeline = build_tiny_pipeline()
+
+    def run():
+        with torch.inference_mode():
+            pipeline(
+                prompt="massive stone golem creature, Clash Royale game art style",
+                negative_prompt="realistic photo, blurry, low quality",
+                num_inference_steps=TINY_STEPS, guidance_scale=8.0, width=TINY_SIZE, height=TINY_SIZE,
+                generator=torch.Generator().manual_seed(SEED),
+            )
+    return run, 1
+
+
+# Nombre -> (preparación, repeticiones)
+BENCHMARKS = {
+    'parse_user_prompt': (bench_parse_user_prompt, 2000),
+    'parse_user_prompt_precisely': (bench_parse_user_prompt_precisely, 2000),
+    'generate_premium_clash_narrative': (bench_generate_premium_clash_narrative, 2000),
+    'generate_precise_narrative': (bench_generate_precise_narrative, 2000),
+    'compose_classic_card': (bench_compose_classic_card, 50),
+    'compose_detailed_card': (bench_compose_detailed_card, 50),
+    'png_encode': (bench_png_encode, 30),
+    'diffusion_tiny': (bench_diffusion_tiny, 10),
+}
+
+
+def measure(run, repeat, warmup=3):
+    """Segundos de cada llamada a run() tras warmup llamadas de calentamiento"""
+    for _ in range(warmup):
+        run()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples, items):
+    milliseconds = sorted(sample * 1000 for sample in samples)
+    median = statistics.median(milliseconds)
+    return {
+        'median_ms': median,
+        'min_ms': milliseconds[0],
+        'p90_ms': milliseconds[min(len(milliseconds) - 1, int(len(milliseconds) * 0.9))],
+        'stdev_ms': statistics.stdev(milliseconds) if len(milliseconds) > 1 else 0.0,
+        'repeat': len(milliseconds),
+        'items': items,
+        'median_ms_per_item': median / items,
+    }
+
+
+def environment(threads):
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': threads,
+        'packages': versions,
+    }
+
+
+def run_benchmarks(names=None, quick=False, threads=DEFAULT_THREADS):
+    """Ejecuta los benchmarks pedidos (todos por defecto) y devuelve el informe"""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    results = {}
+    for name in names or BENCHMARKS:
+        setup, repeat = BENCHMARKS[name]
+        if quick:
+            repeat = max(3, repeat // QUICK_FACTOR)
+        random.seed(SEED)
+        np.random.seed(SEED)
+        try:
+            run, items = setup()
+        except ImportError as e:
+            # Dependencia que falta en esta máquina: la etapa queda marcada, no rompe el resto
+            results[name] = {'skipped': str(e)}
+            print(f"{name:>34}: omitido ({e})")
+            continue
+        results[name] = summarize(measure(run, repeat), items)
+        print(f"{name:>34}: {results[name]['median_ms']:10.3f} ms (p90 {results[name]['p90_ms']:.3f} ms)")
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'quick': quick,
+        'environment': environment(threads),
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Filas (nombre, mediana base, mediana actual, cociente, estado) por benchmark"""
+    rows = []
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if 'skipped' in result or previous is None or 'skipped' in previous:
+            rows.append((name, None, result.get('median_ms'), None, 'sin comparar'))
+            continue
+        ratio = result['median_ms'] / previous['median_ms']
+        if ratio > 1 + tolerance:
+            status = 'REGRESIÓN'
+        elif ratio < 1 - tolerance:
+            status = 'mejora'
+        else:
+            status = 'ok'
+        rows.append((name, previous['median_ms'], result['median_ms'], ratio, status))
+    return rows
+
+
+def write_report(path, report):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de las etapas de generación de cartas")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON con los resultados")
+    parser.add_argument('--baseline', default=None, help="JSON anterior con el que comparar")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Empeoramiento relativo de la mediana que cuenta como regresión")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=None)
+    parser.add_argument('--quick', action='store_true', help=f"Repeticiones divididas por {QUICK_FACTOR}")
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help="Hilos de torch")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.only, quick=args.quick, threads=args.threads)
+    write_report(args.output, report)
+    print(f"Resultados en {args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('environment') != report['environment']:
+        print("Aviso: el entorno de la línea base es distinto; compara con cautela")
+    regressions = 0
+    for name, previous, current, ratio, status in compare(report, baseline, args.tolerance):
+        if ratio is None:
+            print(f"{name:>34}: {status}")
+            continue
+        print(f"{name:>34}: {previous:10.3f} -> {current:10.3f} ms ({ratio:5.2f}x) {status}")
+        regressions += status == 'REGRESIÓN'
+    if regressions:
+        print(f"{regressions} etapas más lentas que la línea base (tolerancia {args.tolerance:.0%})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
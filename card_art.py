@@ -0,0 +1,58 @@
+"""Tamaño de la ilustración de difusión y encaje en el hueco de arte de la carta.
+
+La composición reserva un hueco apaisado de 520x290 para la ilustración, pero
+los prompts pedían imágenes verticales de 512x640 que luego se aplastaban a ese
+hueco. Con el formato "native" la imagen se genera ya apaisada, con lados
+múltiplos de 64 (la UNet reduce 8x en píxeles y otras 8x en latentes, así no
+hay que interpolar al subir de resolución) y casi la misma proporción que el
+hueco, de modo que solo hace falta un reescalado ligero. La UNet trabaja con
+~56% del área latente de 512x640.
+"""
+import os
+
+from PIL import Image
+
+# Hueco de arte en la composición de 600x800: tamaño y esquina superior izquierda
+ART_SLOT_SIZE = (520, 290)
+ART_SLOT_POSITION = (45, 125)
+
+# Tamaños de generación (ancho, alto)
+ART_SIZES = {
+    'portrait': (512, 640),
+    'native': (576, 320),
+    'native-hd': (1024, 576),
+}
+DEFAULT_ART_SIZE = os.environ.get("CLASH_ART_SIZE", "portrait")
+
+
+def apply_art_size(generation_params, art_size=DEFAULT_ART_SIZE):
+    """Devuelve generation_params con el ancho y alto del formato pedido"""
+    width, height = ART_SIZES.get(art_size, ART_SIZES['portrait'])
+    params = dict(generation_params)
+    params['width'] = width
+    params['height'] = height
+    return params
+
+
+def fit_art_to_slot(image, slot_size=ART_SLOT_SIZE):
+    """Encaja la ilustración en el hueco sin deformarla: recorte central a la proporción y reescalado"""
+    if image.size == slot_size:
+        return image
+
+    slot_width, slot_height = slot_size
+    width, height = image.size
+    slot_ratio = slot_width / slot_height
+    ratio = width / height
+
+    box = (0, 0, width, height)
+    # Solo se recorta si la proporción difiere más de un 2% (los formatos nativos no se recortan)
+    if ratio > slot_ratio * 1.02:
+        crop_width = round(height * slot_ratio)
+        left = (width - crop_width) // 2
+        box = (left, 0, left + crop_width, height)
+    elif ratio < slot_ratio / 1.02:
+        crop_height = round(width / slot_ratio)
+        top = (height - crop_height) // 2
+        box = (0, top, width, top + crop_height)
+
+    return image.resize(slot_size, Image.Resampling.LANCZOS, box=box)
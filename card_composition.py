@@ -0,0 +1,263 @@
+"""Composición de cartas con plantillas de marco precalculadas.
+
+El marco de una carta (fondo, bordes redondeados, círculo de coste de dos
+anillos, hueco de arte, panel de información y rótulos fijos) solo depende de
+la rareza y del tipo de carta. Cada combinación rareza x tipo se dibuja una vez
+por proceso y se copia para cada carta; sobre la copia solo se dibuja lo que
+cambia (ilustración, coste, nombre, valores y narrativa). Las fuentes
+TrueType también se cargan una sola vez por proceso.
+
+Hay dos diseños: "classic" (StreamlitApp e IAGenThirdPhase) y "detailed"
+(StreamlitSecVer, con duración para hechizos).
+"""
+import functools
+import threading
+
+from PIL import Image, ImageDraw, ImageFont
+
+from card_art import ART_SLOT_POSITION, fit_art_to_slot
+from text_layout import draw_lines, fit_text, wrap_text
+
+# Sube al cambiar el marco, la maquetación del texto (text_layout) o el encaje del arte (card_art):
+# render_cards.py vuelve a renderizar las cartas hechas con una versión anterior
+LAYOUT_VERSION = 1
+CARD_SIZE = (600, 800)
+# Ancho disponible para el nombre (hasta el rótulo de rareza) y para la narrativa
+TITLE_MAX_WIDTH = 410
+TEXT_MAX_WIDTH = 460
+COST_CENTER = (75, 75)
+COST_RADIUS = 40
+
+# Rareza por coste: (coste máximo, esquema de colores)
+RARITY_SCHEMES = [
+    (2, {'border': '#C0C0C0', 'bg': '#E8E8E8', 'rarity': 'COMÚN', 'cost_bg': '#4A90E2'}),
+    (4, {'border': '#FF8C00', 'bg': '#FFE4B5', 'rarity': 'RARO', 'cost_bg': '#FF6B35'}),
+    (6, {'border': '#9932CC', 'bg': '#E6E6FA', 'rarity': 'ÉPICO', 'cost_bg': '#8E44AD'}),
+    (None, {'border': '#FFD700', 'bg': '#FFF8DC', 'rarity': 'LEGENDARIO', 'cost_bg': '#F39C12'}),
+]
+
+TYPE_LABELS = {
+    'Troops and Defenses': 'TROPA',
+    'Damaging Spells': 'HECHIZO',
+    'Spawners': 'EDIFICIO'
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(size, name="arial.ttf"):
+    """Fuente TrueType cargada una sola vez por proceso (la de PIL por defecto si no existe)"""
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def rarity_scheme(cost):
+    """Esquema de colores y texto de rareza según el coste"""
+    for max_cost, scheme in RARITY_SCHEMES:
+        if max_cost is None or cost <= max_cost:
+            return scheme
+
+
+def _draw_base_frame(draw, scheme, info_margin_bottom):
+    width, height = CARD_SIZE
+
+    # Fondo principal
+    draw.rounded_rectangle(
+        [(15, 15), (width-15, height-15)],
+        radius=25, fill=scheme['bg'], outline=scheme['border'], width=6
+    )
+
+    # Círculo de coste (anillo blanco exterior + círculo del color de la rareza)
+    draw.ellipse([
+        COST_CENTER[0]-COST_RADIUS-4, COST_CENTER[1]-COST_RADIUS-4,
+        COST_CENTER[0]+COST_RADIUS+4, COST_CENTER[1]+COST_RADIUS+4
+    ], fill='white', outline=scheme['border'], width=3)
+    draw.ellipse([
+        COST_CENTER[0]-COST_RADIUS, COST_CENTER[1]-COST_RADIUS,
+        COST_CENTER[0]+COST_RADIUS, COST_CENTER[1]+COST_RADIUS
+    ], fill=scheme['cost_bg'], outline='white', width=2)
+
+    # Hueco de arte y panel de información
+    draw.rounded_rectangle([(40, 120), (width-40, 420)], radius=20, fill='#2C3E50', outline=scheme['border'], width=4)
+    draw.rounded_rectangle(
+        [(40, 440), (width-40, height-info_margin_bottom)],
+        radius=15, fill='#34495E', outline=scheme['border'], width=3
+    )
+
+
+def _render_classic_frame(scheme, card_type):
+    width, height = CARD_SIZE
+    canvas = Image.new('RGB', CARD_SIZE, color='#1a1a1a')
+    draw = ImageDraw.Draw(canvas)
+    _draw_base_frame(draw, scheme, info_margin_bottom=40)
+
+    font_stats = get_font(16)
+    font_desc = get_font(12)
+
+    draw.text((width-120, 460), scheme['rarity'], fill=scheme['border'], font=font_stats)
+    draw.text((60, 485), TYPE_LABELS[card_type], fill='#3498DB', font=font_stats)
+
+    # Rótulos y valores fijos de las estadísticas
+    stats_y = 510
+    if card_type == 'Damaging Spells':
+        draw.text((60, stats_y), "DAÑO", fill='#E74C3C', font=font_stats)
+        draw.text((250, stats_y), "RADIO", fill='#F39C12', font=font_stats)
+        draw.text((340, stats_y), "3.0", fill='white', font=font_stats)
+        draw.text((420, stats_y), "RALENT.", fill='#3498DB', font=font_stats)
+        draw.text((520, stats_y), "2.5s", fill='white', font=font_stats)
+    elif card_type == 'Spawners':
+        draw.text((60, stats_y), "VIDA", fill='#27AE60', font=font_stats)
+        draw.text((250, stats_y), "DURACIÓN", fill='#9B59B6', font=font_stats)
+        draw.text((360, stats_y), "60s", fill='white', font=font_stats)
+    else:
+        draw.text((60, stats_y), "DAÑO", fill='#E74C3C', font=font_stats)
+        draw.text((220, stats_y), "VIDA", fill='#27AE60', font=font_stats)
+        draw.text((380, stats_y), "VEL.", fill='#F39C12', font=font_stats)
+        draw.text((460, stats_y), "1.2s", fill='white', font=font_stats)
+
+    draw.text((300, height-70), "Generado por IA", fill='#95A5A6', font=font_desc)
+
+    # Insignia de nivel (nivel fijo)
+    level_area = (width-80, height-50, width-20, height-20)
+    draw.rounded_rectangle(level_area, radius=5, fill='#2C3E50', outline=scheme['border'], width=2)
+    draw.text((width-60, height-40), "9", fill='white', font=font_stats)
+    return canvas
+
+
+def _render_detailed_frame(scheme, card_type):
+    width, height = CARD_SIZE
+    canvas = Image.new('RGB', CARD_SIZE, color='#1a1a1a')
+    draw = ImageDraw.Draw(canvas)
+    _draw_base_frame(draw, scheme, info_margin_bottom=20)
+
+    font_stats = get_font(16)
+
+    draw.text((width-120, 460), scheme['rarity'], fill=scheme['border'], font=font_stats)
+    draw.text((60, 485), TYPE_LABELS[card_type], fill='#3498DB', font=font_stats)
+
+    stats_y = 510
+    if card_type == 'Damaging Spells':
+        draw.text((60, stats_y), "DAÑO", fill='#E74C3C', font=font_stats)
+        draw.text((250, stats_y), "DURACIÓN", fill='#F39C12', font=font_stats)
+    elif card_type == 'Spawners':
+        draw.text((60, stats_y), "VIDA", fill='#27AE60', font=font_stats)
+    else:
+        draw.text((60, stats_y), "DAÑO", fill='#E74C3C', font=font_stats)
+        draw.text((220, stats_y), "VIDA", fill='#27AE60', font=font_stats)
+    return canvas
+
+
+class CardFrameTemplates:
+    RENDERERS = {
+        'classic': _render_classic_frame,
+        'detailed': _render_detailed_frame,
+    }
+
+    def __init__(self):
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def frame(self, layout, cost, card_type):
+        """Copia del marco de la carta; se dibuja solo la primera vez por rareza x tipo"""
+        scheme = rarity_scheme(cost)
+        # Los tipos desconocidos se dibujan como tropas
+        if card_type not in TYPE_LABELS:
+            card_type = 'Troops and Defenses'
+        key = (layout, scheme['rarity'], card_type)
+
+        with self._lock:
+            template = self._frames.get(key)
+        if template is None:
+            template = self.RENDERERS[layout](scheme, card_type)
+            with self._lock:
+                template = self._frames.setdefault(key, template)
+        return template.copy(), scheme
+
+
+FRAME_TEMPLATES = CardFrameTemplates()
+
+
+def _draw_cost_number(draw, cost):
+    font_cost = get_font(32)
+    cost_text = str(cost)
+    bbox = draw.textbbox((0, 0), cost_text, font=font_cost)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    draw.text((COST_CENTER[0] - text_width//2, COST_CENTER[1] - text_height//2),
+              cost_text, fill='white', font=font_cost)
+
+
+def compose_classic_card(image, card_data, card_name, health_key='Health (+Shield)'):
+    """Carta del diseño classic: marco precalculado + ilustración, coste, valores y narrativa"""
+    height = CARD_SIZE[1]
+    cost = int(card_data.get('Cost', 3))
+    damage = int(card_data.get('Damage', 100))
+    health = int(card_data.get(health_key, 100))
+    card_type = card_data.get('Type', 'Troops and Defenses')
+
+    canvas, scheme = FRAME_TEMPLATES.frame('classic', cost, card_type)
+    draw = ImageDraw.Draw(canvas)
+
+    if image:
+        # Recorte central a la proporción del hueco: sin deformar la ilustración
+        canvas.paste(fit_art_to_slot(image), ART_SLOT_POSITION)
+
+    font_title = get_font(20)
+    font_stats = get_font(16)
+    font_desc = get_font(12)
+
+    _draw_cost_number(draw, cost)
+    draw.text((60, 460), fit_text(card_name, font_title, TITLE_MAX_WIDTH), fill='white', font=font_title)
+
+    stats_y = 510
+    if card_type == 'Damaging Spells':
+        draw.text((150, stats_y), str(damage), fill='white', font=font_stats)
+    elif card_type == 'Spawners':
+        draw.text((150, stats_y), str(health), fill='white', font=font_stats)
+    else:
+        draw.text((140, stats_y), str(damage), fill='white', font=font_stats)
+        draw.text((300, stats_y), str(health), fill='white', font=font_stats)
+
+    # Descripción: 3 líneas ajustadas al ancho real de la fuente
+    lines = wrap_text(card_data.get('Narrative', ''), font_desc, TEXT_MAX_WIDTH, max_lines=3)
+    draw_lines(draw, lines, 60, stats_y + 40, font_desc, '#BDC3C7', line_height=18)
+
+    draw.text((60, height-70), f"Coste: {cost} elixir", fill='#F39C12', font=font_desc)
+    return canvas
+
+
+def compose_detailed_card(image, card_data, card_name):
+    """Carta del diseño detailed: como classic pero con duración exacta para hechizos"""
+    cost = int(card_data.get('Cost', 3))
+    duration = int(card_data.get('Duration', 0))
+    card_type = card_data.get('Type', 'Troops and Defenses')
+
+    canvas, scheme = FRAME_TEMPLATES.frame('detailed', cost, card_type)
+    draw = ImageDraw.Draw(canvas)
+
+    if image:
+        canvas.paste(fit_art_to_slot(image), ART_SLOT_POSITION)
+
+    font_title = get_font(18)
+    font_stats = get_font(16)
+    font_desc = get_font(11)
+
+    _draw_cost_number(draw, cost)
+    draw.text((60, 460), fit_text(card_name, font_title, TITLE_MAX_WIDTH), fill='white', font=font_title)
+
+    stats_y = 510
+    if card_type == 'Damaging Spells':
+        draw.text((150, stats_y), str(card_data.get('Damage', 0)), fill='white', font=font_stats)
+        duration_text = "Instant." if duration == 1 else f"{duration}s"
+        draw.text((360, stats_y), duration_text, fill='white', font=font_stats)
+    elif card_type == 'Spawners':
+        draw.text((150, stats_y), str(card_data.get('Health (+Shield)', 0)), fill='white', font=font_stats)
+    else:
+        draw.text((140, stats_y), str(card_data.get('Damage', 0)), fill='white', font=font_stats)
+        draw.text((300, stats_y), str(card_data.get('Health (+Shield)', 0)), fill='white', font=font_stats)
+
+    # Narrativa completa: hasta 8 líneas, la última con puntos suspensivos si no cabe
+    lines = wrap_text(card_data.get('Narrative', ''), font_desc, TEXT_MAX_WIDTH, max_lines=8)
+    draw_lines(draw, lines, 60, stats_y + 35, font_desc, '#BDC3C7', line_height=15)
+    return canvas
@@ -0,0 +1,167 @@
+"""Carga tipada y cacheada de los CSV de cartas de la wiki.
+
+IAGenFirstPhase e IAGenSecondPhase leían los CSV en crudo y convertían columna
+a columna con pd.to_numeric(...astype(str).str.replace(',', '')). Los valores
+de la wiki como "35-704" (rango), "106/50" (dos modos), "7 (9)" (nivel de la
+carta y de la tropa generada) o "977 (+266)" (vida y escudo) acababan en NaN y
+luego se rellenaban con la mediana. Aquí cada columna se parsea entera con una
+sola expresión regular (Series.str.extract) y se conserva esa información:
+
+  - "1,408" -> 1408;
+  - rangos y dos modos: la columna guarda el mínimo y "<columna> (max)" el
+    máximo (para RANGE_COLUMNS siempre, para el resto si aparece alguno);
+  - "Card Level (Spawn Level)" se separa en "Card Level" y "Spawn Level";
+  - "Health (+Shield)" guarda vida + escudo y "Shield" el escudo.
+
+Las columnas numéricas salen como float64 (NaN donde no hay dato) y las de
+texto como object. El resultado se guarda en Parquet bajo el hash del fichero
+de origen: las siguientes cargas leen la caché en milisegundos.
+
+Uso:
+    python card_data.py clash_wiki_dataset.csv
+    python card_data.py clash_train.csv --output clash_train.parquet
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Sube al cambiar el parseo para invalidar las cachés anteriores
+LOADER_VERSION = 1
+DEFAULT_CACHE_DIR = os.environ.get(
+    "CLASH_DATA_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "clash_cards", "data")
+)
+TEXT_COLUMNS = ('Card', 'Type', 'Troop Spawned')
+LEVEL_COLUMN = 'Card Level (Spawn Level)'
+HEALTH_COLUMN = 'Health (+Shield)'
+RANGE_COLUMNS = ('Count', 'Damage', 'Damage per second', 'Hit Speed', 'Range')
+MAX_SUFFIX = ' (max)'
+
+_NUMBER = r'\d[\d,]*(?:\.\d+)?'
+VALUE_PATTERN = (
+    rf'^\s*(?P<first>{_NUMBER})'
+    rf'(?:\s*[-/]\s*(?P<second>{_NUMBER}))?'
+    rf'(?:\s*\(\s*\+?\s*(?P<extra>{_NUMBER})\s*\))?\s*$'
+)
+
+_loaded = {}
+
+
+def parse_values(values):
+    """DataFrame (first, second, extra) en float64 para una columna de la wiki; lo que no encaja queda NaN"""
+    if pd.api.types.is_numeric_dtype(values):
+        first = values.astype(np.float64)
+        empty = pd.Series(np.nan, index=values.index)
+        return pd.DataFrame({'first': first, 'second': empty, 'extra': empty})
+    parts = values.astype(str).str.extract(VALUE_PATTERN)
+    return parts.apply(lambda part: pd.to_numeric(part.str.replace(',', '', regex=False), errors='coerce'))
+
+
+def split_column(parts, name):
+    """Columnas tipadas (nombre -> Series) a partir de las partes parseadas de una columna"""
+    if name == LEVEL_COLUMN:
+        return {'Card Level': parts['first'], 'Spawn Level': parts['extra']}
+    if name == HEALTH_COLUMN:
+        return {HEALTH_COLUMN: parts['first'] + parts['extra'].fillna(0), 'Shield': parts['extra']}
+
+    columns = {name: parts[['first', 'second']].min(axis=1)}
+    if name in RANGE_COLUMNS or parts['second'].notna().any():
+        columns[name + MAX_SUFFIX] = parts[['first', 'second']].max(axis=1)
+    return columns
+
+
+def parse_cards(raw):
+    """Versión tipada de un DataFrame leído en crudo (todo como texto)"""
+    numeric_names = [name for name in raw.columns if name not in TEXT_COLUMNS]
+    if numeric_names:
+        # Todas las columnas numéricas apiladas: una sola pasada de la expresión regular
+        parts = parse_values(pd.concat([raw[name] for name in numeric_names], keys=numeric_names))
+
+    columns = {}
+    for name in raw.columns:
+        if name in TEXT_COLUMNS:
+            columns[name] = raw[name].astype(object)
+        else:
+            columns.update(split_column(parts.xs(name, level=0), name))
+    return pd.DataFrame(columns, index=raw.index)
+
+
+def file_hash(path):
+    digest = hashlib.sha256(f"v{LOADER_VERSION}".encode('utf-8'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _save_frame(path, cards):
+    # Escritura atómica: otro proceso nunca ve un Parquet a medias
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            cards.to_parquet(f, index=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_cards(path, cache_dir=DEFAULT_CACHE_DIR):
+    """DataFrame tipado de un CSV de cartas, cacheado en memoria y en Parquet por hash del fichero"""
+    key = file_hash(path)
+    if key in _loaded:
+        return _loaded[key].copy()
+
+    cache_path = os.path.join(cache_dir, f"{key}.parquet") if cache_dir else None
+    cards = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            cards = pd.read_parquet(cache_path)
+        except ImportError:
+            cards = None
+    if cards is None:
+        cards = parse_cards(pd.read_csv(path, dtype=str))
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            try:
+                _save_frame(cache_path, cards)
+            except ImportError:
+                # Sin pyarrow/fastparquet: solo queda la caché en memoria
+                pass
+
+    _loaded[key] = cards
+    return cards.copy()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parsea un CSV de cartas de la wiki a un DataFrame tipado")
+    parser.add_argument('csv', help="CSV crudo (p. ej. clash_wiki_dataset.csv)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--output', default=None, help="Guarda el resultado tipado (.parquet o .csv)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    cards = load_cards(args.csv, cache_dir=args.cache_dir)
+    elapsed = time.perf_counter() - start
+    print(f"{len(cards)} cartas, {len(cards.columns)} columnas en {elapsed * 1000:.1f} ms")
+    print(cards.dtypes.to_string())
+
+    if args.output:
+        directory = os.path.dirname(os.path.abspath(args.output))
+        os.makedirs(directory, exist_ok=True)
+        if args.output.endswith('.parquet'):
+            cards.to_parquet(args.output, index=False)
+        else:
+            cards.to_csv(args.output, index=False, encoding='utf-8')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Índice de las cartas reales más parecidas a cartas generadas.
+
+Las cartas generadas (salida de la GAN o prompts de usuario ya parseados) no
+se relacionaban con las cartas reales de clash_dataset_cleaned.csv. Este
+índice escala las columnas numéricas de IAGenSecondPhase con MinMax (los
+mínimos y máximos de las cartas reales) y responde consultas k-NN por lotes:
+la matriz de distancias de un lote de consultas contra las ~70 cartas reales
+se calcula con una multiplicación de matrices y los k vecinos salen de
+np.argpartition, sin bucles de pandas. Con tan pocas cartas de referencia la
+fuerza bruta vectorizada es más rápida que un KD-tree.
+
+Las consultas solo usan las columnas que traen (un prompt parseado tiene
+Cost, Damage y Health (+Shield)). Las distancias se dividen por la raíz del
+número de columnas, así que están entre 0 y 1 para valores dentro del rango
+de las cartas reales.
+
+Uso:
+    python card_index.py candidatas.parquet --k 3 --output vecinas.parquet
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from card_data import load_cards
+
+REFERENCE_CSV = 'clash_dataset_cleaned.csv'
+NUMERIC_COLUMNS = [
+    'Cost', 'Count', 'Damage', 'Damage per second', 'Death Damage',
+    'Health (+Shield)', 'Hit Speed', 'Level', 'Range', 'Spawner Health'
+]
+DEFAULT_CHUNK_SIZE = 65536
+# Por debajo de esta distancia normalizada una carta se considera copia de una real
+NEAR_COPY_DISTANCE = 0.02
+
+
+class CardIndex:
+    def __init__(self, reference_cards, columns=NUMERIC_COLUMNS, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.columns = [column for column in columns if column in reference_cards.columns]
+        self.chunk_size = chunk_size
+        self.names = reference_cards['Card'].astype(str).to_numpy() if 'Card' in reference_cards.columns \
+            else np.arange(len(reference_cards)).astype(str)
+        self.types = reference_cards['Type'].to_numpy(dtype=object) if 'Type' in reference_cards.columns \
+            else np.full(len(reference_cards), None, dtype=object)
+
+        values = reference_cards[self.columns].apply(pd.to_numeric, errors='coerce')
+        values = values.fillna(values.median())
+        self.minimum = values.min().to_numpy(dtype=np.float64)
+        span = values.max().to_numpy(dtype=np.float64) - self.minimum
+        # Columnas constantes: escala 1 para no dividir por cero
+        self.scale = np.where(span > 0, span, 1.0)
+        self.medians = values.median().to_numpy(dtype=np.float64)
+        self.reference = ((values.to_numpy(dtype=np.float64) - self.minimum) / self.scale).astype(np.float32)
+
+    @classmethod
+    def from_csv(cls, path=REFERENCE_CSV, columns=NUMERIC_COLUMNS):
+        return cls(load_cards(path), columns=columns)
+
+    def _normalize(self, cards, positions):
+        values = np.empty((len(cards), len(positions)), dtype=np.float64)
+        for i, position in enumerate(positions):
+            column = pd.to_numeric(cards[self.columns[position]], errors='coerce').to_numpy(dtype=np.float64)
+            # Huecos: la mediana de las cartas reales, que no favorece a ninguna
+            values[:, i] = np.where(np.isnan(column), self.medians[position], column)
+        return ((values - self.minimum[positions]) / self.scale[positions]).astype(np.float32)
+
+    def query(self, cards, k=5):
+        """Índices (filas de las cartas reales) y distancias de los k vecinos de cada carta, ordenados"""
+        positions = [i for i, column in enumerate(self.columns) if column in cards.columns]
+        if not positions:
+            raise ValueError(f"Las cartas no tienen ninguna de las columnas del índice: {self.columns}")
+        k = min(k, len(self.reference))
+        reference = self.reference[:, positions]
+        reference_norms = (reference ** 2).sum(axis=1)
+
+        indices = np.empty((len(cards), k), dtype=np.int64)
+        distances = np.empty((len(cards), k), dtype=np.float32)
+        for start in range(0, len(cards), self.chunk_size):
+            queries = self._normalize(cards.iloc[start:start + self.chunk_size], positions)
+            # |q - r|² = |q|² + |r|² - 2 q·r para todo el lote a la vez
+            squared = (queries ** 2).sum(axis=1)[:, np.newaxis] + reference_norms - 2 * queries @ reference.T
+            np.maximum(squared, 0, out=squared)
+
+            nearest = np.argpartition(squared, k - 1, axis=1)[:, :k] if k < len(reference) \
+                else np.broadcast_to(np.arange(k), squared.shape).copy()
+            nearest_squared = np.take_along_axis(squared, nearest, axis=1)
+            order = np.argsort(nearest_squared, axis=1)
+            end = start + len(queries)
+            indices[start:end] = np.take_along_axis(nearest, order, axis=1)
+            distances[start:end] = np.sqrt(np.take_along_axis(nearest_squared, order, axis=1) / len(positions))
+        return indices, distances
+
+    def nearest(self, cards, k=1):
+        """DataFrame con nombre, tipo y distancia de los k vecinos (columnas nearest_1, distance_1, ...)"""
+        indices, distances = self.query(cards, k)
+        result = {}
+        for j in range(indices.shape[1]):
+            result[f'nearest_{j + 1}'] = self.names[indices[:, j]]
+            result[f'nearest_type_{j + 1}'] = self.types[indices[:, j]]
+            result[f'distance_{j + 1}'] = distances[:, j]
+        return pd.DataFrame(result, index=cards.index)
+
+    def near_copy_mask(self, cards, threshold=NEAR_COPY_DISTANCE):
+        """True para las cartas casi idénticas a alguna carta real"""
+        _, distances = self.query(cards, k=1)
+        return distances[:, 0] <= threshold
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cartas reales más parecidas a un lote de cartas")
+    parser.add_argument('cards', help="Cartas a consultar (.parquet o .csv)")
+    parser.add_argument('--reference', default=REFERENCE_CSV, help="Cartas reales")
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--output', default=None, help="Guarda las cartas con sus vecinas (.parquet o .csv)")
+    args = parser.parse_args(argv)
+
+    cards = pd.read_parquet(args.cards) if args.cards.endswith('.parquet') else pd.read_csv(args.cards)
+    index = CardIndex.from_csv(args.reference)
+
+    start = time.perf_counter()
+    neighbours = index.nearest(cards, k=args.k)
+    elapsed = time.perf_counter() - start
+    near_copies = int((neighbours['distance_1'] <= NEAR_COPY_DISTANCE).sum())
+    print(f"{len(cards)} consultas en {elapsed:.2f}s; {near_copies} casi copias de cartas reales")
+
+    if args.output:
+        directory = os.path.dirname(os.path.abspath(args.output))
+        os.makedirs(directory, exist_ok=True)
+        result = pd.concat([cards, neighbours], axis=1)
+        if args.output.endswith('.parquet'):
+            result.to_parquet(args.output, index=False)
+        else:
+            result.to_csv(args.output, index=False, encoding='utf-8')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
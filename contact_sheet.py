@@ -0,0 +1,171 @@
+"""Hojas de contactos paginadas para revisar muchas cartas generadas.
+
+Sustituye a la galería de matplotlib de IAGenThirdPhase, que abría todas las
+cartas a la vez en una figura de 18 x 6*filas pulgadas y no pasaba de unas
+decenas. Aquí las cartas entran de una en una, se reducen a miniatura una sola
+vez y se pegan en la página en curso; al llenarse, la página se guarda y se
+libera. La memoria queda acotada a una página más una carta sea cual sea el
+número de cartas.
+
+Uso:
+    python contact_sheet.py cartas/ --output hojas/ --columns 8 --rows 6
+"""
+import argparse
+import os
+import sys
+
+from PIL import Image, ImageDraw
+
+from card_composition import get_font
+from text_layout import fit_text
+
+DEFAULT_THUMB_SIZE = (180, 240)
+
+
+class ContactSheetWriter:
+    def __init__(self, output_pattern='diffusion_gallery_{page:03d}.png', columns=6, rows=4,
+                 thumb_size=DEFAULT_THUMB_SIZE, caption_lines=3, title=None, background='#1a1a1a', padding=10):
+        self.output_pattern = output_pattern
+        self.columns = columns
+        self.rows = rows
+        self.thumb_size = thumb_size
+        self.caption_lines = caption_lines
+        self.title = title
+        self.background = background
+        self.padding = padding
+
+        self.font_caption = get_font(11)
+        self.font_title = get_font(18)
+        self.caption_line_height = 14
+        self.header_height = 40 if title else 0
+        self.cell_width = thumb_size[0] + padding
+        self.cell_height = thumb_size[1] + caption_lines * self.caption_line_height + padding * 2
+
+        self.files = []
+        self._page = None
+        self._draw = None
+        self._count = 0
+
+    @property
+    def page_size(self):
+        return (self.columns * self.cell_width + self.padding,
+                self.header_height + self.rows * self.cell_height + self.padding)
+
+    def _new_page(self):
+        self._page = Image.new('RGB', self.page_size, color=self.background)
+        self._draw = ImageDraw.Draw(self._page)
+        if self.title:
+            page_number = len(self.files) + 1
+            self._draw.text((self.padding, 10), f"{self.title} - página {page_number}",
+                            fill='white', font=self.font_title)
+        self._count = 0
+
+    def add(self, image, caption=()):
+        """Añade una carta (ruta o imagen PIL) con sus líneas de pie de foto"""
+        if self._page is None:
+            self._new_page()
+
+        column = self._count % self.columns
+        row = self._count // self.columns
+        x = self.padding + column * self.cell_width
+        y = self.header_height + self.padding + row * self.cell_height
+
+        try:
+            thumbnail = self._thumbnail(image)
+            # Centrada en la celda si la proporción no coincide
+            offset_x = (self.thumb_size[0] - thumbnail.width) // 2
+            offset_y = (self.thumb_size[1] - thumbnail.height) // 2
+            self._page.paste(thumbnail, (x + offset_x, y + offset_y))
+        except (OSError, ValueError) as e:
+            self._draw.rectangle([x, y, x + self.thumb_size[0], y + self.thumb_size[1]], outline='#E74C3C')
+            caption = [f"Error: {str(e)[:40]}"] + list(caption)
+
+        caption_y = y + self.thumb_size[1] + 4
+        for i, line in enumerate(list(caption)[:self.caption_lines]):
+            text = fit_text(str(line), self.font_caption, self.thumb_size[0])
+            self._draw.text((x, caption_y + i * self.caption_line_height), text, fill='#BDC3C7', font=self.font_caption)
+
+        self._count += 1
+        if self._count == self.columns * self.rows:
+            self._flush()
+
+    def _thumbnail(self, image):
+        # La miniatura se calcula una vez por carta; con rutas, la imagen se cierra enseguida
+        if isinstance(image, (str, os.PathLike)):
+            with Image.open(image) as opened:
+                opened.draft('RGB', self.thumb_size)
+                return self._reduce(opened)
+        return self._reduce(image)
+
+    def _reduce(self, image):
+        thumbnail = image.convert('RGB')
+        thumbnail.thumbnail(self.thumb_size, Image.Resampling.LANCZOS)
+        return thumbnail
+
+    def _flush(self):
+        if self._page is None or self._count == 0:
+            return
+        filename = self.output_pattern.format(page=len(self.files) + 1)
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._page.save(filename, optimize=True)
+        self.files.append(filename)
+        self._page = None
+        self._draw = None
+        self._count = 0
+
+    def close(self):
+        """Guarda la última página (incompleta) y devuelve la lista de ficheros"""
+        self._flush()
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def build_contact_sheets(items, **kwargs):
+    """items: iterable de (imagen o ruta, líneas de pie de foto); devuelve las páginas escritas"""
+    with ContactSheetWriter(**kwargs) as writer:
+        for image, caption in items:
+            writer.add(image, caption)
+    return writer.files
+
+
+def _manifest_items(cards_dir):
+    from render_cards import MANIFEST_NAME, load_manifest
+
+    for card_id, entry in sorted(load_manifest(os.path.join(cards_dir, MANIFEST_NAME)).items()):
+        attributes = entry.get('attributes', {})
+        health = attributes.get('Health (+Shield)', attributes.get('Health', '-'))
+        caption = [
+            f"#{card_id} {entry.get('card_name', '')}",
+            f"{str(attributes.get('Type', ''))[:12]}",
+            f"Coste:{attributes.get('Cost', '-')} Daño:{attributes.get('Damage', '-')} Vida:{health}",
+        ]
+        yield os.path.join(cards_dir, entry['file']), caption
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hojas de contactos de las cartas renderizadas")
+    parser.add_argument('cards_dir', help="Directorio de salida de render_cards.py (con manifest.jsonl)")
+    parser.add_argument('--output', default='hojas_contacto', help="Directorio de las hojas")
+    parser.add_argument('--columns', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=6)
+    args = parser.parse_args(argv)
+
+    files = build_contact_sheets(
+        _manifest_items(args.cards_dir),
+        output_pattern=os.path.join(args.output, 'hoja_{page:03d}.png'),
+        columns=args.columns, rows=args.rows,
+        title="CARTAS GENERADAS"
+    )
+    print(f"{len(files)} hojas de contactos en {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
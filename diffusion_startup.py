@@ -0,0 +1,220 @@
+"""Arranque rápido del pipeline de Stable Diffusion.
+
+Cada proceso nuevo de Streamlit llamaba a StableDiffusionPipeline.from_pretrained
+("runwayml/stable-diffusion-v1-5") en la primera petición y el usuario no veía
+nada hasta que terminaba: resolver el modelo en el hub, leer los pesos y pasar
+el pipeline al dispositivo. Además las dos apps importaban torch y diffusers al
+cargarse, aunque solo se pidiera la narrativa. Este módulo solo importa la
+biblioteca estándar; torch y diffusers se importan dentro de las funciones.
+
+  - load_pipeline guarda la primera vez el modelo como snapshot local en
+    safetensors (CLASH_DIFFUSION_SNAPSHOT_DIR), ya con el dtype de destino. Las
+    cargas siguientes lo leen sin red y safetensors mapea los pesos en memoria
+    (mmap) en vez de copiarlos desde los .bin del hub.
+  - DiffusionStartup carga y prepara el pipeline en un hilo desde que arranca
+    la app (CLASH_DIFFUSION_PRELOAD=1) y termina con una inferencia corta de
+    calentamiento, así que la primera carta no paga la inicialización de kernels.
+  - Cada fase (import, download, snapshot, load, to_device, setup, warmup)
+    queda medida en startup.report().
+
+Para réplicas autoescaladas, el snapshot se puede preparar al construir la
+imagen del contenedor:
+    python diffusion_startup.py --model runwayml/stable-diffusion-v1-5
+"""
+import argparse
+import contextlib
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_MODEL_ID = "runwayml/stable-diffusion-v1-5"
+SNAPSHOT_DIR = os.environ.get(
+    "CLASH_DIFFUSION_SNAPSHOT_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "clash_cards", "diffusion")
+)
+PRELOAD = os.environ.get("CLASH_DIFFUSION_PRELOAD", "1") == "1"
+WARMUP_STEPS = 2
+WARMUP_PROMPT = "Clash Royale game art style"
+
+
+@functools.lru_cache(maxsize=None)
+def detect_device():
+    """"cuda" o "cpu"; importa torch solo la primera vez que se pregunta"""
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def snapshot_path(model_id, dtype_name, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, f"{model_id.replace('/', '--')}-{dtype_name}")
+
+
+def _has_snapshot(path):
+    return os.path.exists(os.path.join(path, 'model_index.json'))
+
+
+def save_snapshot(pipeline, path):
+    """Guarda el pipeline en safetensors; el directorio aparece completo o no aparece"""
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        pipeline.save_pretrained(tmp_path, safe_serialization=True)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Otro proceso lo guardó antes: vale el suyo
+        if not _has_snapshot(path):
+            raise
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def load_pipeline(model_id=DEFAULT_MODEL_ID, device=None, startup=None, snapshot_dir=SNAPSHOT_DIR):
+    """StableDiffusionPipeline con DPMSolverMultistepScheduler en el dispositivo, desde el snapshot local si existe"""
+    phase = startup.phase if startup is not None else _untimed
+    with phase('import'):
+        import torch
+        from diffusers import DPMSolverMultistepScheduler, StableDiffusionPipeline
+
+    device = device or detect_device()
+    torch_dtype = torch.float16 if device == "cuda" else torch.float32
+    options = {'torch_dtype': torch_dtype, 'safety_checker': None, 'requires_safety_checker': False}
+
+    path = snapshot_path(model_id, str(torch_dtype).split('.')[-1], snapshot_dir)
+    if os.path.isdir(model_id):
+        # Directorio local del usuario: se carga tal cual, sea safetensors o .bin
+        with phase('load'):
+            pipeline = StableDiffusionPipeline.from_pretrained(model_id, local_files_only=True, **options)
+    elif _has_snapshot(path):
+        with phase('load'):
+            pipeline = StableDiffusionPipeline.from_pretrained(path, use_safetensors=True, local_files_only=True,
+                                                               **options)
+    else:
+        with phase('download'):
+            pipeline = StableDiffusionPipeline.from_pretrained(model_id, **options)
+        with phase('snapshot'):
+            save_snapshot(pipeline, path)
+    # Las claves de las cachés (imágenes, embeddings, ONNX) siguen usando el id del hub, no la ruta local
+    pipeline.register_to_config(_name_or_path=model_id)
+
+    pipeline.scheduler = DPMSolverMultistepScheduler.from_config(pipeline.scheduler.config)
+    with phase('to_device'):
+        pipeline = pipeline.to(device)
+    return pipeline
+
+
+def warm_up(pipeline, width=512, height=512, prompt_embeds=None, negative_prompt_embeds=None, steps=WARMUP_STEPS):
+    """Inferencia corta para inicializar kernels, autocast y VAE antes de la primera carta real"""
+    import torch
+    from inference_profiles import inference_context
+
+    if prompt_embeds is not None:
+        prompts = {'prompt_embeds': prompt_embeds, 'negative_prompt_embeds': negative_prompt_embeds}
+    else:
+        prompts = {'prompt': WARMUP_PROMPT}
+    with torch.inference_mode(), inference_context(getattr(pipeline, 'inference_profile', None)):
+        pipeline(num_inference_steps=steps, width=width, height=height, **prompts)
+
+
+@contextlib.contextmanager
+def _untimed(name):
+    yield
+
+
+class DiffusionStartup:
+    def __init__(self, setup, warmup=None, preload=PRELOAD):
+        # setup(startup) -> pipeline; puede usar startup.phase(...) y startup.warn(...)
+        self.setup = setup
+        self.warmup = warmup
+        self.pipeline = None
+        self.error = None
+        self.warnings = []
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        if preload:
+            self.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Acumula en timings[name] los segundos que tarda el bloque"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def warn(self, message):
+        """Avisos del hilo de carga; la app los muestra en el hilo de Streamlit"""
+        self.warnings.append(message)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='diffusion-startup', daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            pipeline = self.setup(self)
+            if pipeline is not None and self.warmup is not None:
+                try:
+                    with self.phase('warmup'):
+                        self.warmup(pipeline)
+                except Exception as e:
+                    self.warn(f"Calentamiento fallido, la primera carta será más lenta: {e}")
+            self.pipeline = pipeline
+        except Exception as e:
+            self.error = e
+        finally:
+            self.timings['total'] = time.perf_counter() - start
+            self._done.set()
+            print(f"Arranque de difusión: {self.summary()}")
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        """Pipeline listo (espera a que termine la carga); None si falló o no terminó a tiempo"""
+        self.start()
+        self._done.wait(timeout)
+        return self.pipeline
+
+    def report(self):
+        """Segundos por fase, en el orden en que se ejecutaron"""
+        return dict(self.timings)
+
+    def summary(self):
+        return ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.report().items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prepara el snapshot local del modelo de difusión y mide el arranque")
+    parser.add_argument('--model', default=DEFAULT_MODEL_ID)
+    parser.add_argument('--device', default=None, help="cuda o cpu (por defecto, el disponible)")
+    parser.add_argument('--warmup', action='store_true', help="Añade la inferencia de calentamiento")
+    args = parser.parse_args(argv)
+
+    def setup(startup):
+        return load_pipeline(args.model, args.device, startup)
+
+    startup = DiffusionStartup(setup, warmup=warm_up if args.warmup else None, preload=False)
+    if startup.get() is None:
+        print(f"No se pudo cargar el modelo: {startup.error}")
+        return 1
+    for name, seconds in startup.report().items():
+        print(f"{name:>10}: {seconds:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
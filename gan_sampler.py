@@ -0,0 +1,221 @@
+"""Muestreo masivo de cartas sintéticas con el Generator de la GAN de IAGenSecondPhase.
+
+IAGenSecondPhase entrenaba la GAN y se quedaba con torch.randn(10, ...): diez
+cartas, desnormalizadas con scaler.inverse_transform a través de pandas y con
+el tipo elegido al azar, ignorando la parte one-hot de la salida. Aquí el
+Generator, los parámetros del MinMaxScaler y las categorías del
+OneHotEncoder se guardan juntos en un único fichero (save_sampler). GanSampler
+lo carga y genera por lotes: desnormaliza con NumPy, decodifica el tipo con el
+argmax de la cabeza one-hot y descarta con filtros vectorizados las cartas no
+válidas (coste entero fuera de 1-10, estadísticas negativas o no finitas).
+Los lotes se escriben en Parquet o CSV según se generan, así que la memoria no
+depende del número de cartas.
+
+Uso:
+    python gan_sampler.py gan_sampler.pt --count 1000000 --output candidatas.parquet
+    python gan_sampler.py gan_sampler.pt --count 200000 --output candidatas.csv --seed 7
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+SAMPLER_VERSION = 1
+DEFAULT_CHUNK_SIZE = 65536
+INTEGER_COLUMNS = ('Cost', 'Count', 'Level')
+COST_RANGE = (1, 10)
+# Lotes sin ninguna carta válida seguidos antes de rendirse
+MAX_EMPTY_CHUNKS = 20
+
+
+class Generator(nn.Module):
+    def __init__(self, latent_dim, feature_dim):
+        super().__init__()
+        self.model = nn.Sequential(
+            nn.Linear(latent_dim, 64),
+            nn.ReLU(),
+            nn.Linear(64, feature_dim),
+            nn.Sigmoid()
+        )
+
+    def forward(self, z):
+        return self.model(z)
+
+
+def save_sampler(path, generator, scaler, encoder, numeric_cols, latent_dim, type_column='Type'):
+    """Guarda pesos del Generator, MinMaxScaler y categorías del OneHotEncoder en un solo fichero"""
+    artifact = {
+        'version': SAMPLER_VERSION,
+        'latent_dim': latent_dim,
+        'numeric_cols': list(numeric_cols),
+        'scaler_min': np.asarray(scaler.min_, dtype=np.float64).tolist(),
+        'scaler_scale': np.asarray(scaler.scale_, dtype=np.float64).tolist(),
+        'type_column': type_column,
+        'type_categories': [str(category) for category in encoder.categories_[0]],
+        'state_dict': {key: value.detach().cpu() for key, value in generator.state_dict().items()},
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            torch.save(artifact, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+class GanSampler:
+    def __init__(self, artifact, device=None):
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.latent_dim = artifact['latent_dim']
+        self.numeric_cols = artifact['numeric_cols']
+        self.type_column = artifact['type_column']
+        self.type_categories = np.asarray(artifact['type_categories'], dtype=object)
+        self.scaler_min = np.asarray(artifact['scaler_min'], dtype=np.float64)
+        self.scaler_scale = np.asarray(artifact['scaler_scale'], dtype=np.float64)
+
+        feature_dim = len(self.numeric_cols) + len(self.type_categories)
+        self.generator = Generator(self.latent_dim, feature_dim)
+        self.generator.load_state_dict(artifact['state_dict'])
+        self.generator.to(self.device).eval()
+
+    @classmethod
+    def load(cls, path, device=None):
+        return cls(torch.load(path, map_location='cpu'), device=device)
+
+    def sample_raw(self, count, generator=None):
+        """Salida del Generator para count vectores latentes (array NumPy)"""
+        with torch.inference_mode():
+            z = torch.randn(count, self.latent_dim, generator=generator).to(self.device)
+            return self.generator(z).cpu().numpy()
+
+    def decode(self, raw):
+        """Desnormaliza las columnas numéricas y decodifica el tipo por argmax; devuelve (valores, tipos)"""
+        numeric_count = len(self.numeric_cols)
+        # Inversa de MinMaxScaler: X = (X_escalado - min_) / scale_
+        values = (raw[:, :numeric_count].astype(np.float64) - self.scaler_min) / self.scaler_scale
+        types = self.type_categories[np.argmax(raw[:, numeric_count:], axis=1)]
+        return values, types
+
+    def valid_mask(self, values):
+        """Cartas válidas: todo finito y no negativo, coste entero dentro de COST_RANGE"""
+        mask = np.isfinite(values).all(axis=1) & (values >= 0).all(axis=1)
+        if 'Cost' in self.numeric_cols:
+            cost = values[:, self.numeric_cols.index('Cost')]
+            mask &= (cost >= COST_RANGE[0]) & (cost <= COST_RANGE[1])
+        return mask
+
+    def sample(self, count, chunk_size=DEFAULT_CHUNK_SIZE, seed=None, keep=None):
+        """Genera lotes (DataFrames) hasta reunir count cartas válidas; keep(lote) -> máscara filtra además"""
+        generator = torch.Generator()
+        if seed is not None:
+            generator.manual_seed(seed)
+        else:
+            generator.seed()
+
+        integer_indices = [self.numeric_cols.index(column) for column in INTEGER_COLUMNS if column in self.numeric_cols]
+        remaining = count
+        empty_chunks = 0
+        while remaining > 0:
+            values, types = self.decode(self.sample_raw(chunk_size, generator))
+            # Redondeo antes de filtrar: el rango de coste se comprueba sobre el entero
+            values[:, integer_indices] = np.rint(values[:, integer_indices])
+            mask = self.valid_mask(values)
+            chunk = self._frame(values[mask], types[mask], integer_indices)
+            if keep is not None and len(chunk):
+                # p. ej. BalanceScorer.balanced_mask: el filtro de equilibrio va dentro del bucle
+                chunk = chunk[keep(chunk)].reset_index(drop=True)
+            chunk = chunk.iloc[:remaining]
+
+            if len(chunk) == 0:
+                empty_chunks += 1
+                if empty_chunks >= MAX_EMPTY_CHUNKS:
+                    raise RuntimeError(f"{MAX_EMPTY_CHUNKS} lotes seguidos sin cartas válidas")
+                continue
+            empty_chunks = 0
+            remaining -= len(chunk)
+            yield chunk
+
+    def _frame(self, values, types, integer_indices):
+        chunk = pd.DataFrame(values, columns=self.numeric_cols)
+        for column in integer_indices:
+            chunk[self.numeric_cols[column]] = chunk[self.numeric_cols[column]].astype(np.int64)
+        chunk[self.type_column] = types
+        return chunk
+
+
+def write_cards(sampler, count, output_path, chunk_size=DEFAULT_CHUNK_SIZE, seed=None, keep=None):
+    """Escribe count cartas en Parquet (.parquet) o CSV lote a lote; devuelve el número de filas"""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = output_path + '.tmp'
+    parquet = output_path.endswith('.parquet')
+    if parquet:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+    written = 0
+    writer = None
+    try:
+        for chunk in sampler.sample(count, chunk_size=chunk_size, seed=seed, keep=keep):
+            if parquet:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+            else:
+                chunk.to_csv(tmp_path, mode='w' if written == 0 else 'a', header=written == 0,
+                             index=False, encoding='utf-8')
+            written += len(chunk)
+        if writer is not None:
+            writer.close()
+            writer = None
+        os.replace(tmp_path, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera cartas sintéticas con el Generator de la GAN")
+    parser.add_argument('sampler', help="Fichero guardado con save_sampler (p. ej. gan_sampler.pt)")
+    parser.add_argument('--count', type=int, default=100000, help="Cartas válidas a generar")
+    parser.add_argument('--output', default='cartas_sinteticas.parquet', help="Salida .parquet o .csv")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--balance-tolerance', type=float, default=None,
+                        help="Conserva solo cartas con |balance_score| <= tolerancia (balance_sim.py)")
+    args = parser.parse_args(argv)
+
+    sampler = GanSampler.load(args.sampler)
+    keep = None
+    if args.balance_tolerance is not None:
+        from balance_sim import BalanceScorer
+
+        scorer = BalanceScorer.from_csv()
+
+        def balanced(chunk):
+            return scorer.balanced_mask(chunk, args.balance_tolerance)
+        keep = balanced
+    start = time.perf_counter()
+    written = write_cards(sampler, args.count, args.output, chunk_size=args.chunk_size, seed=args.seed, keep=keep)
+    elapsed = time.perf_counter() - start
+    print(f"{written} cartas en {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f} cartas/s) -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
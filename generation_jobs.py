@@ -0,0 +1,136 @@
+"""Cola de trabajos de generación en segundo plano para las apps de Streamlit.
+
+El botón "Generar carta" ya no ejecuta la difusión en el hilo del script: se
+encola un trabajo con identificador, un hilo trabajador lo ejecuta y la página
+consulta su estado en cada rerun. El progreso por paso llega a través del
+callback_on_step_end de diffusers, y ese mismo callback aborta la generación
+cuando el trabajo se cancela (por ejemplo, si el usuario cambia el prompt) y,
+si el trabajo tiene un previewer, publica cada pocos pasos una vista previa de
+los latentes.
+"""
+import queue
+import threading
+import time
+import uuid
+
+
+class GenerationCancelled(Exception):
+    """La generación se canceló antes de terminar"""
+
+
+class GenerationJob:
+    PENDING = 'pendiente'
+    RUNNING = 'en curso'
+    DONE = 'terminado'
+    FAILED = 'error'
+    CANCELLED = 'cancelado'
+
+    def __init__(self, func, total_steps=None, previewer=None):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.previewer = previewer
+        self.preview = None
+        self.status = self.PENDING
+        self.step = 0
+        self.total_steps = total_steps
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in (self.DONE, self.FAILED, self.CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def progress(self):
+        """Fracción completada entre 0 y 1"""
+        if self.status == self.DONE:
+            return 1.0
+        if not self.total_steps:
+            return 0.0
+        return min(self.step / self.total_steps, 1.0)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled(self.id)
+
+    def step_callback(self, pipeline, step, timestep, callback_kwargs):
+        """Callback para callback_on_step_end: registra el paso y corta si se canceló"""
+        self.step = step + 1
+        self.check_cancelled()
+        if self.previewer is not None and self.previewer.should_preview(self.step, self.total_steps):
+            self.preview = self.previewer.decode(callback_kwargs['latents'])
+        return callback_kwargs
+
+
+class GenerationJobQueue:
+    def __init__(self, num_workers=1, keep_finished_seconds=600):
+        self.keep_finished_seconds = keep_finished_seconds
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker, name=f"generation-worker-{i}", daemon=True)
+            worker.start()
+
+    def submit(self, func, total_steps=None, previewer=None):
+        """Encola func(job) y devuelve el id del trabajo"""
+        job = GenerationJob(func, total_steps=total_steps, previewer=previewer)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._queue.put(job)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and not job.done:
+            job.cancel()
+        return job
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job.cancelled:
+                self._finish(job, GenerationJob.CANCELLED)
+                continue
+
+            job.status = GenerationJob.RUNNING
+            try:
+                job.result = job.func(job)
+                # Una cancelación tardía descarta el resultado
+                self._finish(job, GenerationJob.CANCELLED if job.cancelled else GenerationJob.DONE)
+            except GenerationCancelled:
+                self._finish(job, GenerationJob.CANCELLED)
+            except Exception as e:
+                job.error = str(e)
+                self._finish(job, GenerationJob.FAILED)
+
+    def _finish(self, job, status):
+        job.finished_at = time.time()
+        job.func = None
+        job.previewer = None
+        job.status = status
+
+    def _prune(self):
+        # Los resultados terminados se conservan un tiempo para el polling y luego se liberan
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.done and now - job.finished_at > self.keep_finished_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,185 @@
+"""Métricas medidas por etapa de la generación de cartas con difusión.
+
+analyze_diffusion_results (IAGenThirdPhase) informaba de valores inventados:
+'860M (UNet + VAE + CLIP)' parámetros, 'Approx. 4-6GB VRAM' y un 85.0 de
+adherencia al prompt. GenerationMetrics registra lo que de verdad ocurre en
+cada generación:
+
+  - segundos por etapa: text_encode (embeddings CLIP), unet_step (cada paso,
+    con los instantes de StepTimer), vae_decode (desde el último paso hasta
+    que el pipeline devuelve la imagen: decodificación VAE y paso a PIL),
+    composition (marco y textos de la carta) y png_encode;
+  - pico de memoria residente del proceso (ru_maxrss) y, con CUDA, las
+    estadísticas del asignador de torch (asignado, reservado y sus picos);
+  - parámetros reales de unet, vae y text_encoder del pipeline cargado.
+
+Es seguro entre hilos (la cola de trabajos genera en otro hilo) y se exporta
+como líneas JSON (to_json_lines) o en el formato de texto de Prometheus
+(to_prometheus). Solo importa la biblioteca estándar; torch solo se consulta
+si ya está importado.
+"""
+import contextlib
+import json
+import math
+import sys
+import threading
+import time
+
+STAGES = ('text_encode', 'unet_step', 'vae_decode', 'composition', 'png_encode')
+PARAMETER_MODULES = ('unet', 'vae', 'text_encoder')
+# Muestras guardadas por etapa para los percentiles; count y sum cuentan todas
+MAX_SAMPLES = 2048
+PROMETHEUS_PREFIX = 'clash'
+
+
+def peak_rss_bytes():
+    """Pico de memoria residente del proceso en bytes; None si la plataforma no lo da"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KiB y macOS en bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def torch_memory_stats():
+    """Estadísticas del asignador CUDA de torch (bytes); vacío sin CUDA o si torch no está cargado"""
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return {}
+    return {
+        'cuda_allocated_bytes': torch.cuda.memory_allocated(),
+        'cuda_reserved_bytes': torch.cuda.memory_reserved(),
+        'cuda_peak_allocated_bytes': torch.cuda.max_memory_allocated(),
+        'cuda_peak_reserved_bytes': torch.cuda.max_memory_reserved(),
+    }
+
+
+def parameter_counts(pipeline):
+    """Parámetros de cada módulo torch del pipeline (unet, vae, text_encoder) y su total"""
+    counts = {}
+    for name in PARAMETER_MODULES:
+        module = getattr(pipeline, name, None)
+        if module is not None and hasattr(module, 'parameters'):
+            counts[name] = sum(parameter.numel() for parameter in module.parameters())
+    if counts:
+        counts['total'] = sum(counts.values())
+    return counts
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class GenerationMetrics:
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.parameters = {}
+        self.memory = {}
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+        self._sums = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            samples = self._samples.setdefault(stage, [])
+            samples.append(seconds)
+            if len(samples) > self.max_samples:
+                del samples[0]
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+            self._sums[stage] = self._sums.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Mide el bloque como una muestra de la etapa name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def record_steps(self, timer, finished_at):
+        """Pasos de la UNet y decodificación VAE a partir de un StepTimer y del instante en que terminó el pipeline"""
+        for seconds in timer.step_seconds():
+            self.observe('unet_step', seconds)
+        if timer.timestamps:
+            self.observe('vae_decode', finished_at - timer.timestamps[-1])
+
+    def record_parameters(self, pipeline):
+        counts = parameter_counts(pipeline)
+        if counts:
+            self.parameters = counts
+        return counts
+
+    def sample_memory(self):
+        """Actualiza el pico de RSS y las estadísticas del asignador de torch"""
+        memory = torch_memory_stats()
+        rss = peak_rss_bytes()
+        if rss is not None:
+            memory['peak_rss_bytes'] = rss
+        self.memory = memory
+        return memory
+
+    def summary(self):
+        """Por etapa: muestras, total, media, p50, p95 y máximo en segundos"""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            counts = dict(self._counts)
+            sums = dict(self._sums)
+        ordered_stages = [stage for stage in STAGES if stage in samples] + \
+            sorted(stage for stage in samples if stage not in STAGES)
+        summary = {}
+        for stage in ordered_stages:
+            values = samples[stage]
+            summary[stage] = {
+                'count': counts[stage],
+                'total_seconds': sums[stage],
+                'mean_seconds': sums[stage] / counts[stage],
+                'p50_seconds': _percentile(values, 0.5),
+                'p95_seconds': _percentile(values, 0.95),
+                'max_seconds': values[-1],
+            }
+        return summary
+
+    def snapshot(self):
+        return {'stages': self.summary(), 'memory': dict(self.memory), 'parameters': dict(self.parameters)}
+
+    def to_json_lines(self):
+        """Una línea JSON por etapa, otra con la memoria y otra con los parámetros"""
+        timestamp = time.time()
+        lines = [
+            json.dumps({'timestamp': timestamp, 'metric': 'stage', 'stage': stage, **stats})
+            for stage, stats in self.summary().items()
+        ]
+        if self.memory:
+            lines.append(json.dumps({'timestamp': timestamp, 'metric': 'memory', **self.memory}))
+        if self.parameters:
+            lines.append(json.dumps({'timestamp': timestamp, 'metric': 'parameters', **self.parameters}))
+        return ''.join(line + '\n' for line in lines)
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """Formato de texto de exposición de Prometheus (summary por etapa y gauges)"""
+        lines = []
+        summary = self.summary()
+        if summary:
+            name = f'{prefix}_stage_seconds'
+            lines += [f'# HELP {name} Segundos por etapa de generación', f'# TYPE {name} summary']
+            for stage, stats in summary.items():
+                lines.append(f'{name}{{stage="{stage}",quantile="0.5"}} {stats["p50_seconds"]!r}')
+                lines.append(f'{name}{{stage="{stage}",quantile="0.95"}} {stats["p95_seconds"]!r}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {stats["total_seconds"]!r}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {stats["count"]}')
+        for key, value in self.memory.items():
+            name = f'{prefix}_{key}'
+            lines += [f'# HELP {name} Memoria del proceso ({key})', f'# TYPE {name} gauge', f'{name} {value}']
+        if self.parameters:
+            name = f'{prefix}_model_parameters'
+            lines += [f'# HELP {name} Parámetros del modelo cargado', f'# TYPE {name} gauge']
+            # Sin el total: sum(clash_model_parameters) ya lo da
+            for module, count in self.parameters.items():
+                if module == 'total':
+                    continue
+                lines.append(f'{name}{{module="{module}"}} {count}')
+        return ''.join(line + '\n' for line in lines)
@@ -0,0 +1,112 @@
+"""Caché persistente de imágenes generadas con Stable Diffusion.
+
+La imagen que devuelve generate_image_with_diffusion depende solo de
+(modelo, prompt, negative_prompt, pasos, guidance, tamaño, semilla), así que se
+guarda en disco con el hash de esa tupla como nombre. El directorio se comparte
+entre sesiones de Streamlit y entre procesos: las escrituras son atómicas
+(fichero temporal + os.replace) y la expulsión LRU usa la fecha de modificación,
+que se actualiza en cada acierto.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from PIL import Image
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "CLASH_IMAGE_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "clash_cards", "images")
+)
+DEFAULT_MAX_MB = int(os.environ.get("CLASH_IMAGE_CACHE_MAX_MB", "1024"))
+
+
+class DiffusionImageCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_mb=DEFAULT_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, model_id, prompt_data, seed, variant=""):
+        """Clave de contenido para una generación concreta"""
+        params = prompt_data['generation_params']
+        payload = {
+            'model_id': model_id,
+            'prompt': prompt_data['prompt'],
+            'negative_prompt': prompt_data['negative_prompt'],
+            'num_inference_steps': params['num_inference_steps'],
+            'guidance_scale': params['guidance_scale'],
+            # Orden de DPM-Solver++: un borrador de orden 1 y uno de orden 2 no dan la misma imagen
+            'solver_order': params.get('solver_order', 2),
+            'width': params['width'],
+            'height': params['height'],
+            'seed': seed,
+            # Dispositivo/precisión: fp16 en GPU y fp32 en CPU no dan los mismos píxeles
+            'variant': variant,
+        }
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def get(self, key):
+        """Devuelve la imagen cacheada o None"""
+        path = self._path(key)
+        try:
+            with Image.open(path) as cached:
+                image = cached.convert('RGB')
+            # Marcar como usada recientemente para la expulsión LRU
+            os.utime(path)
+            return image
+        except OSError:
+            return None
+
+    def put(self, key, image):
+        """Guarda la imagen de forma atómica y aplica el límite de tamaño"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    image.save(tmp_file, format='PNG')
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._evict()
+        except OSError:
+            # Un fallo de la caché nunca debe romper la generación
+            pass
+
+    def _evict(self):
+        """Elimina las entradas menos usadas hasta quedar por debajo de max_bytes"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.png'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Otro proceso ya la expulsó
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
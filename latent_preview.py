@@ -0,0 +1,42 @@
+"""Vistas previas baratas de los latentes durante la difusión.
+
+En lugar de pasar los latentes intermedios por el VAE completo, se proyectan
+linealmente de los 4 canales latentes de SD 1.x a RGB (coeficientes
+aproximados de la decodificación del VAE). La imagen sale a 1/8 de resolución,
+suficiente para que el usuario vea hacia dónde va la generación y la pare si no
+le gusta.
+"""
+import torch
+from PIL import Image
+
+# Proyección latente -> RGB para Stable Diffusion 1.x (filas: canales latentes)
+SD15_LATENT_RGB_FACTORS = [
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+
+
+class LatentPreviewer:
+    def __init__(self, every_n_steps=5, preview_width=256, latent_rgb_factors=SD15_LATENT_RGB_FACTORS):
+        self.every_n_steps = every_n_steps
+        self.preview_width = preview_width
+        self._factors = torch.tensor(latent_rgb_factors, dtype=torch.float32)
+
+    def should_preview(self, step, total_steps=None):
+        """Cada every_n_steps pasos, salvo el último (ahí llega la imagen final)"""
+        if total_steps and step >= total_steps:
+            return False
+        return step % self.every_n_steps == 0
+
+    def decode(self, latents):
+        """Convierte latentes (B, 4, h, w) en una imagen RGB aproximada del primer elemento"""
+        with torch.no_grad():
+            latent = latents[0].detach().float().cpu()
+            rgb = torch.einsum('chw,cr->hwr', latent, self._factors)
+            rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).to(torch.uint8).numpy()
+
+        image = Image.fromarray(rgb, mode='RGB')
+        preview_height = max(1, round(self.preview_width * image.height / image.width))
+        return image.resize((self.preview_width, preview_height), Image.Resampling.BILINEAR)
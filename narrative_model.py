@@ -0,0 +1,212 @@
+"""Servicio de narrativas con el GPT-2 ajustado en IAGenSecondPhase.
+
+IAGenSecondPhase ajusta GPT2LMHeadModel sobre pares "[CLASH] atributos -> descripción"
+y lo guarda en ./clash-royale-model, pero las apps solo usaban plantillas. Este
+módulo carga el checkpoint una sola vez en un hilo propio y, en CPU, lo
+cuantiza a int8 con quantize_dynamic (las Conv1D de GPT-2 se convierten antes
+en nn.Linear, que es lo que cuantiza PyTorch). Las peticiones concurrentes se
+agrupan en lotes con relleno a la izquierda y se generan con la caché KV.
+
+Cada narrativa tiene un presupuesto de latencia: si el modelo aún no está
+cargado, si la media reciente de un lote ya supera el presupuesto o si la
+respuesta no llega a tiempo, se devuelve la narrativa de plantillas
+(generate_premium_clash_narrative) sin esperar más.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from narrative_tables import MIN_WORDS, clean_spanish_text_advanced, generate_premium_clash_narrative
+
+NARRATIVE_MODEL_DIR = os.environ.get('CLASH_NARRATIVE_MODEL_DIR', 'clash-royale-model')
+DEFAULT_NARRATIVE_BUDGET = float(os.environ.get('CLASH_NARRATIVE_BUDGET', '1.0'))
+MAX_BATCH_SIZE = 8
+BATCH_WAIT = 0.02
+MAX_NEW_TOKENS = 60
+EMA_ALPHA = 0.3
+# Cada cuántas peticiones descartadas por el presupuesto se manda una al modelo para actualizar la media
+PROBE_INTERVAL = 20
+
+
+def format_prompt(card_data):
+    """Prompt con el mismo formato que el dataset de fine-tuning"""
+    cost = int(card_data.get('Cost', 3))
+    damage = int(card_data.get('Damage', 0))
+    health = int(card_data.get('Health (+Shield)', card_data.get('Health', 0)))
+    card_type = card_data.get('Type', 'Troops and Defenses')
+    return f"[CLASH] Coste: {cost}, Daño: {damage}, Salud: {health}, Tipo: {card_type} -> "
+
+
+def conv1d_to_linear(module):
+    """Sustituye las Conv1D de GPT-2 por nn.Linear equivalentes (pesos traspuestos)"""
+    import torch.nn as nn
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+    return module
+
+
+def load_narrative_model(model_dir=NARRATIVE_MODEL_DIR, device=None, quantize=True):
+    """Carga tokenizador y modelo; en CPU, cuantización dinámica int8 de las capas lineales"""
+    import torch
+    from transformers import GPT2LMHeadModel, GPT2Tokenizer
+
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    tokenizer = GPT2Tokenizer.from_pretrained(model_dir)
+    # Relleno a la izquierda: en un lote todos los prompts acaban en la misma posición
+    tokenizer.padding_side = 'left'
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    model = GPT2LMHeadModel.from_pretrained(model_dir)
+    model.eval()
+    if device == 'cpu' and quantize:
+        model = torch.quantization.quantize_dynamic(conv1d_to_linear(model), {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        model.to(device)
+    return tokenizer, model, device
+
+
+class NarrativeModelServer:
+    def __init__(self, model_dir=NARRATIVE_MODEL_DIR, budget=DEFAULT_NARRATIVE_BUDGET, device=None, quantize=True,
+                 max_batch_size=MAX_BATCH_SIZE, batch_wait=BATCH_WAIT, max_new_tokens=MAX_NEW_TOKENS):
+        self.model_dir = model_dir
+        self.budget = budget
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self.max_new_tokens = max_new_tokens
+        self.tokenizer = None
+        self.model = None
+        self.device = device
+        self.error = None
+        # Segundos medios de un lote (EMA); None hasta el primer lote
+        self.expected_seconds = None
+        self._quantize = quantize
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._skipped = 0
+        threading.Thread(target=self._worker, name="narrative-model", daemon=True).start()
+
+    @property
+    def available(self):
+        return self._ready.is_set() and self.model is not None
+
+    def wait_until_ready(self, timeout=None):
+        self._ready.wait(timeout)
+        return self.available
+
+    def submit(self, card_data):
+        """Encola una carta y devuelve un Future con su narrativa ('' si el modelo no dio una válida)"""
+        if self._ready.is_set() and self.model is None:
+            raise RuntimeError(f"Modelo de narrativas no disponible: {self.error}")
+        future = Future()
+        self._queue.put((card_data, future))
+        return future
+
+    def narrative(self, card_data, budget=None, fallback=generate_premium_clash_narrative):
+        """Narrativa del modelo si llega dentro del presupuesto; si no, la de plantillas"""
+        budget = self.budget if budget is None else budget
+        if not self.available:
+            return fallback(card_data)
+
+        if self.expected_seconds is not None and self.expected_seconds > budget:
+            self._skipped += 1
+            if self._skipped % PROBE_INTERVAL == 0:
+                # Sin esperar: solo actualiza la media por si el modelo vuelve a ir rápido
+                self.submit(card_data)
+            return fallback(card_data)
+
+        future = self.submit(card_data)
+        try:
+            text = future.result(timeout=budget)
+        except FutureTimeout:
+            future.cancel()
+            return fallback(card_data)
+        except Exception:
+            return fallback(card_data)
+        return text or fallback(card_data)
+
+    def generate_batch(self, cards):
+        """Genera las narrativas de un lote de cartas en una sola llamada a generate"""
+        import torch
+
+        prompts = [format_prompt(card) for card in cards]
+        encoded = self.tokenizer(prompts, return_tensors='pt', padding=True).to(self.device)
+        with torch.inference_mode():
+            output = self.model.generate(
+                **encoded,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=True,
+                top_p=0.9,
+                temperature=0.8,
+                use_cache=True,
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+            )
+
+        texts = []
+        for tokens in output[:, encoded['input_ids'].shape[1]:]:
+            text = clean_spanish_text_advanced(self.tokenizer.decode(tokens, skip_special_tokens=True))
+            texts.append(text if len(text.split()) >= MIN_WORDS else '')
+        return texts
+
+    def _worker(self):
+        try:
+            self.tokenizer, self.model, self.device = load_narrative_model(self.model_dir, self.device, self._quantize)
+        except Exception as e:
+            self.error = str(e)
+            self.model = None
+            self._ready.set()
+            # Las peticiones encoladas durante la carga no se quedan esperando
+            while True:
+                try:
+                    _, future = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(RuntimeError(self.error))
+        self._ready.set()
+
+        while True:
+            batch = [self._queue.get()]
+            # Breve espera para juntar las peticiones que llegan a la vez
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Las que ya se resolvieron con plantillas (Future cancelado) no se generan
+            batch = [(card, future) for card, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                texts = self.generate_batch([card for card, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            seconds = time.perf_counter() - start
+            if self.expected_seconds is None:
+                self.expected_seconds = seconds
+            else:
+                self.expected_seconds = EMA_ALPHA * seconds + (1 - EMA_ALPHA) * self.expected_seconds
+            for (_, future), text in zip(batch, texts):
+                future.set_result(text)
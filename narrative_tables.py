@@ -0,0 +1,282 @@
+"""Narrativas de cartas por tablas, vectorizadas sobre DataFrames.
+
+generate_premium_clash_narrative (IAGenSecondPhase y StreamlitApp) se llamaba
+fila a fila desde iterrows(): formateaba todas las plantillas de su rama y
+pasaba la elegida por las ~16 re.sub de clean_spanish_text_advanced. Aquí las
+plantillas se guardan en una tabla por (tipo, banda de coste, banda de
+daño/vida) y se limpian una sola vez al crear la tabla, con los huecos de los
+números protegidos. Para un DataFrame entero la banda de cada fila se calcula
+con np.select, la plantilla se elige con un generador con semilla y los textos
+se montan columna a columna.
+
+El resultado de cada fila es el mismo que daría la función original con la
+misma plantilla elegida.
+
+Uso:
+    python narrative_tables.py clash_dataset_cleaned.csv --output clash_cards_narratives.csv --seed 42
+"""
+import argparse
+import random
+import re
+import string
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ENGLISH_WORDS = [
+    'vernal', 'recommended', 'spawner', 'locations', 'troops', 'defenses',
+    'damage', 'health', 'attack', 'defense', 'spell', 'building', 'unit'
+]
+
+_ENGLISH_WORDS = re.compile(r'\b(?:' + '|'.join(ENGLISH_WORDS) + r')\b', re.IGNORECASE)
+_INVALID_CHARS = re.compile(r'[^\w\s\.\!\?\,\:\;áéíóúÁÉÍÓÚñÑüÜ]')
+_QUESTION_MARKS = re.compile(r'\?+')
+_SPACES = re.compile(r'\s+')
+
+MIN_WORDS = 8
+FALLBACK_TEMPLATE = "¡Carta poderosa de {cost} elixir! Perfecta para dominar la arena. Los enemigos temerán su increíble poder destructivo."
+
+# Bandas en el orden de evaluación de generate_premium_clash_narrative: gana la primera que se cumple.
+# Las condiciones valen tanto para escalares como para columnas NumPy.
+NARRATIVE_BANDS = [
+    (('Damaging Spells', 'low', 'any'), lambda cost, damage, health, card_type: (card_type == 'Damaging Spells') & (cost <= 2)),
+    (('Damaging Spells', 'mid', 'any'), lambda cost, damage, health, card_type: (card_type == 'Damaging Spells') & (cost <= 4)),
+    (('Damaging Spells', 'high', 'any'), lambda cost, damage, health, card_type: card_type == 'Damaging Spells'),
+    (('Spawners', 'low', 'any'), lambda cost, damage, health, card_type: (card_type == 'Spawners') & (cost <= 4)),
+    (('Spawners', 'high', 'any'), lambda cost, damage, health, card_type: card_type == 'Spawners'),
+    (('Troops and Defenses', 'low', 'damage'), lambda cost, damage, health, card_type: (cost <= 2) & (damage > 100)),
+    (('Troops and Defenses', 'low', 'health'), lambda cost, damage, health, card_type: cost <= 2),
+    (('Troops and Defenses', 'mid', 'damage'), lambda cost, damage, health, card_type: (cost <= 4) & (damage > 300)),
+    (('Troops and Defenses', 'mid', 'health'), lambda cost, damage, health, card_type: (cost <= 4) & (health > 1500)),
+    (('Troops and Defenses', 'mid', 'balanced'), lambda cost, damage, health, card_type: cost <= 4),
+    (('Troops and Defenses', 'high', 'damage'), lambda cost, damage, health, card_type: damage > 500),
+    (('Troops and Defenses', 'high', 'health'), lambda cost, damage, health, card_type: health > 3000),
+]
+DEFAULT_BAND = ('Troops and Defenses', 'high', 'balanced')
+
+NARRATIVE_TEMPLATES = {
+    # Hechizos baratos, medios y caros
+    ('Damaging Spells', 'low', 'any'): [
+        "¡Hechizo rápido de {cost} elixir! Causa {damage} de daño instantáneo. Perfecto para eliminar tropas pequeñas y sorprender al enemigo.",
+        "¡Magia económica de {cost} elixir! Inflige {damage} puntos de daño en área. Los rivales no verán venir este devastador conjuro.",
+        "¡Conjuro veloz de {cost} elixir! Destruye con {damage} de daño. Ideal para ciclos rápidos y ataques sorpresa definitivos."
+    ],
+    ('Damaging Spells', 'mid', 'any'): [
+        "¡Hechizo poderoso de {cost} elixir! Arrasa enemigos con {damage} de daño brutal en zona amplia. Cambiará el destino de la batalla.",
+        "¡Conjuro versátil de {cost} elixir! Aniquila rivales con {damage} puntos de daño devastador. Úsalo sabiamente para la victoria.",
+        "¡Magia destructiva de {cost} elixir! Causa {damage} de daño letal en área. Los enemigos huirán aterrorizados del campo."
+    ],
+    ('Damaging Spells', 'high', 'any'): [
+        "¡Hechizo legendario de {cost} elixir! Aniquila todo con {damage} de daño masivo apocalíptico. Devastación total garantizada en la arena.",
+        "¡Conjuro supremo de {cost} elixir! Destrucción absoluta de {damage} puntos letales. Dominará completamente toda la arena de batalla.",
+        "¡Magia definitiva de {cost} elixir! Poder destructivo de {damage}. La victoria está completamente asegurada para siempre."
+    ],
+    # Estructuras baratas y caras
+    ('Spawners', 'low', 'any'): [
+        "¡Torre productora de {cost} elixir! Genera tropas continuamente sin parar. Resistencia sólida para defender tu corona victoriosamente.",
+        "¡Edificio spawner de {cost} elixir! Invoca unidades automáticamente en oleadas. Presión constante que abrumará a los enemigos.",
+        "¡Estructura generadora de {cost} elixir! Produce ejércitos sin descanso. Los rivales no podrán avanzar ni un solo paso."
+    ],
+    ('Spawners', 'high', 'any'): [
+        "¡Mega fortaleza de {cost} elixir! Genera oleadas masivas de tropas imparables. Dominará completamente el campo de batalla enemigo.",
+        "¡Super edificio de {cost} elixir! Invoca ejércitos legendarios continuamente. La presión será absolutamente abrumadora para los rivales.",
+        "¡Torre suprema de {cost} elixir! Producción masiva garantizada eternamente. Los enemigos se rendirán antes de la primera oleada."
+    ],
+    # Tropas baratas (hasta 2 de elixir)
+    ('Troops and Defenses', 'low', 'damage'): [
+        "¡Guerrero feroz de {cost} elixir! Ataque brutal de {damage} por golpe mortal. Perfecto para ataques sorpresa devastadores.",
+        "¡Luchador veloz de {cost} elixir! Golpea con {damage} de daño letal. Los enemigos caerán antes de reaccionar.",
+        "¡Asesino rápido de {cost} elixir! Causa {damage} puntos por impacto. Ideal para ciclos de muerte imparables."
+    ],
+    ('Troops and Defenses', 'low', 'health'): [
+        "¡Tropa económica de {cost} elixir! Resistencia sólida de {health} puntos. Perfecta para distraer y confundir enemigos.",
+        "¡Unidad barata de {cost} elixir! Aguanta {health} de daño heroicamente. Excelente para defensa y contraataques.",
+        "¡Soldado accesible de {cost} elixir! Vida resistente de {health}. Los rivales gastarán elixir extra innecesariamente."
+    ],
+    # Tropas medias (3-4 de elixir)
+    ('Troops and Defenses', 'mid', 'damage'): [
+        "¡Guerrero implacable de {cost} elixir! Daño devastador de {damage} por golpe brutal. Arrasará con cualquier enemigo del camino.",
+        "¡Luchador legendario de {cost} elixir! Ataque mortal de {damage} puntos. Los rivales huirán aterrorizados de su poder.",
+        "¡Soldado feroz de {cost} elixir! Golpe letal de {damage}. Devastación pura que aniquilará toda resistencia enemiga."
+    ],
+    ('Troops and Defenses', 'mid', 'health'): [
+        "¡Tanque invencible de {cost} elixir! Vida masiva de {health} puntos épicos. Absorbe todo el daño enemigo sin inmutarse.",
+        "¡Muro viviente de {cost} elixir! Resistencia titanica de {health}. Ningún ataque enemigo podrá detener su avance.",
+        "¡Fortaleza móvil de {cost} elixir! Aguanta {health} de daño heroicamente. Los enemigos se cansarán de atacar inútilmente."
+    ],
+    ('Troops and Defenses', 'mid', 'balanced'): [
+        "¡Tropa equilibrada de {cost} elixir! Combina {damage} de ataque y {health} de vida perfectamente. Versatilidad total asegurada.",
+        "¡Unidad completa de {cost} elixir! Estadísticas balanceadas ideales para toda situación. Funcionará en cualquier estrategia.",
+        "¡Soldado versátil de {cost} elixir! Poder y resistencia combinados magistralmente. Perfecto para cualquier táctica de batalla."
+    ],
+    # Tropas caras (5+ elixir)
+    ('Troops and Defenses', 'high', 'damage'): [
+        "¡Bestia legendaria de {cost} elixir! Poder destructivo de {damage} apocalíptico. Aniquilará completamente cualquier ejército enemigo existente.",
+        "¡Titán imparable de {cost} elixir! Fuerza brutal de {damage} devastadora. Los rivales abandonarán la partida al verlo aparecer.",
+        "¡Monstruo definitivo de {cost} elixir! Daño letal de {damage}. Dominación total asegurada para toda la eternidad."
+    ],
+    ('Troops and Defenses', 'high', 'health'): [
+        "¡Coloso invencible de {cost} elixir! Resistencia épica de {health} puntos legendarios. Será completamente imposible de destruir.",
+        "¡Gigante supremo de {cost} elixir! Vida masiva de {health}. Absorbe cualquier ataque sin sufrir daño significativo.",
+        "¡Titán defensivo de {cost} elixir! Aguanta {health} de daño épico. Los enemigos se agotarán antes de derrotarlo."
+    ],
+    ('Troops and Defenses', 'high', 'balanced'): [
+        "¡Campeón premium de {cost} elixir! Estadísticas superiores balanceadas perfectamente. Dominará toda la arena con superioridad.",
+        "¡Unidad élite de {cost} elixir! Poder y resistencia combinados magistralmente. La victoria está completamente garantizada.",
+        "¡Guerrero supremo de {cost} elixir! Perfección absoluta en combate. Los rivales no tienen ni la menor oportunidad."
+    ],
+}
+
+# Huecos de los números durante la limpieza: solo caracteres de palabra, sobreviven intactos
+_PLACEHOLDERS = {'cost': 'QQCOSTQQ', 'damage': 'QQDAMAGEQQ', 'health': 'QQHEALTHQQ'}
+
+
+def clean_spanish_text_advanced(text):
+    """Limpieza avanzada para garantizar español puro"""
+    # Quitar una palabra deja separadores a ambos lados: no se forman palabras nuevas y
+    # una sola pasada equivale a una re.sub por palabra
+    text = _ENGLISH_WORDS.sub('', text)
+    text = _INVALID_CHARS.sub('', text)
+    text = _QUESTION_MARKS.sub('', text)
+    text = _SPACES.sub(' ', text)
+    return text.strip()
+
+
+def clean_template(template):
+    """Limpia una plantilla conservando sus huecos {cost}, {damage} y {health}"""
+    for field, placeholder in _PLACEHOLDERS.items():
+        template = template.replace('{' + field + '}', placeholder)
+    template = clean_spanish_text_advanced(template)
+    for field, placeholder in _PLACEHOLDERS.items():
+        template = template.replace(placeholder, '{' + field + '}')
+    return template
+
+
+class NarrativeTable:
+    def __init__(self, templates=NARRATIVE_TEMPLATES, bands=NARRATIVE_BANDS, default_band=DEFAULT_BAND):
+        self.keys = [key for key, _ in bands] + [default_band]
+        self._conditions = [condition for _, condition in bands]
+
+        fallback = clean_template(FALLBACK_TEMPLATE)
+        self.templates = []
+        for key in self.keys:
+            cleaned = [clean_template(template) for template in templates[key]]
+            # La validación de longitud no depende de los números: se resuelve aquí
+            self.templates.append([
+                template if len(template.split()) >= MIN_WORDS else fallback for template in cleaned
+            ])
+
+        # Plantillas aplanadas y troceadas en (texto literal, campo) para montar columnas
+        self._offsets = np.cumsum([0] + [len(options) for options in self.templates])[:-1]
+        self._counts = np.array([len(options) for options in self.templates])
+        self._pieces = [
+            [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+            for options in self.templates for template in options
+        ]
+
+    def band(self, cost, damage, health, card_type):
+        """Índice de banda de una carta"""
+        for i, condition in enumerate(self._conditions):
+            if condition(cost, damage, health, card_type):
+                return i
+        return len(self._conditions)
+
+    def bands(self, cost, damage, health, card_type):
+        """Índice de banda de cada fila (columnas NumPy)"""
+        conditions = [condition(cost, damage, health, card_type) for condition in self._conditions]
+        return np.select(conditions, np.arange(len(conditions)), default=len(conditions))
+
+    def narrative(self, attributes, rng=random):
+        """Narrativa de una carta (dict de atributos), como generate_premium_clash_narrative"""
+        cost = int(attributes.get('Cost', 3))
+        damage = int(attributes.get('Damage', 0))
+        health = int(attributes.get('Health (+Shield)', 0))
+        card_type = attributes.get('Type', 'Troops and Defenses')
+
+        template = rng.choice(self.templates[self.band(cost, damage, health, card_type)])
+        # La limpieza original quitaba el signo menos de los números
+        return template.format(cost=abs(cost), damage=abs(damage), health=abs(health))
+
+    def generate(self, cards, seed=None, health_column='Health (+Shield)'):
+        """Narrativas de todas las filas de un DataFrame, con elección reproducible por semilla"""
+        count = len(cards)
+        columns = {
+            'cost': _int_column(cards, 'Cost', 3),
+            'damage': _int_column(cards, 'Damage', 0),
+            'health': _int_column(cards, health_column, 0),
+        }
+        if 'Type' in cards.columns:
+            card_type = cards['Type'].to_numpy(dtype=object)
+        else:
+            card_type = np.full(count, 'Troops and Defenses', dtype=object)
+
+        bands = self.bands(columns['cost'], columns['damage'], columns['health'], card_type)
+        rng = np.random.default_rng(seed)
+        choices = (rng.random(count) * self._counts[bands]).astype(int)
+        slots = self._offsets[bands] + choices
+
+        # Números como texto una sola vez por columna
+        texts = {field: np.abs(values).astype(str).astype(object) for field, values in columns.items()}
+
+        narratives = np.empty(count, dtype=object)
+        for slot in np.unique(slots):
+            rows = np.flatnonzero(slots == slot)
+            narrative = ''
+            for literal, field in self._pieces[slot]:
+                narrative = narrative + literal
+                if field:
+                    narrative = narrative + texts[field][rows]
+            narratives[rows] = narrative
+        return pd.Series(narratives, index=cards.index, name='Narrative')
+
+
+def _int_column(cards, column, default):
+    if column not in cards.columns:
+        return np.full(len(cards), default, dtype=np.int64)
+    values = pd.to_numeric(cards[column], errors='coerce').fillna(default)
+    # astype trunca hacia cero, igual que int()
+    return values.to_numpy(dtype=np.float64).astype(np.int64)
+
+
+NARRATIVE_TABLE = NarrativeTable()
+
+
+def generate_premium_clash_narrative(attributes):
+    """Generador premium de narrativas 100% en español auténtico"""
+    return NARRATIVE_TABLE.narrative(attributes)
+
+
+def generate_narratives(cards, seed=None, health_column='Health (+Shield)'):
+    return NARRATIVE_TABLE.generate(cards, seed=seed, health_column=health_column)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera narrativas para todas las cartas de un CSV")
+    parser.add_argument('csv', help="CSV con columnas Cost, Damage, Health (+Shield) y Type")
+    parser.add_argument('--output', default='clash_cards_narratives.csv')
+    parser.add_argument('--seed', type=int, default=None, help="Semilla de la elección de plantillas")
+    args = parser.parse_args(argv)
+
+    cards = pd.read_csv(args.csv)
+    health_column = 'Health (+Shield)' if 'Health (+Shield)' in cards.columns else 'Health'
+
+    start = time.perf_counter()
+    narratives = generate_narratives(cards, seed=args.seed, health_column=health_column)
+    elapsed = time.perf_counter() - start
+
+    results = pd.DataFrame({
+        'Cost': cards.get('Cost'),
+        'Damage': cards.get('Damage'),
+        'Health': cards.get(health_column),
+        'Type': cards.get('Type'),
+        'Narrative': narratives,
+    })
+    results.to_csv(args.output, index=False, encoding='utf-8')
+    print(f"{len(results)} narrativas en {elapsed:.2f}s -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
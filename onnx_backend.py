@@ -0,0 +1,322 @@
+"""Backend ONNX Runtime para la difusión de las cartas.
+
+Exporta una sola vez a ONNX el text encoder, la UNet y el decodificador del VAE
+de un StableDiffusionPipeline ya cargado, guarda los ficheros en disco y
+ejecuta el bucle del DPMSolverMultistepScheduler sobre el proveedor de CPU de
+ONNX Runtime (con todas las optimizaciones de grafo activadas).
+
+OnnxStableDiffusionBackend se llama igual que el pipeline de diffusers
+(prompt/prompt_embeds, negative_prompt/negative_prompt_embeds, pasos,
+guidance, tamaño, generator, callback_on_step_end) y devuelve un objeto con
+.images, así que entra directamente en generate_image_with_diffusion. Tras la
+exportación cada componente se compara numéricamente con el de PyTorch.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from PIL import Image
+
+BACKENDS = ('pytorch', 'onnx')
+DEFAULT_BACKEND = os.environ.get("CLASH_DIFFUSION_BACKEND", "pytorch")
+ONNX_CACHE_DIR = os.environ.get(
+    "CLASH_ONNX_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "clash_cards", "onnx")
+)
+ONNX_OPSET = 17
+# Tolerancia máxima (diferencia absoluta) entre la salida ONNX y la de PyTorch
+VALIDATION_ATOL = 1e-2
+
+
+class _TextEncoderExport(torch.nn.Module):
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids):
+        return self.text_encoder(input_ids, return_dict=False)[0]
+
+
+class _UNetExport(torch.nn.Module):
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, encoder_hidden_states):
+        return self.unet(sample, timestep, encoder_hidden_states, return_dict=False)[0]
+
+
+class _VaeDecoderExport(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latent_sample):
+        return self.vae.decode(latent_sample, return_dict=False)[0]
+
+
+def _export_inputs(pipeline):
+    """Entradas de ejemplo deterministas para exportar y validar cada componente"""
+    generator = torch.Generator().manual_seed(0)
+    max_length = pipeline.tokenizer.model_max_length
+    hidden_size = pipeline.text_encoder.config.hidden_size
+    latent_channels = pipeline.unet.config.in_channels
+    return {
+        'text_encoder': (torch.randint(0, pipeline.tokenizer.vocab_size, (1, max_length), generator=generator),),
+        'unet': (
+            torch.randn(2, latent_channels, 64, 64, generator=generator),
+            torch.tensor([500.0, 500.0]),
+            torch.randn(2, max_length, hidden_size, generator=generator),
+        ),
+        'vae_decoder': (torch.randn(1, pipeline.vae.config.latent_channels, 64, 64, generator=generator),),
+    }
+
+
+def export_pipeline_to_onnx(pipeline, output_dir, opset=ONNX_OPSET):
+    """Exporta text encoder, UNet y decodificador del VAE a output_dir/<componente>/model.onnx"""
+    import onnx
+
+    inputs = _export_inputs(pipeline)
+    components = {
+        'text_encoder': (
+            _TextEncoderExport(pipeline.text_encoder),
+            ['input_ids'], ['last_hidden_state'],
+            {'input_ids': {0: 'batch'}, 'last_hidden_state': {0: 'batch'}},
+        ),
+        'unet': (
+            _UNetExport(pipeline.unet),
+            ['sample', 'timestep', 'encoder_hidden_states'], ['out_sample'],
+            {
+                'sample': {0: 'batch', 2: 'height', 3: 'width'},
+                'timestep': {0: 'batch'},
+                'encoder_hidden_states': {0: 'batch'},
+                'out_sample': {0: 'batch', 2: 'height', 3: 'width'},
+            },
+        ),
+        'vae_decoder': (
+            _VaeDecoderExport(pipeline.vae),
+            ['latent_sample'], ['sample'],
+            {'latent_sample': {0: 'batch', 2: 'height', 3: 'width'}, 'sample': {0: 'batch', 2: 'height', 3: 'width'}},
+        ),
+    }
+
+    # El procesador de atención SDPA no se exporta bien: se usa el clásico y se restaura después
+    original_processors = pipeline.unet.attn_processors
+    pipeline.unet.set_default_attn_processor()
+    try:
+        for name, (module, input_names, output_names, dynamic_axes) in components.items():
+            component_dir = os.path.join(output_dir, name)
+            os.makedirs(component_dir, exist_ok=True)
+            model_path = os.path.join(component_dir, 'model.onnx')
+
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                tmp_path = os.path.join(tmp_dir, 'model.onnx')
+                with torch.no_grad():
+                    torch.onnx.export(
+                        module.eval(),
+                        inputs[name],
+                        tmp_path,
+                        input_names=input_names,
+                        output_names=output_names,
+                        dynamic_axes=dynamic_axes,
+                        opset_version=opset,
+                        do_constant_folding=True,
+                    )
+                # La UNet supera los 2 GB de protobuf: pesos en un único fichero externo
+                model = onnx.load(tmp_path)
+                onnx.save_model(
+                    model, model_path,
+                    save_as_external_data=True,
+                    all_tensors_to_one_file=True,
+                    location='weights.pb',
+                    convert_attribute=False,
+                )
+    finally:
+        pipeline.unet.set_attn_processor(original_processors)
+
+
+class OnnxComponent:
+    def __init__(self, model_path, providers, intra_op_threads=None, dtype=torch.float32):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads or os.cpu_count() or 1
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=list(providers))
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.dtype = dtype
+
+    def __call__(self, *arrays):
+        feeds = {name: np.ascontiguousarray(array) for name, array in zip(self.input_names, arrays)}
+        return self.session.run(None, feeds)[0]
+
+
+def validate_against_pytorch(pipeline, backend, atol=VALIDATION_ATOL):
+    """Compara cada componente ONNX con su equivalente PyTorch sobre las mismas entradas"""
+    inputs = _export_inputs(pipeline)
+    torch_modules = {
+        'text_encoder': _TextEncoderExport(pipeline.text_encoder),
+        'unet': _UNetExport(pipeline.unet),
+        'vae_decoder': _VaeDecoderExport(pipeline.vae),
+    }
+    onnx_components = {
+        'text_encoder': backend.text_encoder,
+        'unet': backend.unet,
+        'vae_decoder': backend.vae_decoder,
+    }
+
+    report = {}
+    for name, module in torch_modules.items():
+        with torch.no_grad():
+            expected = module.float()(*inputs[name]).numpy()
+        arrays = [tensor.numpy().astype(np.int64 if tensor.dtype == torch.int64 else np.float32) for tensor in inputs[name]]
+        actual = onnx_components[name](*arrays)
+        report[name] = float(np.max(np.abs(actual - expected)))
+
+    report['passed'] = all(diff <= atol for diff in report.values())
+    report['atol'] = atol
+    return report
+
+
+class OnnxStableDiffusionBackend:
+    def __init__(self, pipeline, cache_dir=ONNX_CACHE_DIR, providers=('CPUExecutionProvider',),
+                 intra_op_threads=None, atol=VALIDATION_ATOL):
+        from diffusers import DPMSolverMultistepScheduler
+
+        self.name_or_path = getattr(pipeline, 'name_or_path', None) or "runwayml/stable-diffusion-v1-5"
+        self.device = torch.device('cpu')
+        self.tokenizer = pipeline.tokenizer
+        # Copia propia del scheduler: guarda estado entre pasos
+        self.scheduler = DPMSolverMultistepScheduler.from_config(pipeline.scheduler.config)
+        self.vae_scale_factor = 2 ** (len(pipeline.vae.config.block_out_channels) - 1)
+        self.vae_scaling_factor = pipeline.vae.config.scaling_factor
+        self.latent_channels = pipeline.unet.config.in_channels
+        self.inference_profile = {'profile': 'onnx'}
+
+        key = hashlib.sha256(f"{self.name_or_path}|opset{ONNX_OPSET}|torch{torch.__version__}".encode()).hexdigest()[:16]
+        self.model_dir = os.path.join(cache_dir, key)
+        validation_path = os.path.join(self.model_dir, 'validation.json')
+
+        exported_now = False
+        if not os.path.exists(validation_path):
+            if os.path.exists(self.model_dir):
+                shutil.rmtree(self.model_dir)
+            export_pipeline_to_onnx(pipeline, self.model_dir)
+            exported_now = True
+
+        self.text_encoder = OnnxComponent(os.path.join(self.model_dir, 'text_encoder', 'model.onnx'), providers, intra_op_threads)
+        self.unet = OnnxComponent(os.path.join(self.model_dir, 'unet', 'model.onnx'), providers, intra_op_threads)
+        self.vae_decoder = OnnxComponent(os.path.join(self.model_dir, 'vae_decoder', 'model.onnx'), providers, intra_op_threads)
+
+        if exported_now:
+            # Validación numérica una vez por exportación; si no pasa, no se usa el backend
+            self.validation = validate_against_pytorch(pipeline, self, atol=atol)
+            if not self.validation['passed']:
+                shutil.rmtree(self.model_dir)
+                raise RuntimeError(f"La exportación ONNX no coincide con PyTorch: {self.validation}")
+            with open(validation_path, 'w', encoding='utf-8') as f:
+                json.dump(self.validation, f, indent=2)
+        else:
+            with open(validation_path, encoding='utf-8') as f:
+                self.validation = json.load(f)
+
+    def encode_prompt(self, prompt, device=None, num_images_per_prompt=1, do_classifier_free_guidance=False,
+                      negative_prompt=None):
+        """Misma interfaz que StableDiffusionPipeline.encode_prompt (sin LoRA ni clip_skip)"""
+        def encode(texts):
+            input_ids = self.tokenizer(
+                texts,
+                padding='max_length',
+                max_length=self.tokenizer.model_max_length,
+                truncation=True,
+                return_tensors='np'
+            ).input_ids.astype(np.int64)
+            embeds = torch.from_numpy(self.text_encoder(input_ids))
+            return embeds.repeat_interleave(num_images_per_prompt, dim=0)
+
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        prompt_embeds = encode(prompts)
+        negative_prompt_embeds = None
+        if do_classifier_free_guidance:
+            negatives = negative_prompt or ""
+            negatives = [negatives] * len(prompts) if isinstance(negatives, str) else list(negatives)
+            negative_prompt_embeds = encode(negatives)
+        return prompt_embeds, negative_prompt_embeds
+
+    def _initial_latents(self, batch_size, height, width, generator):
+        # Mismo muestreo que randn_tensor de diffusers en CPU: latentes idénticos al camino PyTorch
+        shape = (batch_size, self.latent_channels, height // self.vae_scale_factor, width // self.vae_scale_factor)
+        if isinstance(generator, list):
+            latents = [torch.randn((1,) + shape[1:], generator=g, dtype=torch.float32) for g in generator]
+            return torch.cat(latents, dim=0)
+        return torch.randn(shape, generator=generator, dtype=torch.float32)
+
+    def __call__(self, prompt=None, negative_prompt=None, prompt_embeds=None, negative_prompt_embeds=None,
+                 num_inference_steps=30, guidance_scale=7.5, width=512, height=512, num_images_per_prompt=1,
+                 generator=None, output_type='pil', callback_on_step_end=None, **kwargs):
+        do_guidance = guidance_scale > 1.0
+
+        if prompt_embeds is None:
+            prompt_embeds, negative_prompt_embeds = self.encode_prompt(
+                prompt, num_images_per_prompt=num_images_per_prompt,
+                do_classifier_free_guidance=do_guidance, negative_prompt=negative_prompt
+            )
+        elif do_guidance and negative_prompt_embeds is None:
+            negative_prompt_embeds = torch.zeros_like(prompt_embeds)
+
+        text_embeddings = prompt_embeds.float()
+        if do_guidance:
+            text_embeddings = torch.cat([negative_prompt_embeds.float(), text_embeddings])
+        text_embeddings = text_embeddings.cpu().numpy()
+
+        batch_size = prompt_embeds.shape[0]
+        latents = self._initial_latents(batch_size, height, width, generator)
+
+        self.scheduler.set_timesteps(num_inference_steps)
+        latents = latents * self.scheduler.init_noise_sigma
+
+        for i, t in enumerate(self.scheduler.timesteps):
+            latent_model_input = torch.cat([latents] * 2) if do_guidance else latents
+            latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
+            timestep = np.full((latent_model_input.shape[0],), float(t), dtype=np.float32)
+
+            noise_pred = torch.from_numpy(self.unet(
+                latent_model_input.numpy().astype(np.float32), timestep, text_embeddings
+            ))
+            if do_guidance:
+                noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+                noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_text - noise_pred_uncond)
+
+            latents = self.scheduler.step(noise_pred, t, latents, return_dict=False)[0]
+
+            if callback_on_step_end is not None:
+                callback_outputs = callback_on_step_end(self, i, t, {'latents': latents})
+                latents = callback_outputs.pop('latents', latents)
+
+        if output_type == 'latent':
+            return SimpleNamespace(images=latents)
+
+        image = self.vae_decoder((latents / self.vae_scaling_factor).numpy().astype(np.float32))
+        image = np.clip(image / 2 + 0.5, 0, 1).transpose(0, 2, 3, 1)
+        images = [Image.fromarray((sample * 255).round().astype('uint8')) for sample in image]
+        return SimpleNamespace(images=images)
+
+
+def compare_images_with_pytorch(pipeline, backend, prompt, num_inference_steps=20, width=512, height=512, seed=0):
+    """Comprobación de extremo a extremo: misma semilla en ambos caminos, diferencia de píxeles"""
+    outputs = []
+    for runner in (pipeline, backend):
+        generator = torch.Generator().manual_seed(seed)
+        with torch.inference_mode():
+            result = runner(
+                prompt=prompt, num_inference_steps=num_inference_steps,
+                width=width, height=height, generator=generator
+            )
+        outputs.append(np.asarray(result.images[0], dtype=np.int16))
+    diff = np.abs(outputs[0] - outputs[1])
+    return {'max_pixel_diff': int(diff.max()), 'mean_pixel_diff': float(diff.mean())}
@@ -0,0 +1,96 @@
+"""Tabla de embeddings CLIP precalculados para los prompts de difusión.
+
+generate_diffusion_prompt y generate_precise_diffusion_prompt producen un
+conjunto pequeño y cerrado de prompts, siempre con el mismo negative_prompt.
+En vez de que el pipeline tokenice y codifique ambos textos en cada llamada,
+los embeddings se calculan una vez por texto, se memorizan en proceso y se
+persisten en disco, y se pasan al pipeline como prompt_embeds /
+negative_prompt_embeds. El embedding incondicional se calcula una sola vez.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+import torch
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "CLASH_EMBEDDINGS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "clash_cards", "embeddings")
+)
+
+
+class PromptEmbeddingCache:
+    def __init__(self, pipeline, model_id=None, cache_dir=DEFAULT_CACHE_DIR):
+        self.pipeline = pipeline
+        self.model_id = model_id or getattr(pipeline, 'name_or_path', None) or "runwayml/stable-diffusion-v1-5"
+        self.cache_dir = cache_dir
+        self._embeddings = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _key(self, text):
+        dtype = str(self.pipeline.text_encoder.dtype)
+        payload = f"{self.model_id}|{dtype}|{text}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def encode(self, text):
+        """Embedding CLIP de un texto (memoria -> disco -> text encoder)"""
+        key = self._key(text)
+        with self._lock:
+            if key in self._embeddings:
+                return self._embeddings[key]
+
+        # Con CPU offload el dispositivo de ejecución no coincide con pipeline.device
+        device = getattr(self.pipeline, '_execution_device', self.pipeline.device)
+        path = os.path.join(self.cache_dir, f"{key}.pt")
+        embeds = None
+
+        if os.path.exists(path):
+            try:
+                embeds = torch.load(path, map_location=device)
+            except Exception:
+                embeds = None
+
+        if embeds is None:
+            with torch.no_grad():
+                embeds, _ = self.pipeline.encode_prompt(
+                    text,
+                    device=device,
+                    num_images_per_prompt=1,
+                    do_classifier_free_guidance=False
+                )
+            self._persist(path, embeds)
+
+        with self._lock:
+            self._embeddings[key] = embeds
+        return embeds
+
+    def _persist(self, path, embeds):
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as tmp_file:
+                torch.save(embeds.cpu(), tmp_file)
+            os.replace(tmp_path, path)
+        except Exception:
+            # Sin disco seguimos con la memoización en proceso
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, prompt_data):
+        """Devuelve (prompt_embeds, negative_prompt_embeds) para un prompt_data"""
+        return self.encode(prompt_data['prompt']), self.encode(prompt_data['negative_prompt'])
+
+    def get_batch(self, prompt_datas):
+        """Embeddings apilados para una llamada por lotes al pipeline"""
+        pairs = [self.get(prompt_data) for prompt_data in prompt_datas]
+        prompt_embeds = torch.cat([pair[0] for pair in pairs], dim=0)
+        negative_prompt_embeds = torch.cat([pair[1] for pair in pairs], dim=0)
+        return prompt_embeds, negative_prompt_embeds
+
+    def warm(self, prompt_datas):
+        """Precalcula (o carga de disco) los embeddings de todos los prompts dados"""
+        for prompt_data in prompt_datas:
+            self.get(prompt_data)
+        return len(self._embeddings)
@@ -0,0 +1,379 @@
+"""Parser de prompts de usuario precompilado, con API por lotes.
+
+parse_user_prompt_precisely (StreamlitSecVer) ejecutaba ~20 expresiones sin
+compilar una detrás de otra y luego varias búsquedas lineales de palabras
+clave. Aquí los patrones se compilan una vez y cada prompt pasa primero por
+una búsqueda de subcadena (keyword in text, ~55) por cada palabra clave
+(personajes, tipos, elementos y las palabras obligatorias de cada patrón
+numérico). Con el conjunto de las que aparecen se resuelven personaje, tipo y
+elementos, y solo se ejecutan los patrones numéricos que pueden coincidir. La
+semántica es la original: para cada campo gana el primer patrón de la lista
+que encuentra algo y el personaje es la primera palabra clave del diccionario
+presente. La ganancia medida por prompt es modesta (unas 2 veces frente a la
+versión secuencial); la grande viene de parse_many con prompts repetidos.
+
+Se probó a compilarlo todo en una regex única (un lookahead opcional con nombre
+por patrón): con el motor re de CPython era unas 4 veces más lenta que la
+versión secuencial, así que se descartó.
+
+parse_many analiza una sola vez cada prompt distinto, que es lo habitual al
+reproducir logs. La implementación secuencial original se conserva como
+referencia para las comprobaciones de equivalencia y el micro-benchmark:
+    python prompt_parser.py
+    python prompt_parser.py --log prompts.txt
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+COST_PATTERNS = [
+    r'(?:cueste?|coste?|cost[eo]?|elixir)\s*(?:de)?\s*(\d+)',
+    r'(\d+)\s*(?:de\s*)?(?:elixir|coste?|cost[eo]?)',
+    r'(?:que\s*)?(?:cueste?|valga)\s*(\d+)',
+    r'de\s*(\d+)\s*elixir'
+]
+
+DAMAGE_PATTERNS = [
+    r'(\d+)\s*(?:de\s*)?(?:daño|damage|ataque|attack)',
+    r'(?:daño|damage|ataque|attack)\s*(?:de)?\s*(\d+)',
+    r'(?:que\s*)?(?:haga|cause|tenga)\s*(\d+)\s*(?:de\s*)?(?:daño|damage|ataque)',
+    r'con\s*(\d+)\s*(?:de\s*)?(?:daño|ataque)'
+]
+
+HEALTH_PATTERNS = [
+    r'(\d+)\s*(?:de\s*)?(?:vida|health|hp|salud|resistencia)',
+    r'(?:vida|health|hp|salud|resistencia)\s*(?:de)?\s*(\d+)',
+    r'(?:que\s*)?(?:tenga|posea)\s*(\d+)\s*(?:de\s*)?(?:vida|health|hp)',
+    r'y\s*(\d+)\s*(?:de\s*)?(?:vida|health)'
+]
+
+DURATION_PATTERNS = [
+    r'duracion\s*(?:de)?\s*(\d+)\s*(?:segundos?|segs?|s)',
+    r'dure\s*(\d+)\s*(?:segundos?|segs?|s)',
+    r'(\d+)\s*segundos?\s*(?:de\s*)?(?:duracion|efecto|tiempo)',
+    r'(?:por|durante)\s*(\d+)\s*(?:segundos?|segs?|s)',
+    r'efecto\s*(?:de)?\s*(\d+)\s*(?:segundos?|segs?|s)',
+    r'con\s*duracion\s*(?:de)?\s*(\d+)\s*(?:segundos?|segs?|s)',
+    r'que\s*dure\s*(\d+)\s*(?:segundos?|segs?|s)'
+]
+
+NUMBER_PATTERNS = {
+    'cost': COST_PATTERNS,
+    'damage': DAMAGE_PATTERNS,
+    'health': HEALTH_PATTERNS,
+    'duration': DURATION_PATTERNS,
+}
+
+# Personajes específicos con info completa (el orden importa: gana el primero que aparece)
+CHARACTERS = {
+    'golem': {'type': 'Troops and Defenses', 'base_cost': 8, 'character': 'Golem', 'base_duration': 0},
+    'gigante': {'type': 'Troops and Defenses', 'base_cost': 5, 'character': 'Gigante', 'base_duration': 0},
+    'caballero': {'type': 'Troops and Defenses', 'base_cost': 3, 'character': 'Caballero', 'base_duration': 0},
+    'arquero': {'type': 'Troops and Defenses', 'base_cost': 3, 'character': 'Arquero', 'base_duration': 0},
+    'dragon': {'type': 'Troops and Defenses', 'base_cost': 4, 'character': 'Dragón', 'base_duration': 0},
+    'mago': {'type': 'Troops and Defenses', 'base_cost': 5, 'character': 'Mago', 'base_duration': 0},
+
+    # Hechizos específicos
+    'hechizo': {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Hechizo', 'base_duration': 3},
+    'rayo': {'type': 'Damaging Spells', 'base_cost': 6, 'character': 'Rayo', 'base_duration': 1},
+    'bola de fuego': {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Bola de Fuego', 'base_duration': 2},
+    'flecha': {'type': 'Damaging Spells', 'base_cost': 3, 'character': 'Flechas', 'base_duration': 1},
+    'veneno': {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Veneno', 'base_duration': 8},
+    'ralentizar': {'type': 'Damaging Spells', 'base_cost': 2, 'character': 'Ralentizar', 'base_duration': 5},
+    'congelar': {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Congelar', 'base_duration': 4},
+
+    # Edificios
+    'torre': {'type': 'Spawners', 'base_cost': 4, 'character': 'Torre', 'base_duration': 0},
+    'cañon': {'type': 'Spawners', 'base_cost': 3, 'character': 'Cañón', 'base_duration': 0},
+    'mortero': {'type': 'Spawners', 'base_cost': 4, 'character': 'Mortero', 'base_duration': 0},
+}
+
+# Detección por tipo general cuando no hay personaje
+TYPE_FALLBACKS = [
+    (['hechizo', 'spell', 'magia', 'conjuro'],
+     {'type': 'Damaging Spells', 'base_cost': 4, 'character': 'Hechizo', 'base_duration': 3}),
+    (['edificio', 'torre', 'defensa', 'spawner'],
+     {'type': 'Spawners', 'base_cost': 4, 'character': 'Torre', 'base_duration': 0}),
+]
+DEFAULT_CHARACTER = {'type': 'Troops and Defenses', 'base_cost': 4, 'character': 'Guerrero', 'base_duration': 0}
+
+ELEMENT_KEYWORDS = [
+    ('hielo', ['hielo', 'nieve', 'congelar', 'frio']),
+    ('fuego', ['fuego', 'llama', 'quemar', 'ardiente']),
+    ('electrico', ['rayo', 'electrico', 'trueno']),
+    ('veneno', ['veneno', 'toxico']),
+]
+
+
+# ---------- Implementación secuencial original (referencia) ----------
+
+def extract_exact_numbers_from_prompt(prompt):
+    """Extrae EXACTAMENTE los números que especifica el usuario"""
+    prompt_lower = prompt.lower()
+    extracted = {'cost': None, 'damage': None, 'health': None, 'duration': None}
+
+    for field, patterns in NUMBER_PATTERNS.items():
+        for pattern in patterns:
+            match = re.search(pattern, prompt_lower)
+            if match:
+                extracted[field] = int(match.group(1))
+                break
+
+    return extracted
+
+
+def detect_character_and_type(prompt):
+    """Detecta el personaje específico y tipo de carta"""
+    prompt_lower = prompt.lower()
+
+    for keyword, info in CHARACTERS.items():
+        if keyword in prompt_lower:
+            return info
+
+    for keywords, info in TYPE_FALLBACKS:
+        if any(word in prompt_lower for word in keywords):
+            return info
+    return DEFAULT_CHARACTER
+
+
+def detect_elements(prompt):
+    """Detecta elementos mágicos específicos"""
+    prompt_lower = prompt.lower()
+    return [element for element, keywords in ELEMENT_KEYWORDS if any(word in prompt_lower for word in keywords)]
+
+
+def build_card_data(prompt, numbers, char_info, elements):
+    """Completa los valores que el usuario no especificó con los del personaje"""
+    cost = numbers['cost']
+    damage = numbers['damage']
+    health = numbers['health']
+    duration = numbers['duration']
+
+    # Solo usar valores por defecto si NO fueron especificados por el usuario
+    if cost is None:
+        cost = char_info['base_cost']
+
+    if damage is None and char_info['type'] != 'Spawners':
+        if char_info['type'] == 'Damaging Spells':
+            damage = cost * 70
+        else:
+            damage = cost * 50
+    elif damage is None:
+        damage = 0
+
+    if health is None and char_info['type'] != 'Damaging Spells':
+        if char_info['type'] == 'Spawners':
+            health = cost * 300
+        else:
+            health = cost * 150
+    elif health is None:
+        health = 0
+
+    # Duración solo para hechizos
+    if char_info['type'] == 'Damaging Spells':
+        if duration is None:
+            duration = char_info.get('base_duration', 3)
+    else:
+        duration = 0
+
+    return {
+        'Cost': cost,
+        'Damage': damage,
+        'Health (+Shield)': health,
+        'Duration': duration,
+        'Type': char_info['type'],
+        'Character': char_info['character'],
+        'Elements': elements,
+        'original_prompt': prompt
+    }
+
+
+def parse_prompt_sequential(prompt):
+    """Parser original: ~20 búsquedas de regex y varias pasadas de palabras clave"""
+    return build_card_data(
+        prompt,
+        extract_exact_numbers_from_prompt(prompt),
+        detect_character_and_type(prompt),
+        detect_elements(prompt)
+    )
+
+
+# ---------- Parser compilado ----------
+
+# Para cada patrón, palabras de las que al menos una aparece en cualquiera de sus
+# coincidencias: si el prompt no contiene ninguna, el patrón no se ejecuta
+NUMBER_TRIGGERS = {
+    'cost': [('cuest', 'cost', 'elixir'), ('elixir', 'cost'), ('cuest', 'valga'), ('elixir',)],
+    'damage': [('daño', 'damage', 'ataque', 'attack'), ('daño', 'damage', 'ataque', 'attack'),
+               ('haga', 'cause', 'tenga'), ('daño', 'ataque')],
+    'health': [('vida', 'health', 'hp', 'salud', 'resistencia'), ('vida', 'health', 'hp', 'salud', 'resistencia'),
+               ('tenga', 'posea'), ('vida', 'health')],
+    'duration': [('duracion',), ('dure',), ('segundo',), ('por', 'durante'), ('efecto',), ('duracion',), ('dure',)],
+}
+
+_DIGIT = re.compile(r'\d')
+
+
+class PromptParser:
+    def __init__(self):
+        self._numbers = []
+        keywords = []
+        for field, patterns in NUMBER_PATTERNS.items():
+            triggers = NUMBER_TRIGGERS[field]
+            assert len(triggers) == len(patterns), field
+            self._numbers.append((field, [(words, re.compile(pattern)) for words, pattern in zip(triggers, patterns)]))
+            for words in triggers:
+                keywords.extend(words)
+
+        # Cada palabra se busca una sola vez aunque aparezca en varias tablas
+        keywords.extend(CHARACTERS)
+        for fallback_keywords, _ in TYPE_FALLBACKS:
+            keywords.extend(fallback_keywords)
+        for _, element_keywords in ELEMENT_KEYWORDS:
+            keywords.extend(element_keywords)
+        self._keywords = tuple(dict.fromkeys(keywords))
+        self._characters = list(CHARACTERS.items())
+
+    def _numbers_in(self, text, present):
+        extracted = dict.fromkeys(NUMBER_PATTERNS)
+        # Sin dígitos ningún patrón puede coincidir
+        if _DIGIT.search(text) is None:
+            return extracted
+        for field, patterns in self._numbers:
+            for words, pattern in patterns:
+                if present.isdisjoint(words):
+                    continue
+                match = pattern.search(text)
+                if match:
+                    extracted[field] = int(match.group(1))
+                    break
+        return extracted
+
+    def parse(self, prompt):
+        """Mismo dict que parse_user_prompt_precisely; una búsqueda de subcadena por palabra clave"""
+        text = prompt.lower()
+        present = {keyword for keyword in self._keywords if keyword in text}
+
+        char_info = next((info for keyword, info in self._characters if keyword in present), None)
+        if char_info is None:
+            char_info = next(
+                (info for keywords, info in TYPE_FALLBACKS if not present.isdisjoint(keywords)),
+                DEFAULT_CHARACTER
+            )
+        elements = [element for element, keywords in ELEMENT_KEYWORDS if not present.isdisjoint(keywords)]
+        return build_card_data(prompt, self._numbers_in(text, present), char_info, elements)
+
+    def parse_many(self, prompts):
+        """Parsea una lista de prompts; los repetidos (logs) se analizan una sola vez"""
+        parsed = {}
+        results = []
+        for prompt in prompts:
+            result = parsed.get(prompt)
+            if result is None:
+                result = parsed[prompt] = self.parse(prompt)
+            # Copia por prompt: los llamantes modifican el dict (p. ej. añaden 'Narrative')
+            results.append(dict(result, Elements=list(result['Elements'])))
+        return results
+
+
+PROMPT_PARSER = PromptParser()
+
+
+def parse_prompt(prompt):
+    return PROMPT_PARSER.parse(prompt)
+
+
+def parse_many(prompts):
+    return PROMPT_PARSER.parse_many(prompts)
+
+
+def parse_user_prompt(prompt, rng=random):
+    """Parser simple de StreamlitApp: tipo por palabra clave y los tres primeros números como coste, daño y vida"""
+    if "hechizo" in prompt.lower() or "spell" in prompt.lower():
+        card_type = "Damaging Spells"
+    elif "edificio" in prompt.lower() or "spawner" in prompt.lower():
+        card_type = "Spawners"
+    else:
+        card_type = "Troops and Defenses"
+    numbers = [int(s) for s in re.findall(r'\d+', prompt)]
+    if len(numbers) >= 3:
+        cost, damage, health = numbers[:3]
+    else:
+        cost = rng.randint(1, 8)
+        damage = rng.randint(50, 800)
+        health = rng.randint(100, 3000)
+    return {
+        'Cost': cost,
+        'Damage': damage,
+        'Health (+Shield)': health,
+        'Type': card_type
+    }
+
+
+# ---------- Micro-benchmark ----------
+
+SAMPLE_PROMPTS = [
+    "Golem de hielo con 400 de daño y 200 de vida",
+    "Hechizo de fuego que cueste 4 elixir, cause 350 de daño y dure 4 segundos",
+    "Hechizo ralentizador que cueste 4 de elixir y haga 300 de daño",
+    "torre de veneno que tenga 1200 de vida",
+    "un dragon electrico de 5 elixir con ataque 250",
+    "bola de fuego con duracion de 3 segundos",
+    "caballero que valga 3 y tenga 900 hp",
+    "conjuro de nieve por 6 segundos",
+    "arquero",
+    "mortero con coste 6 y resistencia 2000 durante 10s",
+    "Spell de veneno toxico con 90 damage por 8 segs",
+    "una carta cualquiera sin números",
+]
+
+
+def benchmark(prompts=SAMPLE_PROMPTS, repeat=2000):
+    """Compara parser secuencial y compilado; comprueba que devuelven lo mismo"""
+    mismatches = [prompt for prompt in prompts if parse_prompt_sequential(prompt) != parse_prompt(prompt)]
+
+    timings = {}
+    for name, parse in (('secuencial', parse_prompt_sequential), ('compilado', parse_prompt)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for prompt in prompts:
+                parse(prompt)
+        timings[name] = (time.perf_counter() - start) / (repeat * len(prompts)) * 1e6
+
+    # Reproducción de un log: cada prompt aparece repeat veces
+    start = time.perf_counter()
+    parse_many(prompts * repeat)
+    timings['parse_many'] = (time.perf_counter() - start) / (repeat * len(prompts)) * 1e6
+
+    return {'us_per_prompt': timings, 'speedup': timings['secuencial'] / timings['compilado'],
+            'mismatches': mismatches}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark del parser de prompts")
+    parser.add_argument('--log', default=None, help="Fichero con un prompt por línea (por defecto, ejemplos)")
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    prompts = SAMPLE_PROMPTS
+    if args.log:
+        with open(args.log, encoding='utf-8') as f:
+            prompts = [line.rstrip('\n') for line in f if line.strip()]
+
+    report = benchmark(prompts, args.repeat)
+    for name, microseconds in report['us_per_prompt'].items():
+        print(f"{name:>12}: {microseconds:8.2f} µs/prompt")
+    print(f"Aceleración: {report['speedup']:.1f}x")
+    if report['mismatches']:
+        print(f"{len(report['mismatches'])} prompts con resultado distinto:")
+        for prompt in report['mismatches'][:10]:
+            print(f"   {prompt}")
+        return 1
+    print(f"Resultados idénticos en {len(prompts)} prompts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""Renderizado masivo de cartas desde un CSV, en paralelo y reanudable.
+
+Compone cada fila del CSV (clash_cards_narratives.csv o cualquier CSV de
+cartas) con el mismo diseño que StableDiffusionCardGenerator.create_card_composition
+de IAGenThirdPhase y la guarda como PNG. La composición y la codificación PNG se
+reparten entre procesos. Cada carta terminada se anota en un manifiesto JSONL en
+cuanto se escribe, así que una ejecución interrumpida continúa donde se quedó.
+
+Uso:
+    python render_cards.py clash_cards_narratives.csv --output cartas/
+    python render_cards.py clash_dataset_cleaned.csv --art-dir arte/ --workers 8
+    python render_cards.py clash_cards_narratives.csv --output cartas/ --force
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from card_composition import LAYOUT_VERSION
+from card_data import parse_values, split_column
+
+MANIFEST_NAME = 'manifest.jsonl'
+DEFAULT_ART_PATTERN = 'diffusion_card_{card_id:02d}.png'
+NUMERIC_DEFAULTS = {'Cost': 3, 'Damage': 100, 'Health (+Shield)': 100, 'Health': 100}
+# Atributos de cada carta que se copian al manifiesto (los usa texture_atlas.py)
+MANIFEST_ATTRIBUTES = ('Cost', 'Damage', 'Health (+Shield)', 'Health', 'Type', 'Duration')
+
+
+def load_render_cards(csv_path):
+    """Lee el CSV y normaliza las columnas numéricas que usa la composición (enteros, con valores por defecto)"""
+    cards = pd.read_csv(csv_path)
+    for column, default in NUMERIC_DEFAULTS.items():
+        if column in cards.columns:
+            # "1,408" -> 1408, "35-704" -> 35; vacíos -> valor por defecto
+            values = split_column(parse_values(cards[column]), column)[column]
+            cards[column] = values.fillna(default).astype(int)
+    if 'Type' in cards.columns:
+        cards['Type'] = cards['Type'].fillna('Troops and Defenses')
+    if 'Narrative' in cards.columns:
+        cards['Narrative'] = cards['Narrative'].fillna('')
+    return cards
+
+
+def load_manifest(manifest_path):
+    """Entradas ya renderizadas por card_id (la última gana)"""
+    entries = {}
+    if not os.path.exists(manifest_path):
+        return entries
+    with open(manifest_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Línea a medias de una ejecución interrumpida
+                continue
+            entries[entry['card_id']] = entry
+    return entries
+
+
+def task_hash(card_data, art_path):
+    """Huella de las entradas de una carta: datos de la fila, fichero de arte y versión del diseño"""
+    payload = {'card': card_data, 'art': None, 'layout': LAYOUT_VERSION}
+    if art_path and os.path.exists(art_path):
+        stat = os.stat(art_path)
+        payload['art'] = [os.path.abspath(art_path), stat.st_size, stat.st_mtime_ns]
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def render_card(task):
+    """Trabajo de un proceso: compone una carta y la guarda como PNG"""
+    from PIL import Image
+    from card_composition import compose_classic_card
+
+    start = time.perf_counter()
+    image = None
+    if task['art_path'] and os.path.exists(task['art_path']):
+        with Image.open(task['art_path']) as art:
+            image = art.convert('RGB')
+
+    card = compose_classic_card(image, task['card_data'], task['card_name'], health_key=task['health_key'])
+
+    # Escritura atómica: un PNG a medias nunca queda con el nombre final
+    tmp_path = task['output_path'] + '.tmp'
+    card.save(tmp_path, format='PNG')
+    os.replace(tmp_path, task['output_path'])
+
+    return {
+        'card_id': task['card_id'],
+        'card_name': task['card_name'],
+        'file': os.path.basename(task['output_path']),
+        'art': os.path.basename(task['art_path']) if image is not None else None,
+        'attributes': {key: task['card_data'][key] for key in MANIFEST_ATTRIBUTES if key in task['card_data']},
+        'input_hash': task['input_hash'],
+        'seconds': round(time.perf_counter() - start, 4),
+    }
+
+
+def build_tasks(cards, output_dir, art_dir=None, art_pattern=DEFAULT_ART_PATTERN):
+    """Una tarea por fila; card_id empieza en 1 como en IAGenThirdPhase"""
+    health_key = 'Health (+Shield)' if 'Health (+Shield)' in cards.columns else 'Health'
+    tasks = []
+    for i, card in enumerate(cards.to_dict(orient='records')):
+        card_id = i + 1
+        card_name = str(card['Card']) if 'Card' in card and pd.notna(card['Card']) else f"CARTA IA #{card_id:02d}"
+        art_path = os.path.join(art_dir, art_pattern.format(**{**card, 'card_id': card_id})) if art_dir else None
+        tasks.append({
+            'card_id': card_id,
+            'card_name': card_name,
+            'card_data': card,
+            'health_key': health_key,
+            'art_path': art_path,
+            'output_path': os.path.join(output_dir, f'final_card_{card_id:02d}.png'),
+            'input_hash': task_hash(card, art_path),
+        })
+    return tasks
+
+
+def render_cards(csv_path, output_dir, art_dir=None, art_pattern=DEFAULT_ART_PATTERN, workers=None,
+                 force=False, max_in_flight=None):
+    """Renderiza todas las cartas pendientes del CSV y devuelve (renderizadas, omitidas, fallidas)"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+
+    cards = load_render_cards(csv_path)
+    tasks = build_tasks(cards, output_dir, art_dir, art_pattern)
+
+    # Reanudación: se omiten las cartas con el mismo input_hash y el PNG en disco
+    done = {} if force else load_manifest(manifest_path)
+    pending = [
+        task for task in tasks
+        if not (task['card_id'] in done
+                and done[task['card_id']]['input_hash'] == task['input_hash']
+                and os.path.exists(task['output_path']))
+    ]
+    skipped = len(tasks) - len(pending)
+    print(f"{len(tasks)} cartas en {csv_path}: {skipped} ya renderizadas, {len(pending)} pendientes")
+
+    workers = workers or os.cpu_count() or 1
+    # Tareas en vuelo acotadas: la memoria no crece con el tamaño del catálogo
+    max_in_flight = max_in_flight or workers * 4
+    rendered = failed = 0
+    start = time.perf_counter()
+
+    with open(manifest_path, 'w' if force else 'a', encoding='utf-8') as manifest, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(pending)
+        in_flight = {}
+
+        def submit_next():
+            task = next(remaining, None)
+            if task is not None:
+                in_flight[executor.submit(render_card, task)] = task
+            return task is not None
+
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = in_flight.pop(future)
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Error en la carta #{task['card_id']}: {e}", file=sys.stderr)
+                else:
+                    manifest.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+                    manifest.flush()
+                    rendered += 1
+                submit_next()
+
+    elapsed = time.perf_counter() - start
+    print(f"Renderizadas {rendered} cartas en {elapsed:.1f}s con {workers} procesos ({failed} errores)")
+    return rendered, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renderiza en paralelo las cartas de un CSV")
+    parser.add_argument('csv', help="CSV de cartas (p. ej. clash_cards_narratives.csv)")
+    parser.add_argument('--output', default='cartas_renderizadas', help="Directorio de salida de los PNG y el manifiesto")
+    parser.add_argument('--art-dir', default=None, help="Directorio con las ilustraciones ya generadas (sin él, hueco vacío)")
+    parser.add_argument('--art-pattern', default=DEFAULT_ART_PATTERN,
+                        help="Nombre de la ilustración de cada carta; admite {card_id} y las columnas del CSV")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos (por defecto, todos los núcleos)")
+    parser.add_argument('--force', action='store_true', help="Vuelve a renderizar todo aunque el manifiesto lo dé por hecho")
+    args = parser.parse_args(argv)
+
+    _, _, failed = render_cards(
+        args.csv, args.output,
+        art_dir=args.art_dir, art_pattern=args.art_pattern,
+        workers=args.workers, force=args.force
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
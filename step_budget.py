@@ -0,0 +1,199 @@
+"""Modo de presupuesto de latencia para la difusión.
+
+En lugar de fijar num_inference_steps según el coste de la carta, el llamante
+pasa un presupuesto en segundos y se eligen los pasos (y el orden del solver
+DPM-Solver++) a partir de los tiempos por paso medidos en esta máquina. Los
+tiempos se guardan en disco por host, dispositivo, perfil y resolución, y se
+actualizan con una media móvil tras cada generación. Si el presupuesto no da
+para una imagen completa se genera un borrador con pocos pasos.
+
+Mientras no hay tiempos medidos para esta clave se planifica con valores por
+defecto conservadores (DEFAULT_SECONDS_PER_STEP). La primera medición es la
+propia generación: el trabajo la registra con StepTimer en el hilo que ya
+ejecuta el pipeline, así que la app nunca lanza una difusión de medida en el
+hilo de Streamlit mientras el trabajador usa el mismo pipeline y scheduler.
+"""
+import json
+import math
+import os
+import socket
+import tempfile
+import threading
+import time
+
+TIMINGS_PATH = os.environ.get(
+    "CLASH_STEP_TIMINGS_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "clash_cards", "step_timings.json")
+)
+# Presupuesto por defecto en segundos (0 = sin presupuesto, pasos fijos)
+DEFAULT_LATENCY_BUDGET = float(os.environ.get("CLASH_LATENCY_BUDGET", 0))
+# Peso de la última medición en la media móvil
+EMA_ALPHA = 0.3
+# Estimación conservadora sin mediciones: segundos por paso a 512x512 y coste fijo (texto + VAE)
+DEFAULT_SECONDS_PER_STEP = {'cuda': 0.25, 'cpu': 4.0}
+DEFAULT_OVERHEAD_SECONDS = {'cuda': 1.0, 'cpu': 8.0}
+
+
+def timing_key(pipeline, width, height):
+    """Clave de los tiempos: host, dispositivo, perfil de inferencia y resolución"""
+    profile_report = getattr(pipeline, 'inference_profile', None)
+    profile = profile_report['profile'] if profile_report else 'default'
+    device = getattr(pipeline, '_execution_device', getattr(pipeline, 'device', 'cpu'))
+    return f"{socket.gethostname()}|{device}|{profile}|{width}x{height}"
+
+
+def apply_solver_order(pipeline, solver_order):
+    """Cambia el orden de DPM-Solver++ del scheduler (se aplica en el próximo set_timesteps)"""
+    scheduler = pipeline.scheduler
+    if 'solver_order' in scheduler.config and scheduler.config.solver_order != solver_order:
+        scheduler.register_to_config(solver_order=solver_order)
+
+
+class StepTimingStore:
+    def __init__(self, path=TIMINGS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._timings = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                self._timings = json.load(f)
+        except (OSError, ValueError):
+            self._timings = {}
+
+    def get(self, key):
+        with self._lock:
+            return self._timings.get(key)
+
+    def record(self, key, step_seconds, total_seconds):
+        """Actualiza segundos por paso y coste fijo (texto + VAE) con una generación medida"""
+        if not step_seconds:
+            return
+        # El primer paso incluye el arranque del pipeline, se descarta si hay más
+        steady = step_seconds[1:] or step_seconds
+        seconds_per_step = sum(steady) / len(steady)
+        overhead_seconds = max(total_seconds - seconds_per_step * len(step_seconds), 0.0)
+
+        with self._lock:
+            stats = self._timings.get(key)
+            if stats is None:
+                stats = {'seconds_per_step': seconds_per_step, 'overhead_seconds': overhead_seconds, 'samples': 0}
+            else:
+                stats['seconds_per_step'] += EMA_ALPHA * (seconds_per_step - stats['seconds_per_step'])
+                stats['overhead_seconds'] += EMA_ALPHA * (overhead_seconds - stats['overhead_seconds'])
+            stats['samples'] += 1
+            self._timings[key] = stats
+            self._save()
+
+    def _save(self):
+        tmp_path = None
+        try:
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+                json.dump(self._timings, tmp_file, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # Sin disco los tiempos siguen en memoria
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class StepTimer:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.started_at = None
+        self.timestamps = []
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.timestamps = []
+
+    def __call__(self, pipeline, step, timestep, callback_kwargs):
+        """Callback para callback_on_step_end: anota el instante de cada paso"""
+        self.timestamps.append(time.perf_counter())
+        if self.callback is not None:
+            return self.callback(pipeline, step, timestep, callback_kwargs)
+        return callback_kwargs
+
+    def step_seconds(self):
+        if self.started_at is None:
+            return []
+        return [end - begin for begin, end in zip([self.started_at] + self.timestamps[:-1], self.timestamps)]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+
+class StepBudgetPlanner:
+    def __init__(self, store=None, target_steps=30, min_steps=14, draft_steps=8, min_draft_steps=4,
+                 solver_order=2, draft_solver_order=1):
+        self.store = store or StepTimingStore()
+        self.target_steps = target_steps
+        self.min_steps = min_steps
+        self.draft_steps = draft_steps
+        self.min_draft_steps = min_draft_steps
+        self.solver_order = solver_order
+        self.draft_solver_order = draft_solver_order
+
+    def estimate(self, pipeline, width, height, measure=False):
+        """Segundos por paso y coste fijo para esta máquina; sin datos, valores conservadores"""
+        stats = self.store.get(timing_key(pipeline, width, height))
+        if stats is not None:
+            return stats
+        # Medir lanza una difusión: solo desde un único hilo (notebook), nunca con un trabajo en marcha
+        if measure:
+            return self.measure(pipeline, width, height)
+
+        device = 'cuda' if 'cuda' in str(getattr(pipeline, '_execution_device', getattr(pipeline, 'device', 'cpu'))) \
+            else 'cpu'
+        profile_report = getattr(pipeline, 'inference_profile', None) or {}
+        seconds_per_step = profile_report.get('seconds_per_step_after')
+        if seconds_per_step is None:
+            seconds_per_step = DEFAULT_SECONDS_PER_STEP[device] * width * height / (512 * 512)
+        return {'seconds_per_step': seconds_per_step, 'overhead_seconds': DEFAULT_OVERHEAD_SECONDS[device],
+                'samples': 0}
+
+    def measure(self, pipeline, width, height, num_inference_steps=3):
+        """Generación corta (texto, pasos y VAE) registrada bajo su timing_key; devuelve los tiempos guardados"""
+        import torch
+        from inference_profiles import inference_context
+
+        timer = StepTimer()
+        timer.start()
+        with torch.inference_mode(), inference_context(getattr(pipeline, 'inference_profile', None)):
+            pipeline(prompt="warm-up", num_inference_steps=num_inference_steps, width=width, height=height,
+                     callback_on_step_end=timer)
+        self.record(pipeline, {'width': width, 'height': height}, timer)
+        return self.store.get(timing_key(pipeline, width, height))
+
+    def plan(self, pipeline, generation_params, budget_seconds, measure=False):
+        """Devuelve generation_params con los pasos y el orden del solver que caben en el presupuesto"""
+        params = dict(generation_params)
+        if not budget_seconds:
+            return params
+
+        stats = self.estimate(pipeline, params['width'], params['height'], measure=measure)
+        available = budget_seconds - stats['overhead_seconds']
+        affordable = max(int(math.floor(available / stats['seconds_per_step'])), 0)
+
+        # Mismo objetivo de pasos para todas las cartas: el coste no alarga la espera
+        if affordable >= self.min_steps:
+            steps = min(affordable, self.target_steps)
+            solver_order = self.solver_order
+            draft = False
+        else:
+            steps = max(self.min_draft_steps, min(affordable, self.draft_steps))
+            solver_order = self.draft_solver_order
+            draft = True
+
+        params.update({
+            'num_inference_steps': steps,
+            'solver_order': solver_order,
+            'draft': draft,
+        })
+        return params
+
+    def record(self, pipeline, params, timer):
+        """Registra los tiempos de una generación terminada"""
+        self.store.record(timing_key(pipeline, params['width'], params['height']), timer.step_seconds(), timer.elapsed())
@@ -0,0 +1,106 @@
+"""Maquetación de texto en tiempo lineal para las cartas.
+
+Antes el ajuste de línea medía con draw.textbbox la línea entera cada vez que
+se añadía una palabra (O(palabras²) mediciones) o cortaba a 45 caracteres sin
+mirar el ancho real de la fuente. Aquí cada palabra (y el espacio) se mide una
+sola vez por fuente y se guarda; el ajuste es voraz y lineal sumando anchos, y
+admite límite de líneas con puntos suspensivos.
+"""
+import threading
+
+# Máximo de palabras memorizadas por fuente
+MAX_CACHED_WORDS = 50000
+
+
+class WordWidthCache:
+    def __init__(self, font):
+        # Se guarda la fuente: mantiene vivo el objeto y su id sigue siendo único
+        self.font = font
+        self._widths = {}
+        self.space_width = self.width(" ")
+
+    def width(self, word):
+        """Ancho en píxeles de una palabra, medido una sola vez"""
+        word_width = self._widths.get(word)
+        if word_width is None:
+            if len(self._widths) >= MAX_CACHED_WORDS:
+                self._widths.clear()
+            word_width = self.font.getlength(word)
+            self._widths[word] = word_width
+        return word_width
+
+
+_width_caches = {}
+_lock = threading.Lock()
+
+
+def width_cache(font):
+    """Caché de anchos de la fuente (una por fuente y proceso)"""
+    path = getattr(font, 'path', None)
+    key = (path, font.size) if path else id(font)
+    with _lock:
+        cache = _width_caches.get(key)
+        if cache is None:
+            cache = WordWidthCache(font)
+            _width_caches[key] = cache
+    return cache
+
+
+def fit_text(text, font, max_width, ellipsis="...", force_ellipsis=False):
+    """Recorta text con puntos suspensivos para que quepa en max_width"""
+    if not force_ellipsis and font.getlength(text) <= max_width:
+        return text
+    if force_ellipsis and font.getlength(text + ellipsis) <= max_width:
+        return text + ellipsis
+
+    # Búsqueda binaria del prefijo más largo que cabe con los puntos suspensivos
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if font.getlength(text[:middle].rstrip() + ellipsis) <= max_width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + ellipsis
+
+
+def wrap_text(text, font, max_width, max_lines=None, ellipsis="..."):
+    """Ajuste voraz de líneas a max_width píxeles; si sobran líneas la última acaba en ellipsis"""
+    widths = width_cache(font)
+    lines = []
+    current = []
+    current_width = 0.0
+    truncated = False
+
+    for word in text.split():
+        word_width = widths.width(word)
+        if current and current_width + widths.space_width + word_width <= max_width:
+            current.append(word)
+            current_width += widths.space_width + word_width
+            continue
+
+        if current:
+            lines.append(' '.join(current))
+            if max_lines and len(lines) >= max_lines:
+                truncated = True
+                break
+
+        # Una palabra más ancha que la línea se recorta
+        if word_width > max_width:
+            word = fit_text(word, font, max_width, ellipsis)
+            word_width = font.getlength(word)
+        current = [word]
+        current_width = word_width
+    else:
+        if current:
+            lines.append(' '.join(current))
+
+    if truncated:
+        lines[-1] = fit_text(lines[-1], font, max_width, ellipsis, force_ellipsis=True)
+    return lines
+
+
+def draw_lines(draw, lines, x, y, font, fill, line_height):
+    """Dibuja las líneas ya maquetadas una debajo de otra"""
+    for i, line in enumerate(lines):
+        draw.text((x, y + i * line_height), line, fill=fill, font=font)
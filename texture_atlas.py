@@ -0,0 +1,212 @@
+"""Exportación de las cartas compuestas a atlas de texturas.
+
+Cada ejecución deja un PNG por carta (final_card_NN.png, ~250 KB) y el cliente
+del juego los carga uno a uno. Este módulo empaqueta las cartas de un
+directorio de render_cards.py en hojas WebP/PNG de rejilla uniforme, a una o
+varias resoluciones, y escribe atlas.json con los rectángulos UV de cada carta,
+sus atributos y el hash de su contenido.
+
+Las cartas conservan su celda entre ejecuciones: solo se vuelven a componer y
+codificar las páginas en las que alguna carta ha cambiado, se ha añadido o se
+ha eliminado. Las páginas sucias se rehacen desde los PNG originales, así que
+WebP con pérdida no acumula degradación.
+
+Uso:
+    python texture_atlas.py cartas/ --output atlas/ --sizes 300x400 150x200
+    python texture_atlas.py cartas/ --output atlas/ --format png
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from PIL import Image
+
+from render_cards import MANIFEST_NAME, load_manifest
+
+ATLAS_MANIFEST = 'atlas.json'
+ATLAS_VERSION = 1
+DEFAULT_SIZES = ((300, 400),)
+DEFAULT_PAGE_SIZE = 4096
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_size(text):
+    """'300x400' -> (300, 400)"""
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def grid_layout(cell_size, page_size=DEFAULT_PAGE_SIZE):
+    """Columnas y filas de celdas que caben en una página"""
+    cell_width, cell_height = cell_size
+    columns = max(1, page_size // cell_width)
+    rows = max(1, page_size // cell_height)
+    return columns, rows
+
+
+def _page_file(size_key, page, image_format):
+    return f"atlas_{size_key}_{page:03d}.{image_format}"
+
+
+def _assign_slots(card_ids, previous_slots):
+    """Mantiene la celda de las cartas que siguen; las nuevas ocupan los huecos libres más bajos"""
+    slots = {card_id: previous_slots[card_id] for card_id in card_ids if card_id in previous_slots}
+    used = set(slots.values())
+    free_slot = 0
+    for card_id in card_ids:
+        if card_id in slots:
+            continue
+        while free_slot in used:
+            free_slot += 1
+        slots[card_id] = free_slot
+        used.add(free_slot)
+    return slots
+
+
+def build_atlases(cards_dir, output_dir, sizes=DEFAULT_SIZES, image_format='webp', quality=90,
+                  page_size=DEFAULT_PAGE_SIZE):
+    """Empaqueta las cartas de cards_dir en atlas y devuelve el manifiesto escrito"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, ATLAS_MANIFEST)
+    size_keys = [f"{width}x{height}" for width, height in sizes]
+
+    # Cartas renderizadas (último estado de cada card_id) y hash de su PNG
+    cards = {}
+    for card_id, entry in sorted(load_manifest(os.path.join(cards_dir, MANIFEST_NAME)).items()):
+        path = os.path.join(cards_dir, entry['file'])
+        if os.path.exists(path):
+            cards[str(card_id)] = {'entry': entry, 'path': path, 'hash': file_hash(path)}
+
+    previous = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)
+    settings = {'version': ATLAS_VERSION, 'format': image_format, 'quality': quality,
+                'page_size': page_size, 'sizes': size_keys}
+    if previous and previous.get('settings') != settings:
+        # Otros ajustes: se reconstruye todo
+        previous = None
+    previous_cards = previous['cards'] if previous else {}
+
+    slots = _assign_slots(list(cards), {card_id: card['slot'] for card_id, card in previous_cards.items()})
+
+    # Celdas sucias: cartas nuevas o con otro contenido y huecos que han quedado libres
+    dirty_slots = {
+        slots[card_id] for card_id, card in cards.items()
+        if previous_cards.get(card_id, {}).get('hash') != card['hash']
+        or previous_cards[card_id]['slot'] != slots[card_id]
+    }
+    dirty_slots |= {card['slot'] for card_id, card in previous_cards.items() if card_id not in cards}
+
+    slot_to_card = {slot: card_id for card_id, slot in slots.items()}
+    total_slots = max(slots.values()) + 1 if slots else 0
+
+    resolutions = {}
+    rewritten = 0
+    for size, size_key in zip(sizes, size_keys):
+        columns, rows = grid_layout(size, page_size)
+        capacity = columns * rows
+        page_count = (total_slots + capacity - 1) // capacity
+        page_dimensions = (columns * size[0], rows * size[1])
+
+        dirty_pages = {slot // capacity for slot in dirty_slots}
+        dirty_pages |= {
+            page for page in range(page_count)
+            if not os.path.exists(os.path.join(output_dir, _page_file(size_key, page, image_format)))
+        }
+
+        pages = []
+        for page in range(page_count):
+            page_path = os.path.join(output_dir, _page_file(size_key, page, image_format))
+            if page in dirty_pages:
+                # Página por página: memoria acotada a una hoja
+                sheet = Image.new('RGB', page_dimensions, color='#000000')
+                for slot in range(page * capacity, min((page + 1) * capacity, total_slots)):
+                    card_id = slot_to_card.get(slot)
+                    if card_id is None:
+                        continue
+                    position = slot % capacity
+                    with Image.open(cards[card_id]['path']) as card_image:
+                        thumbnail = card_image.convert('RGB').resize(size, Image.Resampling.LANCZOS)
+                    sheet.paste(thumbnail, ((position % columns) * size[0], (position // columns) * size[1]))
+                save_kwargs = {'quality': quality, 'method': 4} if image_format == 'webp' else {'optimize': True}
+                tmp_path = page_path + '.tmp'
+                sheet.save(tmp_path, format=image_format.upper(), **save_kwargs)
+                os.replace(tmp_path, page_path)
+                rewritten += 1
+            pages.append({'file': os.path.basename(page_path), 'size': list(page_dimensions)})
+
+        # Páginas sobrantes de ejecuciones anteriores con más cartas
+        stale_page = page_count
+        while os.path.exists(os.path.join(output_dir, _page_file(size_key, stale_page, image_format))):
+            os.remove(os.path.join(output_dir, _page_file(size_key, stale_page, image_format)))
+            stale_page += 1
+
+        resolutions[size_key] = {'cell': list(size), 'columns': columns, 'rows': rows,
+                                 'capacity': capacity, 'pages': pages}
+
+    # UV normalizados con origen arriba a la izquierda
+    manifest_cards = {}
+    for card_id, card in cards.items():
+        slot = slots[card_id]
+        uv = {}
+        for size_key, resolution in resolutions.items():
+            cell_width, cell_height = resolution['cell']
+            page = slot // resolution['capacity']
+            position = slot % resolution['capacity']
+            x = (position % resolution['columns']) * cell_width
+            y = (position // resolution['columns']) * cell_height
+            page_width, page_height = resolution['pages'][page]['size']
+            uv[size_key] = {
+                'page': page,
+                'pixels': [x, y, cell_width, cell_height],
+                'rect': [x / page_width, y / page_height, (x + cell_width) / page_width, (y + cell_height) / page_height],
+            }
+        manifest_cards[card_id] = {
+            'name': card['entry'].get('card_name'),
+            'attributes': card['entry'].get('attributes', {}),
+            'hash': card['hash'],
+            'slot': slot,
+            'uv': uv,
+        }
+
+    manifest = {'settings': settings, 'resolutions': resolutions, 'cards': manifest_cards}
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"{len(cards)} cartas en atlas ({', '.join(size_keys)}): {rewritten} páginas reescritas")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Empaqueta las cartas renderizadas en atlas de texturas")
+    parser.add_argument('cards_dir', help="Directorio de salida de render_cards.py (con manifest.jsonl)")
+    parser.add_argument('--output', default='atlas', help="Directorio de las hojas y atlas.json")
+    parser.add_argument('--sizes', nargs='+', default=[f"{w}x{h}" for w, h in DEFAULT_SIZES],
+                        help="Resoluciones de celda, p. ej. 300x400 150x200")
+    parser.add_argument('--format', choices=('webp', 'png'), default='webp', help="Formato de las hojas")
+    parser.add_argument('--quality', type=int, default=90, help="Calidad WebP")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help="Lado máximo de una hoja en píxeles")
+    args = parser.parse_args(argv)
+
+    build_atlases(
+        args.cards_dir, args.output,
+        sizes=[parse_size(size) for size in args.sizes],
+        image_format=args.format, quality=args.quality, page_size=args.page_size
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
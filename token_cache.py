@@ -0,0 +1,151 @@
+"""Datos de fine-tuning de GPT-2 tokenizados una sola vez y cacheados en disco.
+
+ClashRoyaleDataset (IAGenSecondPhase) llamaba al tokenizador en cada
+__getitem__, en cada época, con padding='max_length' a 128: las descripciones
+cortas pagaban una secuencia entera de 128 tokens. Aquí el corpus se tokeniza
+una vez y se guarda como un único array plano de tokens más sus offsets, en
+ficheros .npy que se abren como memmap. La clave de la caché es el hash de los
+textos, de max_length y del vocabulario del tokenizador.
+
+Para entrenar:
+  - PretokenizedDataset devuelve cada ejemplo sin relleno (o, con pack=True,
+    bloques de varios ejemplos consecutivos de hasta max_length tokens).
+  - DynamicPaddingCollator rellena cada lote solo hasta su secuencia más
+    larga y pone -100 en las etiquetas del relleno.
+  - Con group_by_length=True en TrainingArguments, el Trainer agrupa en cada
+    lote ejemplos de longitud parecida. Con un Dataset de torch no lee la
+    propiedad lengths: su LengthGroupedSampler indexa cada ejemplo una vez al
+    crearse, que aquí es un corte del memmap sin tokenizar. lengths sirve para
+    construir ese sampler a mano, LengthGroupedSampler(batch, lengths=...).
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "CLASH_TOKEN_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "clash_cards", "tokens")
+)
+TOKENIZE_BATCH_SIZE = 1024
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash del vocabulario y los tokens especiales (cambia si se añade <|pad|>)"""
+    digest = hashlib.sha256(type(tokenizer).__name__.encode('utf-8'))
+    for token, token_id in sorted(tokenizer.get_vocab().items(), key=lambda item: item[1]):
+        digest.update(f"{token_id}\x00{token}\x01".encode('utf-8'))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def corpus_key(texts, tokenizer, max_length):
+    digest = hashlib.sha256(f"{tokenizer_fingerprint(tokenizer)}|{max_length}|{len(texts)}".encode('utf-8'))
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def _save_array(path, array):
+    # Escritura atómica; np.save a un fichero abierto no añade la extensión .npy
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_or_tokenize(texts, tokenizer, max_length=128, cache_dir=DEFAULT_CACHE_DIR):
+    """(tokens, offsets) del corpus: tokens es un memmap int32 plano y el ejemplo i es tokens[offsets[i]:offsets[i+1]]"""
+    texts = [str(text) for text in texts]
+    key = corpus_key(texts, tokenizer, max_length)
+    directory = os.path.join(cache_dir, key)
+    tokens_path = os.path.join(directory, 'tokens.npy')
+    offsets_path = os.path.join(directory, 'offsets.npy')
+
+    if not (os.path.exists(tokens_path) and os.path.exists(offsets_path)):
+        os.makedirs(directory, exist_ok=True)
+        chunks = []
+        lengths = []
+        for start in range(0, len(texts), TOKENIZE_BATCH_SIZE):
+            encoded = tokenizer(texts[start:start + TOKENIZE_BATCH_SIZE], truncation=True, max_length=max_length)
+            for ids in encoded['input_ids']:
+                chunks.append(np.asarray(ids, dtype=np.int32))
+                lengths.append(len(ids))
+        tokens = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Los offsets se escriben al final: sin ellos la entrada no cuenta como completa
+        _save_array(tokens_path, tokens)
+        _save_array(offsets_path, offsets)
+
+    return np.load(tokens_path, mmap_mode='r'), np.load(offsets_path)
+
+
+def pack_spans(offsets, max_length):
+    """Agrupa ejemplos consecutivos en bloques de hasta max_length tokens; devuelve (inicio, fin) en tokens"""
+    spans = []
+    if len(offsets) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    block_start = offsets[0]
+    for example_start, example_end in zip(offsets[:-1], offsets[1:]):
+        # Cada ejemplo ya viene truncado a max_length: si no cabe en el bloque en curso, abre otro
+        if example_end - block_start > max_length:
+            spans.append((block_start, example_start))
+            block_start = example_start
+    spans.append((block_start, offsets[-1]))
+    return np.asarray(spans, dtype=np.int64)
+
+
+class PretokenizedDataset(Dataset):
+    def __init__(self, texts, tokenizer, max_length=128, cache_dir=DEFAULT_CACHE_DIR, pack=False):
+        self.max_length = max_length
+        self.tokens, self.offsets = load_or_tokenize(texts, tokenizer, max_length, cache_dir)
+        if pack:
+            self.spans = pack_spans(self.offsets, max_length)
+        else:
+            self.spans = np.stack([self.offsets[:-1], self.offsets[1:]], axis=1)
+
+    @property
+    def lengths(self):
+        """Longitud en tokens de cada elemento, sin indexar el dataset (LengthGroupedSampler(lengths=...))"""
+        return [int(end - start) for start, end in self.spans]
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __getitem__(self, idx):
+        start, end = self.spans[idx]
+        input_ids = torch.from_numpy(np.array(self.tokens[start:end], dtype=np.int64))
+        return {'input_ids': input_ids}
+
+
+class DynamicPaddingCollator:
+    def __init__(self, pad_token_id, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        """Rellena el lote hasta su secuencia más larga; el relleno no cuenta en la pérdida"""
+        length = max(len(feature['input_ids']) for feature in features)
+        if self.pad_to_multiple_of:
+            length = -(-length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = torch.full((len(features), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), length), dtype=torch.long)
+        labels = torch.full((len(features), length), -100, dtype=torch.long)
+        for i, feature in enumerate(features):
+            ids = feature['input_ids']
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+            labels[i, :len(ids)] = ids
+        return {'input_ids': input_ids, 'attention_mask': attention_mask, 'labels': labels}